@@ -0,0 +1,182 @@
+############################################
+# Stylesheets, loose html files and the cover image of a book:
+# each file is read once (in a pool of threads, while the chapters are being converted)
+# and each stylesheet is added to the epub once, however many files use it
+#
+import os, re, io, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from ebooklib import epub
+
+#strings and comments have to be found first so that what is inside them is left alone
+CSS_TOKEN_REGEX = re.compile('("(?:[^"\\\\]|\\\\.)*"|\'(?:[^\'\\\\]|\\\\.)*\')|/\\*.*?\\*/|\\s+', re.S)
+CSS_SPACE_REGEX = re.compile('\\s*([{};,>])\\s*|(:)\\s+')
+THREADS = 8
+
+def safe_read_file(f):
+    """
+    Safe file open operation that returns the whole file as a string
+    Used for opening css files, because most of the rest of the time we do want the program
+    to break if a file can't be opened
+    returns an empty string if it fails and also prints error message to screen.
+    """
+    if(f is None):
+        #print('No file given')
+        return ''
+    try:
+        data = ''
+        with open(f, 'r') as open_f:
+            data = open_f.read()
+        return data
+    except IOError as e:
+        print("Couldn't open file: " + f)
+        return ''
+
+def read_binary_file(f):
+    with open(f, 'rb') as open_f:
+        return open_f.read()
+
+def minify_css(css):
+    """
+    Removes comments and the spaces that don't change anything (strings are kept as they are)
+    """
+    segments = []
+    plain = []
+    last = 0
+    for match in CSS_TOKEN_REGEX.finditer(css):
+        plain.append(css[last:match.start()])
+        if(match.group(1)):
+            segments.append(squeeze_css(''.join(plain)))
+            segments.append(match.group(1))
+            plain = []
+        else:
+            #a comment could be all that separates two words
+            plain.append(' ')
+        last = match.end()
+    plain.append(css[last:])
+    segments.append(squeeze_css(''.join(plain)))
+    return ''.join(segments).strip()
+
+def squeeze_css(css):
+    """
+    Removes the spaces around punctuation and the last ; of every block (css has no strings or comments)
+    """
+    return CSS_SPACE_REGEX.sub('\\1\\2', css).replace(';}', '}')
+
+def downscale_image(data, max_size):
+    """
+    Makes the image smaller if its longest side is more than max_size pixels, returns the bytes of the image
+    Needs Pillow, without it the image is returned as it is
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        print('Pillow is not installed, images are not downscaled')
+        return data
+    image = Image.open(io.BytesIO(data))
+    if(max(image.size) <= max_size):
+        return data
+    image_format = image.format
+    image.thumbnail((max_size, max_size))
+    output = io.BytesIO()
+    if(image_format == 'JPEG'):
+        image.save(output, image_format, quality=85, optimize=True)
+    else:
+        image.save(output, image_format, optimize=True)
+    if(output.tell() >= len(data)):
+        return data
+    return output.getvalue()
+
+class AssetRegistry(object):
+    """
+    Reads the files the book needs besides the chapters, each one once
+    load starts reading them in a pool of threads, the other methods wait for the files they need
+    Stylesheets added with add_stylesheet are kept by content: a stylesheet with the same content as one that
+    was already added is not added again, its link points to the first one instead. Their uids and file names are
+    the file name of the stylesheet (with part of the content hash added if another stylesheet already has that name),
+    so they are the same in every build
+    reserved_names are file names in style/ that are used by other stylesheets of the book
+    defined_stylesheet finds where a stylesheet named by its file name (defined_css) ended up
+    If minify is True, stylesheets are minified, if max_image_size is given, images bigger than that
+    (in pixels, the longest side) are downscaled
+    """
+    def __init__(self, in_base, minify=False, max_image_size=None, reserved_names=()):
+        self.in_base = in_base
+        self.minify = minify
+        self.max_image_size = max_image_size
+        self.pool = ThreadPoolExecutor(max_workers=THREADS)
+        self.files = {} #(path, binary): future of the content
+        self.stylesheets = {} #content hash: file name of the stylesheet in the epub
+        self.names = set(reserved_names)
+        self.hrefs = {} #file name of an added stylesheet: its file name in the epub
+
+    def load(self, paths, binary=False):
+        """
+        Starts reading the files (paths relative to the data file, None is skipped)
+        binary files are images, see image
+        """
+        for path in paths:
+            if(path is None or (path, binary) in self.files):
+                continue
+            read = self.read_image if binary else safe_read_file
+            self.files[(path, binary)] = self.pool.submit(read, self.in_base(path))
+
+    def read_image(self, f):
+        data = read_binary_file(f)
+        if(self.max_image_size):
+            data = downscale_image(data, self.max_image_size)
+        return data
+
+    def text(self, path):
+        """
+        The content of a text file, an empty string if path is None or the file can't be read
+        """
+        if(path is None):
+            return ''
+        self.load([path])
+        return self.files[(path, False)].result()
+
+    def style(self, path):
+        """
+        The content of a stylesheet, minified if asked for
+        """
+        css = self.text(path)
+        if(self.minify and css):
+            css = minify_css(css)
+        return css
+
+    def image(self, path):
+        """
+        The bytes of an image, downscaled if asked for (raises an error if the file can't be read)
+        """
+        self.load([path], True)
+        return self.files[(path, True)].result()
+
+    def add_stylesheet(self, book, path):
+        """
+        Adds the stylesheet to the book unless one with the same content was added already,
+        returns its file name in the epub (relative to the html files)
+        """
+        css = self.style(path)
+        content_hash = hashlib.sha256(css.encode('utf-8')).hexdigest()
+        name = os.path.basename(path)
+        if(content_hash in self.stylesheets):
+            self.hrefs.setdefault(name, self.stylesheets[content_hash])
+            return self.stylesheets[content_hash]
+        if(name in self.names):
+            stem, ext = os.path.splitext(name)
+            name = stem + '-' + content_hash[:8] + ext
+        self.names.add(name)
+        book.add_item(epub.EpubItem(uid=name, file_name='style/' + name, media_type='text/css', content=css))
+        self.stylesheets[content_hash] = 'style/' + name
+        self.hrefs.setdefault(os.path.basename(path), self.stylesheets[content_hash])
+        return self.stylesheets[content_hash]
+
+    def defined_stylesheet(self, name):
+        """
+        The file name in the epub of the stylesheet that was added with the file name name (see add_stylesheet),
+        style/name if there is none (the stylesheets of the book in reserved_names)
+        """
+        return self.hrefs.get(name, 'style/' + name)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
@@ -0,0 +1,433 @@
+############################################
+# Benchmarks the conversion on synthetic odt and docx documents
+# of any size, and compares the results with a saved baseline
+#
+# python benchmark.py --chapters 50 --paragraphs 100 --save-baseline baseline.json
+# python benchmark.py --chapters 50 --paragraphs 100 --baseline baseline.json
+# python benchmark.py --formats --blockquote-scaling 1000 2000 10000 20000
+#
+import os, sys, json, time, random, argparse, tempfile, zipfile, resource, io, subprocess, copy
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+from odf.opendocument import OpenDocumentText
+from odf.style import Style, TextProperties
+from odf.text import H, P, Span, Note, NoteCitation, NoteBody
+
+WORDS = ('the', 'of', 'and', 'a', 'to', 'in', 'was', 'she', 'her', 'it', 'said', 'Alice', 'little', 'very', 'queen',
+    'rabbit', 'turtle', 'hatter', 'thought', 'garden', 'door', 'key', 'curious', 'remarked', 'timidly', 'again')
+WORDS_PER_PAGE = 300
+SPAN_KINDS = ('bold', 'italic', 'bold_italic')
+NOISE_SECONDS = 0.02 #differences smaller than these are never regressions
+NOISE_MB = 1.0
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+############################################
+# Synthetic documents
+#
+def make_document(chapters=20, paragraphs=40, footnotes=0.1, spans=2.0, blockquotes=10, seed=1):
+    """
+    Makes the content of a synthetic document, which write_odt and write_docx save as files
+    footnotes and spans are the average number of footnotes and of bold/italic spans in a paragraph,
+    blockquotes is the number of blockquotes in the whole document (each one is 1 to 3 paragraphs)
+    Every chapter also has a story break
+    returns the list of chapters as (title, paragraphs) and the number of words.
+    Each paragraph is a list of runs (kind, text) where kind is 'text', 'note' or one of SPAN_KINDS
+    """
+    rng = random.Random(seed)
+    words = [0]
+    def text(count):
+        words[0] += count
+        return ' '.join(rng.choice(WORDS) for i in range(count))
+    quote_at = set(rng.randrange(chapters * paragraphs) for i in range(blockquotes))
+    document = []
+    for c in range(chapters):
+        body = []
+        for p in range(paragraphs):
+            if(c * paragraphs + p in quote_at):
+                lines = [text(rng.randint(10, 40)) for i in range(rng.randint(1, 3))]
+                lines[0] = '[[' + lines[0]
+                lines[-1] = lines[-1] + ']]'
+                body.extend([[('text', line)] for line in lines])
+                continue
+            runs = [('text', text(rng.randint(5, 15)))]
+            #each sentence is a chance for a span or a footnote, on average spans and footnotes per paragraph
+            for i in range(8):
+                if(rng.random() < spans / 8.0):
+                    runs.append(('text', ' '))
+                    runs.append((rng.choice(SPAN_KINDS), text(rng.randint(1, 6))))
+                if(rng.random() < footnotes / 8.0):
+                    runs.append(('note', text(rng.randint(5, 30))))
+                runs.append(('text', ' ' + text(rng.randint(5, 15)) + '.'))
+            body.append(runs)
+            if(p == paragraphs // 2):
+                body.append([('text', '***')])
+        document.append(('Chapter %d' % (c + 1), body))
+    return document, words[0]
+
+def make_blockquote_html(quotes, seed=1):
+    """
+    The html of a chapter with quotes [[ ]] blockquotes, half of them one paragraph and half three paragraphs,
+    with a paragraph between each two (for the micro-benchmark of process_html_with_blockquotes)
+    """
+    rng = random.Random(seed)
+    def text():
+        return ' '.join(rng.choice(WORDS) for i in range(rng.randint(5, 15)))
+    html = ['<html><body><h1>Chapter 1</h1>']
+    for q in range(quotes):
+        if(q % 2):
+            html.append('<p>[[%s</p><p>%s</p><p>%s]]</p>' % (text(), text(), text()))
+        else:
+            html.append('<p>[[%s]]</p>' % text())
+        html.append('<p>%s</p>' % text())
+    html.append('</body></html>')
+    return ''.join(html)
+
+def write_odt(f_name, document):
+    """
+    Saves a document from make_document as odt
+    """
+    doc = OpenDocumentText()
+    styles = {}
+    for kind in SPAN_KINDS:
+        style = Style(name='T_' + kind, family='text')
+        properties = {}
+        if('bold' in kind):
+            properties['fontweight'] = 'bold'
+        if('italic' in kind):
+            properties['fontstyle'] = 'italic'
+        style.addElement(TextProperties(**properties))
+        doc.automaticstyles.addElement(style)
+        styles[kind] = style
+    note_num = 0
+    for title, body in document:
+        doc.text.addElement(H(outlinelevel=1, text=title))
+        for runs in body:
+            paragraph = P()
+            for kind, text in runs:
+                if(kind == 'text'):
+                    paragraph.addText(text)
+                elif(kind == 'note'):
+                    note_num += 1
+                    note = Note(id='ftn%d' % note_num, noteclass='footnote')
+                    note.addElement(NoteCitation(text=str(note_num)))
+                    note_body = NoteBody()
+                    note_body.addElement(P(text=text))
+                    note.addElement(note_body)
+                    paragraph.addElement(note)
+                else:
+                    paragraph.addElement(Span(stylename=styles[kind], text=text))
+            doc.text.addElement(paragraph)
+    doc.save(f_name)
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+DOCX_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/word/footnotes.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml"/>'
+    '</Types>')
+DOCX_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="' + REL_NS + '/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>')
+DOCX_DOCUMENT_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="' + REL_NS + '/styles" Target="styles.xml"/>'
+    '<Relationship Id="rId2" Type="' + REL_NS + '/footnotes" Target="footnotes.xml"/>'
+    '</Relationships>')
+DOCX_STYLES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="' + W_NS + '">'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>'
+    '</w:styles>')
+DOCX_RUN_PROPERTIES = {'text': '', 'bold': '<w:rPr><w:b/></w:rPr>', 'italic': '<w:rPr><w:i/></w:rPr>', 'bold_italic': '<w:rPr><w:b/><w:i/></w:rPr>'}
+
+def write_docx(f_name, document):
+    """
+    Saves a document from make_document as docx
+    (written as xml directly, so python-docx is not needed)
+    """
+    body = []
+    notes = ['<w:footnote w:type="separator" w:id="-1"><w:p/></w:footnote>',
+        '<w:footnote w:type="continuationSeparator" w:id="0"><w:p/></w:footnote>']
+    for title, paragraphs in document:
+        body.append('<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>%s</w:t></w:r></w:p>' % escape(title))
+        for runs in paragraphs:
+            body.append('<w:p>')
+            for kind, text in runs:
+                if(kind == 'note'):
+                    notes.append('<w:footnote w:id="%d"><w:p><w:r><w:t xml:space="preserve">%s</w:t></w:r></w:p></w:footnote>' % (len(notes) - 1, escape(text)))
+                    body.append('<w:r><w:footnoteReference w:id="%d"/></w:r>' % (len(notes) - 2))
+                else:
+                    body.append('<w:r>%s<w:t xml:space="preserve">%s</w:t></w:r>' % (DOCX_RUN_PROPERTIES[kind], escape(text)))
+            body.append('</w:p>')
+    with zipfile.ZipFile(f_name, 'w', zipfile.ZIP_DEFLATED) as out:
+        out.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        out.writestr('_rels/.rels', DOCX_RELS)
+        out.writestr('word/_rels/document.xml.rels', DOCX_DOCUMENT_RELS)
+        out.writestr('word/styles.xml', DOCX_STYLES)
+        out.writestr('word/document.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document xmlns:w="%s"><w:body>%s</w:body></w:document>' % (W_NS, ''.join(body)))
+        out.writestr('word/footnotes.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:footnotes xmlns:w="%s">%s</w:footnotes>' % (W_NS, ''.join(notes)))
+
+WRITERS = {'odt': write_odt, 'docx': write_docx}
+
+def write_manifest(directory, ext, name='benchmark'):
+    """
+    Writes the json for a book made of the synthetic document name.ext, returns its path
+    """
+    data_file = os.path.join(directory, name + '_' + ext + '.json')
+    with open(data_file, 'w') as open_f:
+        json.dump({
+            'authors': ['Bench Mark'],
+            'title': 'Benchmark ' + ext,
+            'id': name + '-' + ext,
+            'output_file_name': name + '_' + ext + '.epub',
+            'files': [name + '.' + ext],
+            'whitelist': [],
+            'blacklist': []
+        }, open_f, indent=1)
+    return data_file
+
+############################################
+# Running the benchmarks
+# (every run is in a new process so that the peak memory is only that of the run)
+#
+def run_pipeline(data_file):
+    """
+    Builds the book without the cache, returns the wall time and the peak memory (resident set size, in MB) of the process
+    """
+    from standard_to_epub import build_book
+    start = time.perf_counter()
+    build_book(data_file, {'cache_enabled': False})
+    wall = time.perf_counter() - start
+    return wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_stages(data_file):
+    """
+    Builds the book with profiling on, returns the totals of each stage (see profiling.summarize)
+    """
+    from standard_to_epub import build_book
+    with redirect_stdout(io.StringIO()):
+        output_file_name = build_book(data_file, {'cache_enabled': False, 'profile': True})
+    with open(output_file_name + '.profile', 'r') as open_f:
+        return json.load(open_f)['stages']
+
+def run_odf_walk(f_name, repeat):
+    """
+    Micro-benchmark of the SimpleODF2XHTML handlers (spans, paragraphs and so on): the best time of
+    walking the already loaded odt document, so loading the file is not counted
+    """
+    from odf.opendocument import load
+    from odt_converters import SimpleODF2XHTML
+    document = load(f_name)
+    times = []
+    for i in range(repeat):
+        converter = SimpleODF2XHTML()
+        converter._wfunc = converter._wlines
+        converter.document = document
+        start = time.perf_counter()
+        converter._walknode(document.topnode)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run_save_footers(f_name, repeat):
+    """
+    Micro-benchmark of save_footers (renumbering the footnotes and taking them out of the document):
+    the best time on copies of the already parsed document, so parsing is not counted
+    Use --footnotes to make the document as footnote-dense as needed (0 if the document has no footnotes)
+    """
+    from standard_open_files_as_html import open_file_as_xhtml
+    from parsing_libraries import process_html, process_html_with_blockquotes, save_footers, find_footnote_markers
+    soup = process_html(process_html_with_blockquotes(open_file_as_xhtml(f_name)))
+    if(not soup.find(find_footnote_markers)):
+        return 0.0
+    times = []
+    for i in range(repeat):
+        document = copy.copy(soup)
+        start = time.perf_counter()
+        save_footers(document)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run_blockquotes(quotes, repeat):
+    """
+    Micro-benchmark of process_html_with_blockquotes: the best time on copies of an already parsed
+    chapter with quotes blockquotes (see make_blockquote_html), so parsing is not counted
+    """
+    from bs4 import BeautifulSoup
+    from parsing_libraries import process_html_with_blockquotes, HTML_PARSER
+    soup = BeautifulSoup(make_blockquote_html(quotes), HTML_PARSER)
+    times = []
+    for i in range(repeat):
+        document = copy.copy(soup)
+        start = time.perf_counter()
+        process_html_with_blockquotes(document)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run_docx_html(f_name, fast):
+    """
+    Reads the docx file into html with docx_converters (if fast is True) or with mammoth, the way the pipeline does
+    before parsing it. Returns the wall time and the peak memory (resident set size, in MB) of the process,
+    both libraries are imported before so only reading the file is measured
+    """
+    import mammoth, docx_converters
+    from standard_open_files_as_html import docx_to_xhtml, open_docx_reader
+    start = time.perf_counter()
+    if(fast):
+        reader = open_docx_reader(f_name)
+        for chunk in reader.iter_body_chunks(100000):
+            pass
+        for chunk in reader.iter_note_chunks(100000):
+            pass
+    else:
+        docx_to_xhtml(f_name)
+    wall = time.perf_counter() - start
+    return wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_startup(data_file):
+    """
+    Builds the book in a new python started with -X importtime, returns the seconds spent importing modules
+    (python's own startup imports included, the conversion itself is not counted)
+    """
+    code = 'import standard_to_epub; standard_to_epub.build_book(%r, {"cache_enabled": False})' % data_file
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    for line in completed.stderr.splitlines():
+        fields = line.split('|')
+        #modules imported by other modules are indented, their time is already in the cumulative time of those
+        if(line.startswith('import time:') and len(fields) == 3 and fields[1].strip().isdigit() and not fields[2].startswith('  ')):
+            total += int(fields[1])
+    return total / 1000000.0
+
+def in_new_process(function, *args):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+def benchmark_format(directory, ext, pages, repeat):
+    """
+    Runs the pipeline repeat times and the profiled pipeline once on the document with extension ext
+    returns the metrics: names ending in _per_second are better when higher, all the others when lower
+    """
+    data_file = write_manifest(directory, ext)
+    runs = [in_new_process(run_pipeline, data_file) for i in range(repeat)]
+    wall = min(run[0] for run in runs)
+    metrics = {
+        'pipeline_seconds': wall,
+        'pages_per_second': pages / wall,
+        'pipeline_peak_rss_mb': min(run[1] for run in runs)
+    }
+    for total in in_new_process(run_stages, data_file):
+        metrics['stage_%s_seconds' % total['stage']] = total['wall']
+        metrics['stage_%s_peak_mb' % total['stage']] = total['peak_memory'] / 1048576.0
+    #a one page book, so the imports needed for the format are measured and not much else
+    WRITERS[ext](os.path.join(directory, 'startup.' + ext), make_document(chapters=1, paragraphs=3)[0])
+    startup_file = write_manifest(directory, ext, 'startup')
+    metrics['startup_import_seconds'] = min(run_startup(startup_file) for i in range(max(repeat, 3)))
+    metrics['micro_save_footers_seconds'] = in_new_process(run_save_footers, os.path.join(directory, 'benchmark.' + ext), max(repeat, 3))
+    if(ext == 'odt'):
+        metrics['micro_odf_walk_seconds'] = in_new_process(run_odf_walk, os.path.join(directory, 'benchmark.odt'), max(repeat, 3))
+    if(ext == 'docx'):
+        #the fast path against mammoth, each one in a new process so their peak memory is their own
+        for name, fast in (('fast', True), ('mammoth', False)):
+            wall, rss = in_new_process(run_docx_html, os.path.join(directory, 'benchmark.docx'), fast)
+            metrics['docx_html_%s_pages_per_second' % name] = pages / wall
+            metrics['docx_html_%s_peak_rss_mb' % name] = rss
+    return metrics
+
+def run_benchmarks(args):
+    """
+    Makes the synthetic documents and benchmarks each format, returns the results (saved as the baseline)
+    """
+    scale = {'chapters': args.chapters, 'paragraphs': args.paragraphs, 'footnotes': args.footnotes,
+        'spans': args.spans, 'blockquotes': args.blockquotes, 'seed': args.seed}
+    document, words = make_document(**scale)
+    pages = words / float(WORDS_PER_PAGE)
+    if(args.blockquote_scaling):
+        scale['blockquote_scaling'] = args.blockquote_scaling
+    results = {'scale': scale, 'pages': pages, 'formats': {}}
+    directory = args.output_dir or tempfile.mkdtemp(prefix='epub_benchmark_')
+    os.makedirs(directory, exist_ok=True)
+    for ext in args.formats:
+        WRITERS[ext](os.path.join(directory, 'benchmark.' + ext), document)
+        print('Benchmarking %s (%.0f pages)...' % (ext, pages))
+        results['formats'][ext] = benchmark_format(directory, ext, pages, args.repeat)
+    if(args.blockquote_scaling):
+        #compared with the baseline like a format, the time for each number of blockquotes shows how it scales
+        print('Benchmarking blockquotes (%s)...' % ', '.join(str(quotes) for quotes in args.blockquote_scaling))
+        results['formats']['blockquotes'] = dict(('micro_blockquotes_%d_seconds' % quotes,
+            in_new_process(run_blockquotes, quotes, max(args.repeat, 3))) for quotes in args.blockquote_scaling)
+    return results
+
+def print_results(results):
+    for ext, metrics in results['formats'].items():
+        print('')
+        print('%-40s %12s' % (ext, ''))
+        for name, value in metrics.items():
+            print('%-40s %12.3f' % (name, value))
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares results with baseline, returns a message for each metric that got worse by more than tolerance (0.1 is 10%)
+    """
+    if(results['scale'] != baseline['scale']):
+        raise Exception("The baseline was made with a different scale: " + json.dumps(baseline['scale']))
+    regressions = []
+    for ext, metrics in results['formats'].items():
+        for name, value in metrics.items():
+            old = baseline['formats'].get(ext, {}).get(name)
+            if(old is None):
+                continue
+            if(name.endswith('_per_second')):
+                worse = value < old * (1 - tolerance)
+            else:
+                noise = NOISE_MB if name.endswith('_mb') else NOISE_SECONDS
+                worse = value > old * (1 + tolerance) and value - old > noise
+            if(worse):
+                regressions.append('%s %s: %.3f (baseline %.3f)' % (ext, name, value, old))
+    return regressions
+
+def process_cmdline():
+    parser = argparse.ArgumentParser(description='Benchmarks converting synthetic odt and docx documents to epub')
+    parser.add_argument('--chapters', type=int, default=20, help='number of chapters (default 20)')
+    parser.add_argument('--paragraphs', type=int, default=40, help='paragraphs in each chapter (default 40)')
+    parser.add_argument('--footnotes', type=float, default=0.1, help='average footnotes in a paragraph (default 0.1)')
+    parser.add_argument('--spans', type=float, default=2.0, help='average bold/italic spans in a paragraph (default 2)')
+    parser.add_argument('--blockquotes', type=int, default=10, help='blockquotes in the document (default 10)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random text (default 1)')
+    parser.add_argument('--formats', nargs='*', choices=sorted(WRITERS), default=['odt', 'docx'], help='formats to benchmark (none for only the micro-benchmarks)')
+    parser.add_argument('--blockquote-scaling', nargs='+', type=int, default=[], metavar='N',
+        help='also time process_html_with_blockquotes on a chapter with N [[ ]] blockquotes, for each N')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the pipeline, the fastest one counts (default 3)')
+    parser.add_argument('--output-dir', help='where to write the documents and books (default: a new temporary directory)')
+    parser.add_argument('--save-baseline', metavar='FILE', help='save the results as the baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with this baseline and fail if anything is slower or uses more memory')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='how much worse than the baseline is still fine (default 0.15, 15%%)')
+    return parser.parse_args()
+
+def main():
+    args = process_cmdline()
+    results = run_benchmarks(args)
+    print_results(results)
+    if(args.save_baseline):
+        with open(args.save_baseline, 'w') as open_f:
+            json.dump(results, open_f, indent=1)
+        print('Baseline saved in ' + args.save_baseline)
+    if(args.baseline):
+        with open(args.baseline, 'r') as open_f:
+            baseline = json.load(open_f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        print('')
+        if(regressions):
+            print('Regressions compared with ' + args.baseline + ':')
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('No regressions compared with ' + args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+############################################
+# Watch mode: builds the books, then keeps watching their data files, the files they are made of,
+# their stylesheets, loose files and cover images, and builds a book again when any of them is saved
+#
+#   python standard_to_epub.py --watch book.json
+#
+# The files are checked every POLL_INTERVAL seconds, and a rebuild waits until nothing has changed for DEBOUNCE seconds,
+# so a burst of saves is built once. The process stays running between builds with the conversion results of every file
+# in memory (see MemoryCache), so only the files that changed are converted again: a change to a stylesheet only writes the epub again
+#
+import os, json, time
+from standard_to_epub import build_book_timed, get_asset_files
+from build_state import BuildState
+
+POLL_INTERVAL = 0.2 #seconds between checks of the files
+DEBOUNCE = 0.3 #seconds without changes before the book is built
+
+class MemoryCache(object):
+    """
+    Keeps the results of conversion_pool.convert_file in memory between the builds of watch mode, can be used
+    in place of a ConversionCache with conversion_pool.iter_convert_files
+    A file whose modification time and size are the same as when it was converted is not converted again (nor hashed)
+    Files that it doesn't have are looked up in cache (a ConversionCache or BuildState, see wrap) and saved there too
+    """
+    def __init__(self):
+        self.cache = None
+        self.files = {} #key: (mtime, size, result)
+        self.stats = {} #key: (mtime, size, key in cache) of the files that are being converted
+        self.used = set()
+
+    def wrap(self, cache=None):
+        """
+        Starts a build that looks up in cache (optional) what is not in memory, returns the MemoryCache
+        """
+        self.cache = cache
+        self.stats = {}
+        self.used = set()
+        return self
+
+    def key(self, f_name, options):
+        return (f_name, json.dumps(options, sort_keys=True))
+
+    def get(self, key):
+        """
+        Returns the result for the file if it didn't change since it was converted, otherwise the one in cache (or None)
+        """
+        f_name, options = key
+        self.used.add(key)
+        stat = os.stat(f_name)
+        entry = self.files.get(key)
+        if(entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size):
+            if(isinstance(self.cache, BuildState)):
+                self.cache.keep(f_name)
+            return dict(entry[2])
+        cache_key = None
+        result = None
+        if(self.cache is not None):
+            cache_key = self.cache.key(f_name, json.loads(options))
+            result = self.cache.get(cache_key)
+        #the file as it was before converting it, if it changes while it is converted the next build sees it
+        self.stats[key] = (stat.st_mtime, stat.st_size, cache_key)
+        if(result is not None):
+            self.files[key] = (stat.st_mtime, stat.st_size, dict(result))
+        return result
+
+    def put(self, key, result):
+        mtime, size, cache_key = self.stats.pop(key)
+        to_keep = dict(result)
+        to_keep.pop('profile', None)
+        self.files[key] = (mtime, size, to_keep)
+        if(self.cache is not None):
+            self.cache.put(cache_key, result)
+
+    def forget_unused(self):
+        """
+        Forgets the files that were not part of the last build
+        """
+        for key in [key for key in self.files if key not in self.used]:
+            del self.files[key]
+
+def get_stamp(path):
+    """
+    What a change of the file is noticed by: its modification time and size (None if it doesn't exist)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+class BookWatcher(object):
+    """
+    Watches the files of one book and rebuilds it with build_book_timed (so errors are printed and the watching goes on)
+    """
+    def __init__(self, data_file, overrides=None):
+        self.data_file = os.path.abspath(data_file)
+        self.overrides = overrides
+        self.memory = MemoryCache()
+        self.kinds = {} #path: 'manifest', 'document' or 'asset'
+        self.stamps = {} #path: get_stamp of the file when it was last checked
+
+    def watched_files(self):
+        """
+        The files of the book (see get_watched_files), only the data file if it can't be read (it may be half saved)
+        """
+        try:
+            with open(self.data_file, 'r') as open_f:
+                json_data = json.load(open_f)
+            json_data.update(self.overrides or {})
+            return get_watched_files(self.data_file, json_data)
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return {self.data_file: 'manifest'}
+
+    def refresh(self):
+        """
+        Reads which files the book is made of now and remembers how they are before the build
+        """
+        self.kinds = self.watched_files()
+        self.stamps = dict((path, get_stamp(path)) for path in self.kinds)
+
+    def check(self):
+        """
+        returns the files that changed (or appeared or disappeared) since the last check
+        """
+        changed = []
+        for path in self.kinds:
+            stamp = get_stamp(path)
+            if(stamp != self.stamps[path]):
+                self.stamps[path] = stamp
+                changed.append(path)
+        return changed
+
+    def build(self, changed=()):
+        """
+        Builds the book again, changed are the files that changed since the last build
+        """
+        if(changed):
+            kinds = set(self.kinds.get(path) for path in changed)
+            names = ', '.join(os.path.basename(path) for path in changed)
+            if(kinds == {'asset'}):
+                print(names + ' changed, writing ' + os.path.basename(self.data_file) + ' again without converting anything')
+            else:
+                print(names + ' changed, building ' + os.path.basename(self.data_file) + ' again')
+        self.refresh()
+        result = build_book_timed(self.data_file, self.overrides, None, self.memory)
+        if(result['error']):
+            print('Build failed (%.2f seconds): %s' % (result['seconds'], result['error']))
+        else:
+            print('Built ' + result['output_file'] + ' in %.2f seconds' % result['seconds'])
+        return result
+
+def get_watched_files(data_file, json_data):
+    """
+    The files a book is made of as a dict of path: kind, the data file ('manifest'), the files that are
+    converted into chapters ('document') and the stylesheets, loose files and cover image ('asset')
+    """
+    base_dir = os.path.dirname(data_file)
+    kinds = {data_file: 'manifest'}
+    for path in get_asset_files(json_data) + [json_data.get('cover_img', None)]:
+        if(path is not None):
+            kinds.setdefault(os.path.join(base_dir, path), 'asset')
+    for path in json_data['files']:
+        kinds[os.path.join(base_dir, path)] = 'document'
+    return kinds
+
+def watch(data_files, overrides=None, interval=POLL_INTERVAL, debounce=DEBOUNCE):
+    """
+    Builds the books and builds them again whenever their files change, until it is stopped with Ctrl+C
+    """
+    watchers = [BookWatcher(data_file, overrides) for data_file in data_files]
+    try:
+        #the first builds are usually the longest, Ctrl+C during them stops too
+        for watcher in watchers:
+            watcher.build()
+        print('Watching %d books for changes (Ctrl+C to stop)' % len(watchers))
+        while(True):
+            time.sleep(interval)
+            changed = dict((watcher, watcher.check()) for watcher in watchers)
+            if(not any(changed.values())):
+                continue
+            #wait until the files stop changing, an editor often saves several times in a row
+            while(True):
+                time.sleep(debounce)
+                more = False
+                for watcher in watchers:
+                    for path in watcher.check():
+                        more = True
+                        if(path not in changed[watcher]):
+                            changed[watcher].append(path)
+                if(not more):
+                    break
+            for watcher in watchers:
+                if(changed[watcher]):
+                    watcher.build(changed[watcher])
+    except KeyboardInterrupt:
+        print('Stopped watching')
@@ -0,0 +1,71 @@
+############################################
+# Deterministic builds: the epub only depends on what it is built from (the zip timestamps and the modification date
+# in the metadata are fixed), and a digest of all of that is saved in the epub's zip comment.
+# Before building, the digest is computed again from the data file and the hashes of the files, if it is the one
+# in the epub that is already there, the epub would come out the same and nothing has to be done
+#
+import os, json, datetime, zipfile, hashlib
+from importlib import metadata
+from conversion_cache import converter_version, hash_file
+
+DIGEST_VERSION = 1 #change this whenever the epub written from the same files changes
+DEFAULT_SOURCE_DATE = 315532800 #1980-01-01, the first date a zip file can have
+DIGEST_PREFIX = b'convert_files_to_epub sha256:'
+#values of the data file that change how the book is built, not what is in it
+BUILD_ONLY_KEYS = frozenset(['jobs', 'chunk_jobs', 'cache_enabled', 'cache_dir', 'cache_size', 'incremental', 'profile', 'profile_dump'])
+
+def get_source_date():
+    """
+    The date of every file in a deterministic epub: SOURCE_DATE_EPOCH (seconds since 1970, the usual variable
+    for reproducible builds) if it is set, 1980-01-01 otherwise
+    """
+    epoch = int(os.environ.get('SOURCE_DATE_EPOCH', DEFAULT_SOURCE_DATE))
+    return datetime.datetime.fromtimestamp(max(epoch, DEFAULT_SOURCE_DATE), datetime.timezone.utc)
+
+def deterministic_options(options, digest):
+    """
+    Adds to the options of an epub writer (see streaming_epub.open_epub_zip) what makes the epub the same
+    in every build: the dates of the files and of the metadata, and the digest as the zip comment
+    """
+    source_date = get_source_date()
+    options['mtime'] = source_date
+    options['date_time'] = source_date.timetuple()[:6]
+    options['comment'] = DIGEST_PREFIX + digest.encode('ascii')
+    return options
+
+def input_digest(json_data, files):
+    """
+    Digest of everything an epub is built from: the values in json_data (without BUILD_ONLY_KEYS), the versions
+    of the converters and of ebooklib, the source date and the content of files (the paths of the documents,
+    stylesheets, loose files and images, in the order they are in json_data, so the paths themselves are not needed)
+    """
+    sha = hashlib.sha256()
+    settings = dict((key, value) for key, value in json_data.items() if key not in BUILD_ONLY_KEYS)
+    sha.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    versions = [str(DIGEST_VERSION), converter_version(), get_source_date().isoformat()]
+    try:
+        versions.append('ebooklib-' + metadata.version('ebooklib'))
+    except metadata.PackageNotFoundError:
+        versions.append('ebooklib-unknown')
+    sha.update(' '.join(versions).encode('utf-8'))
+    for f in files:
+        try:
+            file_hash = hash_file(f)
+        except (IOError, TypeError):
+            #missing files are part of the digest too, the stylesheets are left empty
+            file_hash = 'missing'
+        sha.update(('\n' + file_hash).encode('utf-8'))
+    return sha.hexdigest()
+
+def read_digest(epub_file):
+    """
+    The digest saved in an epub by a deterministic build, None if there is none (or no epub)
+    """
+    try:
+        with zipfile.ZipFile(epub_file) as open_zip:
+            comment = open_zip.comment
+    except (IOError, zipfile.BadZipFile):
+        return None
+    if(not comment.startswith(DIGEST_PREFIX)):
+        return None
+    return comment[len(DIGEST_PREFIX):].decode('ascii', 'replace')
@@ -0,0 +1,344 @@
+############################################
+# Build server: keeps a pool of worker processes with everything imported
+# and builds books when asked over http (on a port or a unix socket),
+# so a rebuild doesn't have to start python and import the libraries again
+#
+#   python build_server.py --port 8765 -j 2
+#   curl -N -d '{"manifest": "/path/to/book.json"}' http://127.0.0.1:8765/build
+#   curl --unix-socket /tmp/epub.sock -N -d '{"manifest": "/path/to/book.json"}' http://localhost/build
+#
+# POST /build takes {"manifest": path, "overrides": {...}, "wait": true} and answers with one json event
+# per line (queued, started, file, chapter, done or error) until the book is built.
+# Only the values in BUILD_OVERRIDES can be overridden, what the book is made of and where it is written come from the manifest.
+# With "wait": false it answers with the job right away. GET /jobs lists the jobs.
+# Asking for a book that is already waiting to be built joins that job instead of building it twice
+#
+import os, json, time, asyncio, argparse, signal, itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from standard_to_epub import build_book_timed
+from conversion_pool import get_jobs
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_REQUEST_SIZE = 1024 * 1024 #bytes
+FINISHED_JOBS_KEPT = 100 #finished jobs listed by GET /jobs
+#values of the manifest a request can override: how the book is built (the options of the command line, see standard_to_epub.get_overrides)
+#jobs is left out, the server sets it
+BUILD_OVERRIDES = frozenset(['cache_enabled', 'parser', 'odt_fast_path', 'docx_fast_path', 'streaming', 'incremental', 'profile',
+    'profile_dump', 'minify_css', 'chunk_size', 'chunk_jobs', 'compression_level', 'max_chapter_size', 'max_chapter_paragraphs',
+    'deterministic', 'max_cover_size'])
+
+EVENTS = None #queue for the progress events of a worker process, see start_worker
+
+def start_worker(events):
+    """
+    Initializer of the worker processes
+    """
+    global EVENTS
+    EVENTS = events
+
+def warm_up():
+    """
+    Run once in every worker when the server starts, so the workers exist before the first book
+    and have the libraries for every format imported (those are otherwise imported on first use)
+    """
+    import odt_converters, docx_converters, mammoth
+    return os.getpid()
+
+def run_job(job_id, data_file, overrides):
+    """
+    Builds a book in a worker process, sending the progress events to the server
+    """
+    def progress(event):
+        event['job'] = job_id
+        EVENTS.put(event)
+    try:
+        return build_book_timed(data_file, overrides, progress)
+    finally:
+        #the server waits for this, so that it has all the events of the job before saying it is done
+        EVENTS.put({'event': 'finished', 'job': job_id})
+
+class Job(object):
+    """
+    A book that was asked to be built, with everyone waiting for its events
+    """
+    def __init__(self, job_id, data_file, overrides):
+        self.id = job_id
+        self.data_file = data_file
+        self.overrides = overrides
+        self.state = 'queued'
+        self.requests = 1
+        self.result = None
+        self.listeners = []
+        self.submitted = time.time()
+        self.output_file = None
+        self.previous = None #job writing the same epub before this one
+        self.finished = asyncio.Event() #the worker sent all its events
+        self.done = asyncio.Event()
+
+    def key(self):
+        return job_key(self.data_file, self.overrides)
+
+    def listen(self):
+        listener = asyncio.Queue()
+        self.listeners.append(listener)
+        return listener
+
+    def send(self, event):
+        for listener in self.listeners:
+            listener.put_nowait(event)
+
+    def to_json(self):
+        return {'job': self.id, 'manifest': self.data_file, 'overrides': self.overrides, 'state': self.state,
+            'requests': self.requests, 'result': self.result}
+
+def job_key(data_file, overrides):
+    return (data_file, json.dumps(overrides, sort_keys=True))
+
+def get_output_file(data_file, overrides=None):
+    """
+    The epub that the data file is built into with overrides, like build_book does (the data file itself
+    if it can't be read, the build will fail anyway)
+    """
+    try:
+        with open(data_file, 'r') as open_f:
+            json_data = json.load(open_f)
+        json_data.update(overrides or {})
+        return os.path.join(os.path.dirname(data_file), json_data['output_file_name'])
+    except (IOError, ValueError, KeyError, TypeError):
+        return data_file
+
+class BuildServer(object):
+    """
+    Runs the jobs in a pool of jobs worker processes
+    A job waits until a worker is free and no other job is writing the same epub
+    While it waits, asking for the same book again joins it: the book changed again before it was built, so one build is enough
+    """
+    def __init__(self, jobs=None):
+        self.workers = get_jobs(jobs if jobs is not None else 0)
+        self.context = multiprocessing.get_context()
+        self.events = self.context.Queue()
+        self.pool = None
+        self.slots = None
+        self.jobs = {}
+        self.queued = {} #job key: job that has not started yet
+        self.latest = {} #epub file: last job writing it, one build of each epub at a time
+        self.counter = itertools.count(1)
+
+    async def start(self):
+        self.slots = asyncio.Semaphore(self.workers)
+        await self.start_pool()
+        self.event_reader = asyncio.create_task(self.read_events())
+
+    async def start_pool(self):
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context, initializer=start_worker, initargs=(self.events,))
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up) for i in range(self.workers)])
+
+    async def restart_pool(self, broken):
+        """
+        Starts new workers in place of the pool broken. When a worker dies (killed, out of memory...) the pool can't run anything anymore
+        """
+        if(self.pool is not broken):
+            #another job that was in the same pool started them already
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        print('A worker died, starting the workers again')
+        try:
+            await self.start_pool()
+        except Exception as e:
+            #the next job tries again
+            print('Error! the workers could not be started again: %s: %s' % (type(e).__name__, e))
+
+    async def stop(self):
+        self.events.put(None)
+        await self.event_reader
+        self.pool.shutdown(cancel_futures=True)
+
+    async def read_events(self):
+        """
+        Passes the progress events from the workers to the jobs they belong to
+        """
+        loop = asyncio.get_running_loop()
+        while(True):
+            event = await loop.run_in_executor(None, self.events.get)
+            if(event is None):
+                return
+            job = self.jobs.get(event['job'])
+            if(job is None):
+                continue
+            if(event['event'] == 'finished'):
+                job.finished.set()
+            else:
+                job.send(event)
+
+    def submit(self, data_file, overrides=None):
+        """
+        Returns the job that builds data_file, a new one unless the same book is already waiting
+        """
+        data_file = os.path.abspath(data_file)
+        overrides = dict(overrides or {})
+        #the workers are the pool, books are not converted in pools of their own
+        overrides['jobs'] = 1
+        key = job_key(data_file, overrides)
+        job = self.queued.get(key)
+        if(job is not None):
+            job.requests += 1
+            return job
+        job = Job(next(self.counter), data_file, overrides)
+        job.output_file = get_output_file(data_file, overrides)
+        job.previous = self.latest.get(job.output_file)
+        self.jobs[job.id] = job
+        self.queued[key] = job
+        self.latest[job.output_file] = job
+        asyncio.create_task(self.run(job))
+        return job
+
+    async def run(self, job):
+        key = job.key()
+        if(job.previous is not None):
+            await job.previous.done.wait()
+            job.previous = None
+        async with self.slots:
+            del self.queued[key]
+            job.state = 'running'
+            job.send({'event': 'started', 'job': job.id})
+            loop = asyncio.get_running_loop()
+            pool = self.pool
+            try:
+                job.result = await loop.run_in_executor(pool, run_job, job.id, job.data_file, job.overrides)
+                await job.finished.wait()
+            except BrokenProcessPool as e:
+                #the worker died, and the pool with it
+                job.result = {'data_file': job.data_file, 'output_file': None, 'seconds': 0.0, 'error': '%s: %s' % (type(e).__name__, e)}
+                await self.restart_pool(pool)
+            except Exception as e:
+                job.result = {'data_file': job.data_file, 'output_file': None, 'seconds': 0.0, 'error': '%s: %s' % (type(e).__name__, e)}
+        if(self.latest.get(job.output_file) is job):
+            del self.latest[job.output_file]
+        job.state = 'failed' if job.result['error'] else 'done'
+        event = {'event': 'error' if job.result['error'] else 'done', 'job': job.id}
+        event.update(job.result)
+        job.send(event)
+        job.send(None)
+        job.done.set()
+        self.forget_finished()
+
+    def forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+        for job_id in finished[:-FINISHED_JOBS_KEPT]:
+            del self.jobs[job_id]
+
+    async def handle(self, reader, writer):
+        """
+        Answers one http request
+        """
+        try:
+            method, path, body = await read_request(reader)
+            if(method == 'GET' and path == '/jobs'):
+                await respond(writer, 200, [job.to_json() for job in self.jobs.values()])
+            elif(method == 'POST' and path == '/build'):
+                await self.handle_build(writer, json.loads(body or b'{}'))
+            else:
+                await respond(writer, 404, {'error': 'not found'})
+        except (ValueError, KeyError) as e:
+            await respond(writer, 400, {'error': '%s: %s' % (type(e).__name__, e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_build(self, writer, request):
+        if(not isinstance(request, dict) or not isinstance(request.get('manifest'), str)):
+            raise ValueError('expected {"manifest": path}')
+        if(not os.path.isfile(request['manifest'])):
+            raise ValueError('no such manifest: ' + request['manifest'])
+        overrides = request.get('overrides', None) or {}
+        if(not isinstance(overrides, dict)):
+            raise ValueError('expected "overrides" to be an object')
+        not_allowed = sorted(key for key in overrides if key not in BUILD_OVERRIDES)
+        if(not_allowed):
+            raise ValueError('these values can not be overridden: ' + ', '.join(not_allowed))
+        job = self.submit(request['manifest'], overrides)
+        if(not request.get('wait', True)):
+            await respond(writer, 202, job.to_json())
+            return
+        listener = job.listen()
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+            queued = {'event': 'queued', 'job': job.id, 'state': job.state, 'requests': job.requests}
+            write_event(writer, queued)
+            while(True):
+                await writer.drain()
+                event = await listener.get()
+                if(event is None):
+                    break
+                write_event(writer, event)
+            await writer.drain()
+        finally:
+            job.listeners.remove(listener)
+
+async def read_request(reader):
+    """
+    Reads an http request, returns the method, the path and the body
+    """
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if(len(request_line) < 2):
+        raise ValueError('bad request line')
+    headers = {}
+    while(True):
+        line = await reader.readline()
+        if(line in (b'\r\n', b'\n', b'')):
+            break
+        name, sep, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if(length > MAX_REQUEST_SIZE):
+        raise ValueError('request too big')
+    body = await reader.readexactly(length) if length else b''
+    return request_line[0].upper(), request_line[1].split('?')[0], body
+
+async def respond(writer, status, data):
+    reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found'}
+    body = json.dumps(data).encode('utf-8') + b'\n'
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % (status, reasons[status], len(body))).encode('latin-1'))
+    writer.write(body)
+    await writer.drain()
+
+def write_event(writer, event):
+    writer.write(json.dumps(event).encode('utf-8') + b'\n')
+
+async def serve(args):
+    build_server = BuildServer(args.jobs)
+    await build_server.start()
+    if(args.socket):
+        server = await asyncio.start_unix_server(build_server.handle, path=args.socket)
+        print('Building books on ' + args.socket + ' with %d workers' % build_server.workers)
+    else:
+        server = await asyncio.start_server(build_server.handle, args.host, args.port)
+        print('Building books on http://%s:%d with %d workers' % (args.host, args.port, build_server.workers))
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    async with server:
+        await stopping.wait()
+    await build_server.stop()
+    if(args.socket and os.path.exists(args.socket)):
+        os.remove(args.socket)
+
+def process_cmdline():
+    parser = argparse.ArgumentParser(description='Keeps worker processes running and builds epubs when asked over http')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on (default %s)' % DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default %d)' % DEFAULT_PORT)
+    parser.add_argument('--socket', default=None, help='listen on this unix socket instead of a port')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of books built at the same time (default: all cpus)')
+    return parser.parse_args()
+
+def main():
+    asyncio.run(serve(process_cmdline()))
+
+if __name__ == '__main__':
+    main()
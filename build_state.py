@@ -0,0 +1,90 @@
+############################################
+# Remembers what each file of a book was converted into, so that
+# rebuilding the book only converts the files that changed
+#
+import os, json
+from conversion_cache import converter_version, hash_file, result_to_json, result_from_json
+
+def get_state_file_name(output_file_name):
+    return output_file_name + '.buildstate'
+
+class BuildState(object):
+    """
+    Build state of one book, kept next to its epub
+    For every file it records the modification time, size and hash of the file,
+    the options it was converted with and the result of conversion_pool.convert_file
+    A file is converted again only if its modification time or size changed and its hash changed too
+    Can be used in place of a ConversionCache with conversion_pool.iter_convert_files. Files that
+    are not in the build state are looked up in cache (a ConversionCache, optional) instead
+    """
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache
+        self.version = converter_version()
+        self.files = {}
+        self.stats = {} #f_name: (mtime, size, hash) of the files that are being converted
+        self.used = set()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as open_f:
+                state = json.load(open_f)
+            if(state.get('version') == self.version):
+                self.files = state['files']
+        except (IOError, ValueError, KeyError):
+            #no build state yet (or a broken one), everything is converted
+            pass
+
+    def key(self, f_name, options):
+        return (f_name, json.dumps(options, sort_keys=True))
+
+    def get(self, key):
+        """
+        Returns the result for the file if it didn't change since the last build, otherwise None
+        """
+        f_name, options = key
+        self.used.add(f_name)
+        entry = self.files.get(f_name)
+        stat = os.stat(f_name)
+        if(entry is not None and entry['options'] == options and stat.st_mtime == entry['mtime'] and stat.st_size == entry['size']):
+            return result_from_json(dict(entry['result']))
+        file_hash = hash_file(f_name)
+        if(entry is not None and entry['options'] == options and file_hash == entry['hash']):
+            #touched but not changed
+            entry['mtime'] = stat.st_mtime
+            return result_from_json(dict(entry['result']))
+        #the file as it was before converting it, if it changes while it is converted the next build sees it
+        self.stats[f_name] = (stat.st_mtime, stat.st_size, file_hash)
+        if(self.cache is not None):
+            result = self.cache.get(self.cache.key(f_name, json.loads(options), file_hash))
+            if(result is not None):
+                self.put(key, result, False)
+            return result
+        return None
+
+    def put(self, key, result, to_cache=True):
+        f_name, options = key
+        mtime, size, file_hash = self.stats.pop(f_name)
+        self.files[f_name] = {
+            'mtime': mtime,
+            'size': size,
+            'hash': file_hash,
+            'options': options,
+            'result': result_to_json(result)
+        }
+        if(to_cache and self.cache is not None):
+            self.cache.put(self.cache.key(f_name, json.loads(options), file_hash), result)
+
+    def keep(self, f_name):
+        """
+        The file is still part of the book but get was not needed (see book_watcher.MemoryCache), save keeps its entry
+        """
+        self.used.add(f_name)
+
+    def save(self):
+        """
+        Writes the build state, forgetting files that were not used in this build
+        """
+        files = dict((f, entry) for f, entry in self.files.items() if f in self.used)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as open_f:
+            json.dump({'version': self.version, 'files': files}, open_f)
+        os.replace(temp_path, self.path)
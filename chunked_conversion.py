@@ -0,0 +1,228 @@
+############################################
+# Converts a big docx file in chunks: the html that mammoth makes is cut before h1 tags
+# into slices of about chunk_size characters, and each slice is parsed and split into chapters
+# on its own (in a pool of processes if asked), so there is never more than one slice as a BeautifulSoup tree.
+# The list of footnotes that mammoth puts at the end is cut the same way and converted last,
+# once the chapters of all the footnote markers are known
+# The chunks can also come from somewhere else already cut (docx_converters reads docx files in chunks)
+#
+from collections import deque
+from itertools import chain
+from bs4 import BeautifulSoup
+from parsing_libraries import (HTML_PARSER, HTML_TAG_REGEX, VOID_TAGS, index_html, clean_indexed_html, prepare_html,
+    split_chapters, renumber_footnote_markers, link_footnotes, UnbalancedBlockquotes)
+from standard_open_files_as_html import UnsupportedDocument
+from profiling import stage
+
+FOOTNOTES_START = '<li id="footnote-' #the first tag inside the list of footnotes mammoth makes
+
+class ChapterTitle(object):
+    """
+    Stands in for the h1 tag of a chapter in get_chapter_file_name (only its string is used),
+    so the chapters of the ids in a chunk can be sent between processes without the tree of the chunk
+    """
+    __slots__ = ('string',)
+    def __init__(self, string):
+        self.string = string
+
+def find_chunks(xhtml, chunk_size):
+    """
+    Finds where to cut xhtml (html made by mammoth, where every tag is closed): before an h1 tag that is not inside
+    another tag, once the chunk has at least chunk_size characters. The first chunk goes on at least until the second h1,
+    so every chunk has chapter titles. The list of footnotes is cut the same way before its li tags
+    returns the chunks as lists of (start, end) slices of xhtml, without the list of footnotes,
+    and the chunks of the list of footnotes, each one with the ol tag around it
+    Raises UnsupportedDocument if the html can't be cut (no h1 outside other tags, tags that don't match, chapters after the footnotes)
+    """
+    cuts = [0]
+    note_cuts = [] #where the ol tag of the footnotes opens, the cuts inside it and where it closes
+    notes_end = None
+    depth = 0
+    has_h1 = False
+    for match in HTML_TAG_REGEX.finditer(xhtml):
+        if(match.group(1)):
+            depth -= 1
+            if(depth < 0):
+                raise UnsupportedDocument('closing tag without an opening tag at %d' % match.start())
+            if(depth == 0 and note_cuts and notes_end is None):
+                notes_end = match.end()
+                note_cuts.append(match.start())
+            continue
+        name = match.group(2).lower()
+        if(depth == 0):
+            if(name == 'h1'):
+                if(note_cuts):
+                    raise UnsupportedDocument('chapters after the list of footnotes')
+                if(has_h1 and match.start() - cuts[-1] >= chunk_size):
+                    cuts.append(match.start())
+                has_h1 = True
+            elif(name == 'ol' and not note_cuts and xhtml.startswith(FOOTNOTES_START, match.end())):
+                note_cuts = [match.start(), match.end()]
+        elif(depth == 1 and name == 'li' and note_cuts and notes_end is None):
+            if(match.start() - note_cuts[-1] >= chunk_size):
+                note_cuts.append(match.start())
+        if(name not in VOID_TAGS and not match.group(0).endswith('/>')):
+            depth += 1
+    if(depth != 0 or not has_h1):
+        raise UnsupportedDocument('the html can not be cut into chunks')
+    cuts.append(len(xhtml))
+    chunks = []
+    for start, end in zip(cuts, cuts[1:]):
+        if(notes_end is not None and start <= note_cuts[0] < end):
+            chunks.append([(start, note_cuts[0]), (notes_end, end)])
+        else:
+            chunks.append([(start, end)])
+    note_chunks = []
+    if(notes_end is not None):
+        opening = (note_cuts[0], note_cuts[1])
+        closing = (note_cuts[-1], notes_end)
+        for start, end in zip(note_cuts[1:-1], note_cuts[2:]):
+            note_chunks.append([opening, (start, end), closing])
+    return chunks, note_chunks
+
+def chunk_text(xhtml, chunk):
+    return ''.join(xhtml[start:end] for start, end in chunk)
+
+def convert_chunk(text, parser=None, blockquotes_enabled=True):
+    """
+    Parses one chunk (see find_chunks), prepares it like prepare_html and splits it into chapters,
+    with its footnote markers pointing to the footnote document
+    returns the chapters, the number of footnote markers, the chapter of every id in the chunk
+    as a ChapterTitle (None if it comes before the first chapter) and the ChapterTitle of the last chapter
+    Raises UnbalancedBlockquotes if a blockquote goes on into the next chunk
+    """
+    soup = BeautifulSoup(text, parser or HTML_PARSER)
+    soup, index = prepare_html(soup, blockquotes_enabled)
+    if(index is None or index.footnotes):
+        raise UnsupportedDocument('footnotes outside of the list of footnotes')
+    markers = index.footnote_markers()
+    renumber_footnote_markers(markers)
+    titles = {}
+    def chapter_title(h1):
+        if(h1 is None):
+            return None
+        if(id(h1) not in titles):
+            titles[id(h1)] = ChapterTitle(None if h1.string is None else str(h1.string))
+        return titles[id(h1)]
+    chapters = {}
+    for a, h1 in index.anchors:
+        if(a['id'] not in chapters):
+            chapters[a['id']] = chapter_title(h1)
+    last_title = chapter_title(index.h1[-1])
+    chunk_chapters = split_chapters(soup)
+    #the tree is full of reference cycles, without this it stays until the garbage collector gets to it
+    soup.decompose()
+    return chunk_chapters, len(markers), chapters, last_title
+
+def iter_converted_chunks(chunks, parser=None, blockquotes_enabled=True, jobs=1):
+    """
+    Yields convert_chunk of the chunks (the html of each one) in order. If jobs is more than 1, the chunks are converted
+    in that many processes. chunks can be an iterator, only a few chunks are taken from it before they are needed
+    A chunk that ends inside a blockquote is converted again together with the next one
+    """
+    chunks = iter(chunks)
+    executor = None
+    if(jobs > 1):
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    def submit(text):
+        if(executor is None):
+            return None #converted when it is needed
+        return executor.submit(convert_chunk, text, parser, blockquotes_enabled)
+    pending = deque() #(text, future), only a few chunks ahead so their text is not all kept at once
+    def fill():
+        while(len(pending) < 2 * jobs):
+            text = next(chunks, None)
+            if(text is None):
+                return
+            pending.append((text, submit(text)))
+    try:
+        while(True):
+            fill()
+            if(not pending):
+                break
+            text, future = pending.popleft()
+            while(True):
+                try:
+                    if(future is None):
+                        result = convert_chunk(text, parser, blockquotes_enabled)
+                    else:
+                        result = future.result()
+                    break
+                except UnbalancedBlockquotes:
+                    fill()
+                    if(not pending):
+                        #nothing left to close it, the whole document would have failed the same way
+                        raise
+                    following, following_future = pending.popleft()
+                    if(following_future is not None):
+                        following_future.cancel()
+                    text = text + following
+                    future = submit(text)
+            yield result
+    finally:
+        if(executor is not None):
+            executor.shutdown(cancel_futures=True)
+
+def convert_xhtml_in_chunks(xhtml, options):
+    """
+    Converts the html of a docx file (see standard_open_files_as_html.docx_to_xhtml) chunk by chunk,
+    with options like conversion_pool.convert_file ('chunk_size' characters in each chunk, 'chunk_jobs' processes)
+    The chapters, footer and footnote numbers are the same as converting the whole document at once
+    returns the chapters, the footer html (or None) and the number of the last footnote (0 if there are none)
+    Raises UnsupportedDocument if the document has to be converted as a whole
+    """
+    with stage('find_chunks'):
+        chunks, note_chunks = find_chunks(xhtml, options['chunk_size'])
+    if(len(chunks) < 2):
+        raise UnsupportedDocument('the document fits in one chunk')
+    return convert_html_chunks((chunk_text(xhtml, chunk) for chunk in chunks),
+        (chunk_text(xhtml, chunk) for chunk in note_chunks), options)
+
+def convert_html_chunks(chunks, note_chunks, options):
+    """
+    Converts a document that is already cut into chunks (the html of each one, cut like find_chunks does),
+    note_chunks are the chunks of the list of footnotes, each one in the ol tag. Both can be iterators,
+    note_chunks is only read once all the chunks are converted
+    returns the chapters, the footer html (or None) and the number of the last footnote, like convert_xhtml_in_chunks
+    Raises UnsupportedDocument if the document has to be converted as a whole
+    """
+    parser = options.get('parser', None)
+    blockquotes_enabled = options.get('blockquotes_enabled', True)
+    chapters = []
+    ids = {} #chapter of every id, the first one in the document is the one that counts
+    marker_count = 0
+    last_title = None
+    with stage('convert_chunks'):
+        for chunk_chapters, chunk_markers, chunk_ids, chunk_last_title in iter_converted_chunks(chunks, parser,
+                blockquotes_enabled, options.get('chunk_jobs', 1)):
+            chapters.extend(chunk_chapters)
+            marker_count += chunk_markers
+            for a_id, title in chunk_ids.items():
+                ids.setdefault(a_id, title)
+            last_title = chunk_last_title
+    note_chunks = iter(note_chunks)
+    first_notes = next(note_chunks, None)
+    if(first_notes is None and marker_count == 0):
+        return chapters, None, 0
+    if(first_notes is None or marker_count == 0):
+        #the footnotes would stay in the last chapter, or there are markers without footnotes
+        raise UnsupportedDocument('footnote markers and footnotes do not match')
+    footer = []
+    footnote_num = 0
+    with stage('save_footers'):
+        for text in chain([first_notes], note_chunks):
+            soup = BeautifulSoup(text, parser or HTML_PARSER)
+            notes = soup.find('ol')
+            index = index_html(soup)
+            clean_indexed_html(soup, index, blockquotes_enabled)
+            if(index.h1 or index.footnote_markers() or any(fn.parent is not notes for fn in index.footnotes)):
+                raise UnsupportedDocument('chapters or footnote markers in the list of footnotes')
+            #the footnotes come after the last chapter
+            for a, h1 in index.anchors:
+                ids.setdefault(a['id'], last_title)
+            if(index.footnotes):
+                footnote_num = link_footnotes(index.footnotes, ids)
+            footer.extend(str(x) for x in notes.contents)
+            soup.decompose()
+    return chapters, ''.join(footer), footnote_num
@@ -0,0 +1,149 @@
+############################################
+# On disk cache for converted files, so that files which did not
+# change since the last build do not need to be converted again
+#
+import os, json, hashlib
+from importlib import metadata
+from parsing_libraries import Chapter
+
+CACHE_VERSION = 2 #change this whenever the conversion output changes, so old entries are not used
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'convert_files_to_epub')
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024 #bytes
+EVICTION_TARGET = 0.9 #evict shrinks the cache to this part of its max size, so the next puts don't have to evict again right away
+
+def converter_version():
+    """
+    Version string of everything that affects the conversion
+    """
+    versions = [str(CACHE_VERSION)]
+    for package in ['odfpy', 'mammoth', 'beautifulsoup4']:
+        try:
+            versions.append(package + '-' + metadata.version(package))
+        except metadata.PackageNotFoundError:
+            versions.append(package + '-unknown')
+    return ' '.join(versions)
+
+def hash_file(f_name):
+    """
+    Returns the sha256 of the file's content
+    """
+    sha = hashlib.sha256()
+    with open(f_name, 'rb') as open_f:
+        for block in iter(lambda: open_f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def result_to_json(result):
+    """
+    Copy of a conversion_pool.convert_file result that can be saved with json
+    """
+    to_save = dict(result)
+    to_save.pop('profile', None)
+    to_save['chapters'] = [[c.title, c.slug, c.html] for c in result['chapters']]
+    return to_save
+
+def result_from_json(result):
+    """
+    Opposite of result_to_json (changes result in place and returns it)
+    """
+    result['chapters'] = [Chapter(title, html, slug) for title, slug, html in result['chapters']]
+    return result
+
+class ConversionCache(object):
+    """
+    Stores the results of conversion_pool.convert_file as json files named after a hash of
+    the source file's content, the converter version and the options used for the conversion
+    Least recently used entries are removed when the cache gets bigger than max_size bytes
+    The size of the cache is read from the directory once (on the first put) and kept up to date by put,
+    so the directory is only scanned again when the entries have to be sorted to remove some
+    """
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size = max_size if max_size is not None else DEFAULT_CACHE_SIZE
+        self.version = converter_version()
+        self.total = None #bytes in the cache, None until it is needed
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, f_name, options, file_hash=None):
+        """
+        Cache key for a file converted with options (a dict, must be json serializable)
+        file_hash is the file's hash_file, if it is already known
+        """
+        sha = hashlib.sha256()
+        sha.update((file_hash or hash_file(f_name)).encode('utf-8'))
+        sha.update(self.version.encode('utf-8'))
+        sha.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        """
+        Returns the stored result or None if there is none
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as open_f:
+                result = json.load(open_f)
+        except (IOError, ValueError):
+            return None
+        #mark as recently used
+        os.utime(path, None)
+        return result_from_json(result)
+
+    def put(self, key, result):
+        path = self.path(key)
+        if(self.total is None):
+            self.total = sum(size for mtime, size, entry_path in self.scan())
+        temp_path = path + '.tmp' + str(os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as open_f:
+            json.dump(result_to_json(result), open_f)
+        size = os.path.getsize(temp_path)
+        try:
+            #an entry that is replaced doesn't count twice
+            self.total -= os.path.getsize(path)
+        except OSError:
+            pass
+        #replace is atomic, so other builds never read half written entries
+        os.replace(temp_path, path)
+        self.total += size
+        if(self.total > self.max_size):
+            self.evict()
+
+    def scan(self):
+        """
+        returns (modification time, size, path) of every entry in the cache
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if(not entry.name.endswith('.json')):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                #removed by another build
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size (with room to spare, see EVICTION_TARGET)
+        The directory is read again, other builds using the same cache may have changed it
+        """
+        entries = self.scan()
+        total = sum(size for mtime, size, path in entries)
+        if(total <= self.max_size):
+            self.total = total
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if(total <= self.max_size * EVICTION_TARGET):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total = total
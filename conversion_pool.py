@@ -0,0 +1,201 @@
+############################################
+# Converts the files of a book into chapters,
+# either one after the other or in a pool of processes
+#
+import os
+from itertools import repeat, chain
+from parsing_libraries import HTML_PARSER, prepare_html, split_chapters, find_footnote_markers, save_footers
+from standard_open_files_as_html import open_file_as_xhtml, open_odt_chapters, open_docx_reader, docx_to_xhtml, UnsupportedDocument
+from chunked_conversion import convert_xhtml_in_chunks, convert_html_chunks
+from bs4 import BeautifulSoup
+import profiling
+from profiling import stage
+
+DOCX_CHUNK_SIZE = 500000 #characters of html in each chunk of the docx fast path if no chunk_size is given
+
+def convert_file(f_name, options=None, profile=False):
+    """
+    Converts a single file into chapters
+    options is a dict with 'blockquotes_enabled' (default True), 'parser' (the html parser, default HTML_PARSER),
+    'odt_fast_path' (default True, see use_odt_fast_path), 'docx_fast_path' (default True, see use_docx_fast_path),
+    'chunk_size' and 'chunk_jobs' (see use_chunks)
+    If profile is True, the result also has the 'profile' of each stage (see profiling)
+    Footnotes are numbered starting from 1 in every file, iter_merged_chapters in parsing_libraries
+    renumbers them once all the files are done, so that files can be converted in any order
+    returns a dict with the chapters (list of Chapters), the footer html (or None)
+    and the number of the last footnote (0 if there are none)
+    """
+    options = options or {}
+    if(profile):
+        profiling.start(f_name)
+    try:
+        with stage('convert_file'):
+            converted = None
+            if(use_odt_fast_path(f_name, options)):
+                try:
+                    with stage('odf2chapters'):
+                        converted = open_odt_chapters(f_name, options.get('blockquotes_enabled', True))
+                except UnsupportedDocument:
+                    #BeautifulSoup can do what the fast path can't
+                    pass
+            if(use_docx_fast_path(f_name, options)):
+                try:
+                    with stage('docx2chapters'):
+                        converted = convert_docx_fast(f_name, options)
+                except UnsupportedDocument:
+                    #mammoth can do what the fast path can't
+                    pass
+            if(converted is None and use_chunks(f_name, options)):
+                converted = convert_docx_in_chunks(f_name, options)
+            if(converted is None):
+                converted = convert_with_soup(f_name, options)
+            chapters, footer, footnote_num = converted
+    finally:
+        if(profile):
+            records = profiling.stop()
+    result = {'file': f_name, 'chapters': chapters, 'footer': footer, 'footnote_num': footnote_num}
+    if(profile):
+        result['profile'] = records
+    return result
+
+def use_odt_fast_path(f_name, options):
+    """
+    odt files are converted straight into chapters (open_odt_chapters) unless options has 'odt_fast_path' False.
+    It gives the same html as BeautifulSoup with html.parser, so it is not used if another parser is chosen
+    """
+    return (os.path.splitext(f_name)[-1].lower() == '.odt' and options.get('odt_fast_path', True)
+        and options.get('parser', None) in (None, HTML_PARSER))
+
+def use_docx_fast_path(f_name, options):
+    """
+    docx files are read in chunks without mammoth (see convert_docx_fast) unless options has 'docx_fast_path' False.
+    It gives the same html as mammoth, so it is used whatever the parser
+    """
+    return os.path.splitext(f_name)[-1].lower() == '.docx' and options.get('docx_fast_path', True)
+
+def convert_docx_fast(f_name, options):
+    """
+    Reads the docx file a chunk of options['chunk_size'] characters (DOCX_CHUNK_SIZE if it is not given) at a time
+    with docx_converters and converts the chunks as they come, or the whole html at once if it is only one chunk
+    returns the chapters, the footer html and the number of the last footnote
+    Raises UnsupportedDocument if the file has to be converted with mammoth
+    """
+    reader = open_docx_reader(f_name)
+    chunk_size = options.get('chunk_size', None) or DOCX_CHUNK_SIZE
+    chunks = reader.iter_body_chunks(chunk_size)
+    first = next(chunks, '')
+    second = next(chunks, None)
+    if(second is None):
+        with stage('parse'):
+            html_form = BeautifulSoup(first + ''.join(reader.iter_note_chunks()), options.get('parser', None) or HTML_PARSER)
+        del first
+        return convert_soup(html_form, options)
+    return convert_html_chunks(chain([first, second], chunks), reader.iter_note_chunks(chunk_size), options)
+
+def use_chunks(f_name, options):
+    """
+    docx files are converted in chunks of options['chunk_size'] characters of html (see chunked_conversion)
+    if it is given, with options['chunk_jobs'] processes (default 1). This keeps the memory used by huge files down
+    """
+    return os.path.splitext(f_name)[-1].lower() == '.docx' and options.get('chunk_size', None) is not None
+
+def convert_docx_in_chunks(f_name, options):
+    """
+    Converts the docx file chunk by chunk, or as a whole if it can't be (see convert_xhtml_in_chunks),
+    returns the chapters, the footer html and the number of the last footnote
+    """
+    with stage('mammoth'):
+        xhtml = docx_to_xhtml(f_name)
+    try:
+        return convert_xhtml_in_chunks(xhtml, options)
+    except UnsupportedDocument:
+        pass
+    with stage('parse'):
+        html_form = BeautifulSoup(xhtml, options.get('parser', None) or HTML_PARSER)
+    del xhtml
+    return convert_soup(html_form, options)
+
+def convert_with_soup(f_name, options):
+    """
+    Converts the file with BeautifulSoup, returns the chapters, the footer html and the number of the last footnote
+    """
+    return convert_soup(open_file_as_xhtml(f_name, options.get('parser', None), False), options)
+
+def convert_soup(html_form, options):
+    """
+    Converts the soup of a file that has not been cleaned up yet (see open_file_as_xhtml), like convert_with_soup
+    """
+    with stage('prepare_html'):
+        #cleanup, blockquotes, story breaks and chapter titles
+        html_form, index = prepare_html(html_form, options.get('blockquotes_enabled', True))
+    footer = None
+    footnote_num = 0
+    with stage('save_footers'):
+        if(index is not None):
+            has_footnotes = len(index.footnote_markers()) > 0
+        else:
+            has_footnotes = html_form.find(find_footnote_markers) is not None
+        if(has_footnotes):
+            #we have footnotes
+            html_form, footer, footnote_num = save_footers(html_form, index=index)
+    with stage('split_chapters'):
+        chapters = split_chapters(html_form)
+    return chapters, footer, footnote_num
+
+def get_jobs(jobs):
+    """
+    Number of processes to use, 0 or less means use all the cpus
+    """
+    if(jobs is None):
+        return 1
+    jobs = int(jobs)
+    if(jobs <= 0):
+        jobs = os.cpu_count() or 1
+    return jobs
+
+def iter_convert_files(files, options=None, jobs=1, cache=None, profile=False):
+    """
+    Converts all files with options (see convert_file) and yields the results of convert_file in the same order as files,
+    each one as soon as it (and the ones before it) are done
+    If jobs is more than 1, files are converted concurrently in that many processes
+    If a conversion_cache.ConversionCache is given, files that are already in it are not converted again
+    If profile is True, the results of files that were converted have the 'profile' of each stage
+    """
+    cached = [None] * len(files)
+    keys = [None] * len(files)
+    if(cache is not None):
+        #the options are part of the key, converting with other options gives other html
+        for i, f in enumerate(files):
+            keys[i] = cache.key(f, options)
+            cached[i] = cache.get(keys[i])
+            if(cached[i] is not None):
+                cached[i]['file'] = f
+    to_convert = [f for f, result in zip(files, cached) if result is None]
+    jobs = min(get_jobs(jobs), len(to_convert))
+    executor = None
+    if(jobs <= 1):
+        converted = (convert_file(f, options, profile) for f in to_convert)
+    else:
+        #multiprocessing takes a while to import, and most builds don't need it
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        #map keeps the original order, so chapters are still assembled in order
+        converted = executor.map(convert_file, to_convert, repeat(options), repeat(profile))
+    try:
+        for i, result in enumerate(cached):
+            if(result is None):
+                result = next(converted)
+                if(cache is not None):
+                    cache.put(keys[i], result)
+            cached[i] = None #don't keep results around once they are used
+            yield result
+    finally:
+        if(executor is not None):
+            executor.shutdown(cancel_futures=True)
+
+def convert_files(files, options=None, jobs=1, cache=None):
+    """
+    Converts all files with options (see convert_file) and returns the results of convert_file in the same order as files
+    See iter_convert_files
+    """
+    return list(iter_convert_files(files, options, jobs, cache))
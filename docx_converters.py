@@ -0,0 +1,490 @@
+############################################
+# Converts a docx file to the same html mammoth makes of it (see standard_open_files_as_html.docx_to_xhtml)
+# without a tree of the whole document: word/document.xml is read out of the archive with iterparse,
+# one paragraph at a time, and the html comes out in chunks cut before h1 tags (see chunked_conversion)
+# Only what mammoth does with its default style map for text documents is done here: headings, bold, italic,
+# strikethrough, superscript and subscript, line breaks, bookmarks, hyperlinks and footnotes.
+# Documents with anything else (tables, lists, images, fields, endnotes...) raise UnsupportedDocument
+# and are converted with mammoth instead
+# Imported only when a docx file is converted, see standard_open_files_as_html
+#
+import zipfile, posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from standard_open_files_as_html import WINDOWS_1252, UnsupportedDocument
+
+#the prefixes mammoth gives the namespaces of docx files, element names are written with them here
+NAMESPACES = {
+    'http://schemas.openxmlformats.org/wordprocessingml/2006/main': 'w',
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships': 'r',
+    'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing': 'wp',
+    'http://schemas.openxmlformats.org/drawingml/2006/main': 'a',
+    'http://schemas.openxmlformats.org/drawingml/2006/picture': 'pic',
+    'http://purl.oclc.org/ooxml/wordprocessingml/main': 'w',
+    'http://purl.oclc.org/ooxml/officeDocument/relationships': 'r',
+    'http://purl.oclc.org/ooxml/drawingml/wordprocessingDrawing': 'wp',
+    'http://purl.oclc.org/ooxml/drawingml/main': 'a',
+    'http://purl.oclc.org/ooxml/drawingml/picture': 'pic',
+    'http://schemas.openxmlformats.org/package/2006/relationships': 'relationships',
+    'http://schemas.openxmlformats.org/markup-compatibility/2006': 'mc',
+    'urn:schemas-microsoft-com:vml': 'v',
+    'urn:schemas-microsoft-com:office:word': 'office-word',
+    'http://schemas.microsoft.com/office/word/2010/wordml': 'wordml',
+}
+RELATIONSHIP_TYPES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+STYLE_MAP_PATH = 'mammoth/style-map'
+#elements mammoth reads that are not done here, the document has to be converted with mammoth
+UNSUPPORTED_ELEMENTS = frozenset(['w:fldChar', 'w:instrText', 'w:sym', 'w:tbl', 'w:tr', 'w:tc', 'w:object', 'w:drawing',
+    'v:group', 'v:rect', 'v:roundrect', 'v:shape', 'v:textbox', 'w:txbxContent', 'w:pict', 'wp:inline', 'wp:anchor',
+    'v:imagedata', 'w:endnoteReference', 'mc:AlternateContent', 'w:sdt'])
+#elements whose children are read as if they were not there
+TRANSPARENT_ELEMENTS = frozenset(['w:customXml', 'w:ins', 'w:moveFromRangeEnd', 'w:moveFromRangeStart', 'w:moveTo',
+    'w:moveToRangeEnd', 'w:moveToRangeStart', 'w:smartTag'])
+VOID_TAGS = frozenset(['br', 'hr', 'img', 'input'])
+#paragraph styles of mammoth's default style map, everything else is a p tag
+HEADING_STYLE_IDS = dict(('Heading%d' % i, 'h%d' % i) for i in range(1, 7))
+HEADING_STYLE_NAMES = dict(('HEADING %d' % i, 'h%d' % i) for i in range(1, 7)) #names are matched in upper case
+NOTE_STYLE_NAMES = frozenset(['FOOTNOTE TEXT', 'ENDNOTE TEXT', 'ANNOTATION TEXT', 'FOOTNOTE', 'ENDNOTE'])
+UP_ARROW = '↑'
+
+class HtmlElement(object):
+    """
+    An html element like mammoth's: collapsible elements are merged into the element before them if it has the same tag
+    and attributes (runs next to each other that are both bold are one strong tag)
+    """
+    __slots__ = ('tag', 'attributes', 'children', 'collapsible')
+    def __init__(self, tag, attributes, children, collapsible=False):
+        self.tag = tag
+        self.attributes = attributes
+        self.children = children
+        self.collapsible = collapsible
+
+#child of an element that has to be written even if it has nothing else in it (bookmarks)
+FORCE_WRITE = object()
+
+def strip_empty(nodes):
+    """
+    Removes empty text and the elements with nothing in them (except void ones), like mammoth
+    """
+    stripped = []
+    for node in nodes:
+        if(isinstance(node, str)):
+            if(node):
+                stripped.append(node)
+        elif(node is FORCE_WRITE):
+            stripped.append(node)
+        else:
+            node.children = strip_empty(node.children)
+            if(node.children or node.tag in VOID_TAGS):
+                stripped.append(node)
+    return stripped
+
+def collapsing_add(collapsed, node):
+    """
+    Adds node to the list of nodes collapsed, merging it into the last one if it can be
+    """
+    if(isinstance(node, HtmlElement)):
+        node.children = collapse(node.children)
+        last = collapsed[-1] if collapsed else None
+        if(node.collapsible and isinstance(last, HtmlElement) and last.tag == node.tag and last.attributes == node.attributes):
+            for child in node.children:
+                collapsing_add(last.children, child)
+            return
+    collapsed.append(node)
+
+def collapse(nodes):
+    collapsed = []
+    for node in nodes:
+        collapsing_add(collapsed, node)
+    return collapsed
+
+def escape_html(text):
+    return escape(text, {'"': '&quot;'})
+
+def write_html(nodes, output):
+    """
+    Appends the html of the nodes to the list output, written the way mammoth writes it
+    """
+    for node in nodes:
+        if(isinstance(node, str)):
+            output.append(escape_html(node))
+        elif(node is FORCE_WRITE):
+            continue
+        else:
+            attributes = ''.join(' %s="%s"' % (key, escape_html(node.attributes[key])) for key in sorted(node.attributes))
+            if(not node.children and node.tag in VOID_TAGS):
+                output.append('<%s%s />' % (node.tag, attributes))
+            else:
+                output.append('<%s%s>' % (node.tag, attributes))
+                write_html(node.children, output)
+                output.append('</%s>' % node.tag)
+
+def node_html(node):
+    """
+    The html of a node, with the characters BeautifulSoup reads differently changed like docx_to_xhtml does
+    """
+    output = []
+    write_html([node], output)
+    html = ''.join(output)
+    if(not html.isascii()):
+        html = html.translate(WINDOWS_1252)
+    return html
+
+QUALIFIED_NAMES = {}
+
+def qualified_name(name):
+    """
+    The name of an element or attribute as mammoth writes it ('w:p' instead of '{namespace}p')
+    """
+    if(name not in QUALIFIED_NAMES):
+        uri, sep, local = name[1:].partition('}')
+        if(name.startswith('{') and sep and uri in NAMESPACES):
+            QUALIFIED_NAMES[name] = NAMESPACES[uri] + ':' + local
+        else:
+            QUALIFIED_NAMES[name] = name
+    return QUALIFIED_NAMES[name]
+
+def attribute(element, name):
+    """
+    The value of the attribute name (like 'w:val') of an element, None if it doesn't have it
+    """
+    for key, value in element.attrib.items():
+        if(qualified_name(key) == name):
+            return value
+    return None
+
+def find_child(element, name):
+    if(element is None):
+        return None
+    for child in element:
+        if(qualified_name(child.tag) == name):
+            return child
+    return None
+
+def child_attribute(element, name, attribute_name):
+    child = find_child(element, name)
+    return None if child is None else attribute(child, attribute_name)
+
+def read_boolean(element):
+    return element is not None and attribute(element, 'w:val') not in ('false', '0')
+
+def join_part_path(base, target):
+    if(target.startswith('/')):
+        return target.lstrip('/')
+    return (base + '/' + target if base else target).lstrip('/')
+
+def relationships_path(name):
+    base, f_name = posixpath.split(name)
+    return join_part_path(base, '_rels/' + f_name + '.rels')
+
+class DocxHtmlReader(object):
+    """
+    Reads a docx file into the html mammoth.convert_to_html makes of it, a paragraph at a time
+    The styles, numbering and footnotes are read when it is made, iter_body_chunks reads the document,
+    iter_note_chunks gives the list of footnotes afterwards
+    Raises UnsupportedDocument (when it is made or while the chunks are read) for documents it can't read like mammoth
+    """
+    def __init__(self, f_name):
+        self.archive = zipfile.ZipFile(f_name)
+        try:
+            self.names = set(self.archive.namelist())
+            if(STYLE_MAP_PATH in self.names):
+                raise UnsupportedDocument('the document has a style map of its own')
+            self.document_path = self.find_document_path()
+            self.relationships = self.read_relationships(relationships_path(self.document_path))
+            base = posixpath.dirname(self.document_path)
+            self.paragraph_styles = {}
+            self.character_styles = {}
+            styles = self.read_part(self.find_part_path('styles', base))
+            if(styles is not None):
+                self.read_styles(styles)
+            self.num_ids = set()
+            self.numbered_styles = set()
+            numbering = self.read_part(self.find_part_path('numbering', base))
+            if(numbering is not None):
+                self.read_numbering(numbering)
+            self.note_references = [] #footnote ids in the order they are referenced in the document
+            self.notes = {} #footnote id: html of its li tag
+            self.reading_notes = False
+            footnotes_path = self.find_part_path('footnotes', base)
+            if(footnotes_path in self.names):
+                self.read_footnotes(footnotes_path)
+        except:
+            #iter_body_html closes the archive once it is read, if the reader is not made nothing will
+            self.archive.close()
+            raise
+
+    def read_part(self, name):
+        if(name not in self.names):
+            return None
+        with self.archive.open(name) as open_f:
+            return ET.parse(open_f).getroot()
+
+    def read_relationships(self, name):
+        """
+        returns {id: target} and {type: [targets]} of the relationships in the part name
+        """
+        targets = {}
+        types = {}
+        root = self.read_part(name)
+        if(root is not None):
+            for element in root:
+                if(qualified_name(element.tag) == 'relationships:Relationship'):
+                    targets[element.get('Id')] = element.get('Target')
+                    types.setdefault(element.get('Type'), []).append(element.get('Target'))
+        return targets, types
+
+    def find_document_path(self):
+        targets, types = self.read_relationships('_rels/.rels')
+        for target in types.get(RELATIONSHIP_TYPES + 'officeDocument', []):
+            if(join_part_path('', target) in self.names):
+                return join_part_path('', target)
+        if('word/document.xml' not in self.names):
+            raise UnsupportedDocument('no main document part')
+        return 'word/document.xml'
+
+    def find_part_path(self, name, base):
+        for target in self.relationships[1].get(RELATIONSHIP_TYPES + name, []):
+            if(join_part_path(base, target) in self.names):
+                return join_part_path(base, target)
+        return 'word/%s.xml' % name
+
+    def read_styles(self, root):
+        for element in root:
+            if(qualified_name(element.tag) != 'w:style'):
+                continue
+            style_id = attribute(element, 'w:styleId')
+            styles = {'paragraph': self.paragraph_styles, 'character': self.character_styles}.get(attribute(element, 'w:type'))
+            #the first style with an id is the one that counts
+            if(styles is not None and style_id not in styles):
+                styles[style_id] = child_attribute(element, 'w:name', 'w:val')
+
+    def read_numbering(self, root):
+        """
+        Keeps the numbering ids and the paragraph styles that are numbered, paragraphs with those are list items
+        """
+        for element in root:
+            name = qualified_name(element.tag)
+            if(name == 'w:num'):
+                self.num_ids.add(attribute(element, 'w:numId'))
+            elif(name == 'w:abstractNum'):
+                for level in element:
+                    if(qualified_name(level.tag) == 'w:lvl'):
+                        style_id = child_attribute(level, 'w:pStyle', 'w:val')
+                        if(style_id is not None):
+                            self.numbered_styles.add(style_id)
+
+    def iter_part_elements(self, name, depth):
+        """
+        Yields the elements of the part name that are depth levels down (1 is the root), each one once it is read whole.
+        They are removed from the tree afterwards, so the tree never gets bigger than one of them
+        """
+        parents = []
+        with self.archive.open(name) as open_f:
+            for event, element in ET.iterparse(open_f, events=('start', 'end')):
+                if(event == 'start'):
+                    parents.append(element)
+                    continue
+                parents.pop()
+                if(len(parents) == depth - 1):
+                    yield parents, element
+                    if(parents):
+                        parents[-1].remove(element)
+
+    def read_footnotes(self, name):
+        self.part_relationships = self.read_relationships(relationships_path(name))
+        self.reading_notes = True
+        for parents, element in self.iter_part_elements(name, 2):
+            if(qualified_name(element.tag) != 'w:footnote' or attribute(element, 'w:type') in ('continuationSeparator', 'separator')):
+                continue
+            note_id = attribute(element, 'w:id')
+            back_link = HtmlElement('p', {}, [' ', HtmlElement('a', {'href': '#footnote-ref-' + note_id}, [UP_ARROW])], True)
+            li = HtmlElement('li', {'id': 'footnote-' + note_id}, self.read_children(element) + [back_link])
+            self.notes[note_id] = node_html(collapse(strip_empty([li]))[0])
+        self.reading_notes = False
+
+    def iter_body_html(self):
+        """
+        Yields the html of each element of the body of the document, and whether it is an h1 tag
+        """
+        self.part_relationships = self.relationships
+        top = [] #the last element could still take in the ones after it, see collapsing_add
+        body = None
+        try:
+            for parents, element in self.iter_part_elements(self.document_path, 3):
+                #only the first body counts
+                if(body is None and qualified_name(parents[-1].tag) == 'w:body'):
+                    body = parents[-1]
+                if(parents[-1] is not body):
+                    continue
+                for node in strip_empty(self.read(element)):
+                    collapsing_add(top, node)
+                while(len(top) > 1):
+                    node = top.pop(0)
+                    yield node_html(node), isinstance(node, HtmlElement) and node.tag == 'h1'
+        finally:
+            #the footnotes are read already
+            self.archive.close()
+        if(body is None):
+            raise UnsupportedDocument('the document has no body')
+        for node in top:
+            yield node_html(node), isinstance(node, HtmlElement) and node.tag == 'h1'
+
+    def iter_body_chunks(self, chunk_size):
+        """
+        Yields the html of the body in chunks cut before h1 tags once they have at least chunk_size characters,
+        the first chunk goes on at least until the second h1 (like chunked_conversion.find_chunks)
+        """
+        chunk = []
+        size = 0
+        has_h1 = False
+        for html, is_h1 in self.iter_body_html():
+            if(is_h1):
+                if(has_h1 and size >= chunk_size):
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+                has_h1 = True
+            chunk.append(html)
+            size += len(html)
+        if(chunk):
+            yield ''.join(chunk)
+
+    def iter_note_chunks(self, chunk_size=None):
+        """
+        Yields the list of footnotes of the document (once the body is read) in chunks of at least chunk_size characters,
+        each one in an ol tag, or all of it in one chunk if chunk_size is None
+        """
+        chunk = []
+        size = 0
+        for note_id in self.note_references:
+            if(note_id not in self.notes):
+                raise UnsupportedDocument('reference to a missing footnote ' + note_id)
+            if(chunk and chunk_size is not None and size >= chunk_size):
+                yield '<ol>' + ''.join(chunk) + '</ol>'
+                chunk = []
+                size = 0
+            chunk.append(self.notes[note_id])
+            size += len(self.notes[note_id])
+        if(chunk):
+            yield '<ol>' + ''.join(chunk) + '</ol>'
+
+    def read(self, element):
+        """
+        The html nodes of a docx element
+        """
+        name = qualified_name(element.tag)
+        if(name == 'w:p'):
+            return self.read_paragraph(element)
+        elif(name == 'w:r'):
+            return self.read_run(element)
+        elif(name == 'w:t'):
+            return [''.join(element.itertext())]
+        elif(name == 'w:tab'):
+            return ['\t']
+        elif(name == 'w:noBreakHyphen'):
+            return ['\u2011']
+        elif(name == 'w:softHyphen'):
+            return ['\u00ad']
+        elif(name == 'w:br'):
+            if(attribute(element, 'w:type') in (None, '', 'textWrapping')):
+                return [HtmlElement('br', {}, [])]
+            return [] #page and column breaks
+        elif(name == 'w:bookmarkStart'):
+            bookmark = attribute(element, 'w:name')
+            if(bookmark == '_GoBack'):
+                return []
+            return [HtmlElement('a', {'id': str(bookmark)}, [FORCE_WRITE], True)]
+        elif(name == 'w:hyperlink'):
+            return self.read_hyperlink(element)
+        elif(name == 'w:footnoteReference'):
+            return self.read_footnote_reference(element)
+        elif(name == 'w:commentReference'):
+            return [] #mammoth leaves comments out
+        elif(name in TRANSPARENT_ELEMENTS):
+            return self.read_children(element)
+        elif(name in UNSUPPORTED_ELEMENTS):
+            raise UnsupportedDocument(name + ' elements are not supported')
+        return [] #mammoth ignores the rest too
+
+    def read_children(self, element):
+        nodes = []
+        for child in element:
+            nodes.extend(self.read(child))
+        return nodes
+
+    def read_paragraph(self, element):
+        properties = find_child(element, 'w:pPr')
+        if(find_child(find_child(properties, 'w:rPr'), 'w:del') is not None):
+            raise UnsupportedDocument('deleted paragraphs are not supported')
+        return [HtmlElement(self.paragraph_tag(properties), {}, self.read_children(element))]
+
+    def paragraph_tag(self, properties):
+        """
+        The tag mammoth's default style map gives a paragraph with these properties
+        """
+        style_id = child_attribute(properties, 'w:pStyle', 'w:val')
+        style_name = self.paragraph_styles.get(style_id)
+        style_name = style_name.upper() if style_name is not None else None
+        if(style_id in HEADING_STYLE_IDS):
+            return HEADING_STYLE_IDS[style_id]
+        if(style_name in HEADING_STYLE_NAMES):
+            return HEADING_STYLE_NAMES[style_name]
+        if(style_id == 'Heading' or style_name == 'HEADING'):
+            return 'h1'
+        if(style_name in NOTE_STYLE_NAMES):
+            return 'p'
+        num_id = child_attribute(find_child(properties, 'w:numPr'), 'w:numId', 'w:val')
+        if((num_id is not None and num_id in self.num_ids) or style_id in self.numbered_styles):
+            raise UnsupportedDocument('lists are not supported')
+        return 'p'
+
+    def read_run(self, element):
+        properties = find_child(element, 'w:rPr')
+        nodes = self.read_children(element)
+        #the same order as mammoth, the last one is the outermost tag
+        tags = []
+        if(read_boolean(find_child(properties, 'w:strike'))):
+            tags.append('s')
+        vertical_alignment = child_attribute(properties, 'w:vertAlign', 'w:val')
+        if(vertical_alignment == 'subscript'):
+            tags.append('sub')
+        elif(vertical_alignment == 'superscript'):
+            tags.append('sup')
+        if(read_boolean(find_child(properties, 'w:i'))):
+            tags.append('em')
+        if(read_boolean(find_child(properties, 'w:b'))):
+            tags.append('strong')
+        style_name = self.character_styles.get(child_attribute(properties, 'w:rStyle', 'w:val'))
+        if(style_name is not None and style_name.upper() == 'STRONG'):
+            tags.append('strong')
+        for tag in tags:
+            nodes = [HtmlElement(tag, {}, nodes, True)]
+        return nodes
+
+    def read_hyperlink(self, element):
+        relationship_id = attribute(element, 'r:id')
+        anchor = attribute(element, 'w:anchor')
+        nodes = self.read_children(element)
+        if(relationship_id is not None):
+            href = self.part_relationships[0].get(relationship_id)
+            if(href is None):
+                raise UnsupportedDocument('hyperlink to a missing relationship ' + relationship_id)
+            if(anchor is not None):
+                href = href.split('#')[0] + '#' + anchor
+        elif(anchor is not None):
+            href = '#' + anchor
+        else:
+            return nodes
+        attributes = {'href': href}
+        if(attribute(element, 'w:tgtFrame')):
+            attributes['target'] = attribute(element, 'w:tgtFrame')
+        return [HtmlElement('a', attributes, nodes, True)]
+
+    def read_footnote_reference(self, element):
+        if(self.reading_notes):
+            raise UnsupportedDocument('footnote references inside footnotes are not supported')
+        note_id = attribute(element, 'w:id')
+        self.note_references.append(note_id)
+        a = HtmlElement('a', {'href': '#footnote-' + note_id, 'id': 'footnote-ref-' + note_id}, ['[%d]' % len(self.note_references)])
+        return [HtmlElement('sup', {}, [a])]
@@ -0,0 +1,520 @@
+############################################
+# Converters from odt (with odfpy) to the xhtml open_odt parses with BeautifulSoup,
+# or straight to chapters (the fast path used by open_odt_chapters)
+# Imported only when an odt file is converted, see standard_open_files_as_html
+#
+from odf.odf2xhtml import ODF2XHTML, special_styles
+from odf.namespaces import *
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLTreeBuilder
+from xml.sax.saxutils import escape
+from html import unescape
+import sys, io
+from parsing_libraries import STORY_BREAK_REGEX, FOOTNOTE_DOC_TITLE, Chapter, slugify
+from standard_open_files_as_html import WINDOWS_1252, UnsupportedDocument
+
+class SimpleODF2XHTML(ODF2XHTML):
+    """
+    Modifying ODF2XHTML so that it doesn't keep any css and also need to change the way it does a few things
+    """
+    def __init__(self, generate_css=False, embedable=False, character_references=False):
+        """
+        If character_references is True, the xhtml is us-ascii with character references for everything else,
+        otherwise it has the characters themselves (which is the same once BeautifulSoup has read it)
+        """
+        super().__init__(generate_css, embedable)
+        self.character_references = character_references
+        self.output = io.StringIO()
+        self.elements[(TEXTNS, 'deletion')] = (self.s_ignorexml, None)
+        self.elements[(TEXTNS, 'span')] = (self.s_text_span_convert, self.e_text_span_convert)
+        #tags for each style, see s_office_text
+        self.span_styles = {}
+        self.paragraph_styles = {}
+
+    def e_text_note_body(self, tag, attrs):
+        """
+        Hacked to make it not write out the opening and closing p tag
+        Note: multi-paragraph footnotes not currently supported, and will be forced
+        to one paragraph.
+        """
+        self._wfunc = self._orgwfunc
+        #my code
+        #remove p tags because we need to put stuff before ending p tag
+        #useless spans are occasionally in there too, seems to happen in files converted from docx
+        self.notebody = [i for i in self.notebody if i not in ['<p>', '</p>', '<span>', '</span>']]
+        #end my code
+        self.notedict[self.currentnote]['body'] = ''.join(self.notebody)
+        self.notebody = ''
+        del self._orgwfunc
+
+    def e_text_note_citation(self, tag, attrs):
+        """
+        Hacked so that sup tags come first before a tag and also so that the text is enclosed in brackets
+        """
+        mark = ''.join(self.data)
+        self.notedict[self.currentnote]['citation'] = mark
+        self.opentag('sup')
+        self.opentag('a',{ 'href': "#footnote-%s" % self.currentnote , 'id' : "footnote-ref-%s" % self.currentnote})
+        # Since HTML only knows about endnotes, there is too much risk that the
+        # marker is reused in the source. Therefore we force numeric markers
+        if sys.version_info[0]==3:
+            self.writeout("[%s]" % str(self.currentnote))
+        else:
+            self.writeout(unicode(self.currentnote))
+        self.closetag('a')
+        self.closetag('sup')
+    def generate_footnotes(self):
+        """
+        Hacked so that footnotes include a reference to go back to where it is referenced
+        """
+        if self.currentnote == 0:
+            return
+        if self.generate_css:
+            self.opentag('ol', {'style':'border-top: 1px solid black'}, True)
+        else:
+            self.opentag('ol')
+        for key in range(1,self.currentnote+1):
+            note = self.notedict[key]
+            self.opentag('li', { 'id':"footnote-%d" % key })
+            self.opentag('p')
+            self.writeout(note['body'])
+            self.opentag('a', {'href': "#footnote-ref-%s" % key})
+            self.writeout('↑')
+            self.closetag('a')
+            self.closetag('p')
+            self.closetag('li')
+        self.closetag('ol')
+
+    def load(self, odffile):
+        self.output = io.StringIO()
+        super().load(odffile)
+
+    def _wlines(self, s):
+        """
+        The xhtml is written as it is made instead of being kept as a list of lines
+        that is joined, encoded and decoded again at the end
+        If there are footnotes, some of the lines are integers, so those are made into strings
+        """
+        if(not isinstance(s, str)):
+            s = str(s)
+        if(not s.isascii()):
+            if(self.character_references):
+                s = s.encode('us-ascii','xmlcharrefreplace').decode('us-ascii')
+            else:
+                s = s.translate(WINDOWS_1252)
+        self.output.write(s)
+
+    def xhtml(self):
+        """ Returns the xhtml
+        """
+        return self.output.getvalue()
+
+    def s_office_text(self, tag, attrs):
+        """
+        The styles have all been read when the text starts, so what the span and p handlers
+        need from each style is worked out here once instead of on every tag
+        """
+        self.span_styles = {None: ()}
+        self.paragraph_styles = {None: ('p', {}, ())}
+        for name in self.styledict:
+            if(name.startswith('.S-')):
+                self.span_styles[name[3:]] = self.get_span_style(name[3:])
+            elif(name.startswith('.P-')):
+                self.paragraph_styles[name[3:]] = self.get_paragraph_style(name[3:])
+        super().s_office_text(tag, attrs)
+
+    def get_style_tags(self, style_name, prefix):
+        """
+        The tags for the bold and italic of a style, in the order they are opened
+        (if it is both, an em tag inside a strong tag)
+        """
+        font_weight, font_style = self.get_font_weight_and_style(style_name, prefix)
+        tags = []
+        if(font_weight == 'bold'):
+            tags.append('strong')
+        if(font_style == 'italic'):
+            tags.append('em')
+        return tuple(tags)
+
+    def get_span_style(self, c):
+        """
+        The tags a text:span with style c becomes, nothing if it is neither bold nor italic
+        (not saving formating so spans are useless)
+        """
+        if(not c):
+            return ()
+        return self.get_style_tags(c, '.S-')
+
+    def get_paragraph_style(self, c):
+        """
+        The tag a text:p with style c becomes, its attributes and the tags for bold and italic inside it
+        """
+        htmlattrs = {}
+        specialtag = "p"
+        tags = ()
+        if c:
+            tags = self.get_style_tags(c, '.P-')
+            c = c.replace(".","_")
+            specialtag = special_styles.get("P-"+c)
+            if specialtag is None:
+                specialtag = 'p'
+                if self.generate_css:
+                    htmlattrs['class'] = "P-%s" % c
+        return specialtag, htmlattrs, tags
+
+    def s_text_span_convert(self, tag, attrs):
+        """ 
+        This will change text:span to em or strong tags, replacing the existing method in base class.
+        If it cannot figure out whether it is bold or italic, it will leave out the span tag.
+        If it is both, it will create an em tag inside a strong tag.
+        """
+        self.writedata()
+        c = attrs.get( (TEXTNS,'style-name'), None)
+        tags = self.span_styles.get(c)
+        if(tags is None):
+            #style that isn't in the styles
+            tags = self.span_styles[c] = self.get_span_style(c)
+        for tag in tags:
+            self.opentag(tag, {})
+        self.purgedata()
+    def e_text_span_convert(self, tag, attrs):
+        """ 
+        This will change text:span to em or strong tags.
+        """
+        self.writedata()
+        c = attrs.get( (TEXTNS,'style-name'), None)
+        tags = self.span_styles.get(c)
+        if(tags is None):
+            tags = self.span_styles[c] = self.get_span_style(c)
+        for tag in reversed(tags):
+            self.closetag(tag, False)
+        self.purgedata()
+    def s_text_p(self, tag, attrs):
+        """ have to look for bold and italic because 
+        some p tags might just have that in the css, which we're throwing away
+        """
+        c = attrs.get( (TEXTNS,'style-name'), None)
+        style = self.paragraph_styles.get(c)
+        if(style is None):
+            style = self.paragraph_styles[c] = self.get_paragraph_style(c)
+        specialtag, htmlattrs, tags = style
+        self.opentag(specialtag, htmlattrs)
+        for tag in tags:
+            self.opentag(tag, {})
+        self.purgedata()
+
+    def e_text_p(self, tag, attrs):
+        """ End Paragraph
+        """
+        c = attrs.get( (TEXTNS,'style-name'), None)
+        style = self.paragraph_styles.get(c)
+        if(style is None):
+            style = self.paragraph_styles[c] = self.get_paragraph_style(c)
+        specialtag, htmlattrs, tags = style
+        self.writedata()
+        for tag in reversed(tags):
+            self.closetag(tag, {})
+        self.closetag(specialtag)
+        self.purgedata()
+    def get_font_weight_and_style(self, style_name, prefix):
+        c = style_name
+        item_style = self.styledict.get(prefix +  c, {})
+        font_style = item_style.get(('urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0', 'font-style'))
+        font_weight = item_style.get(('urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0', 'font-weight'))
+        return font_weight, font_style
+
+#what the BeautifulSoup html.parser path does with the html, so the fast path can do the same
+VOID_TAGS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+PRESERVE_WHITESPACE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+ASCII_SPACES = BeautifulSoup.ASCII_SPACES
+
+def attribute_html(key, value):
+    """
+    An attribute the way BeautifulSoup writes it
+    """
+    value = escape(value.translate(WINDOWS_1252))
+    quote = '"'
+    if('"' in value):
+        if("'" in value):
+            value = value.replace('"', '&quot;')
+        else:
+            quote = "'"
+    return ' ' + key + '=' + quote + value + quote
+
+class HtmlElement(object):
+    """
+    An element that ChapterODF2XHTML is writing: its html so far and enough about its children
+    to know what the .string of it would be in BeautifulSoup
+    """
+    __slots__ = ('tag', 'attrs', 'pieces', 'segment', 'count', 'first', 'anchor')
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.pieces = [] #html of the children
+        self.segment = [] #text that isn't ended by a tag yet
+        self.count = 0 #number of children
+        self.first = None #.string of the first child
+        self.anchor = False #h1 that had its anchor left out
+
+    def add(self, html, string):
+        self.pieces.append(html)
+        self.count += 1
+        if(self.count == 1):
+            self.first = string
+
+    def string(self):
+        if(self.count == 1):
+            return self.first
+        return None
+
+    def html(self):
+        attrs = ''.join(attribute_html(key, value) for key, value in self.attrs.items())
+        return '<%s%s>%s</%s>' % (self.tag, attrs, ''.join(self.pieces), self.tag)
+
+class ChapterODF2XHTML(SimpleODF2XHTML):
+    """
+    Fast path for odt files: makes the chapters while the document is read instead of writing xhtml
+    for BeautifulSoup, with the same html that open_file_as_xhtml and conversion_pool.convert_file give
+    (with html.parser): no spans, no empty p tags, no anchors in h1 tags, blockquotes, story breaks,
+    chapter titles and the footnotes taken out into the footer
+    Nothing but the chapter being written is kept, there is no tree of the whole document
+    Documents it can't do the same way (no h1 tags, h1 tags in lists, links in headers and so on)
+    raise UnsupportedDocument
+    """
+    def __init__(self, blockquotes_enabled=True):
+        super().__init__()
+        self.blockquotes_enabled = blockquotes_enabled
+        self.stack = [] #open elements, empty outside of the body
+        self.root = None
+        self.main_stack = None #stack of the body while a footnote is written
+        self.quotes = [] #html of the open blockquotes
+        self.page = None #html of the chapter being written
+        self.chapter_title = None #.string of its h1 tag
+        self.chapters = []
+        self.footer = None
+        self.footnote_num = 0
+
+    def in_note(self):
+        return self.stack[0] is not self.root
+
+    def text(self, s):
+        if(self.stack and s):
+            self.stack[-1].segment.append(s)
+
+    def writeout(self, s):
+        if(self.stack and s):
+            if('<' in s):
+                raise UnsupportedDocument('markup written directly')
+            self.text(unescape(s))
+
+    def writedata(self):
+        d = ''.join(self.data)
+        if d != '':
+            self.text(d)
+
+    def s_text_s(self, tag, attrs):
+        c = attrs.get( (TEXTNS,'c'),"1")
+        self.text('\xa0' * int(c))
+
+    def end_segment(self, element):
+        """
+        Text ends where a tag starts or ends, BeautifulSoup makes each of those a child
+        """
+        if(not element.segment):
+            return
+        text = ''.join(element.segment).translate(WINDOWS_1252)
+        element.segment = []
+        if(not text.strip(ASCII_SPACES) and not any(e.tag in PRESERVE_WHITESPACE_TAGS for e in self.stack)):
+            text = '\n' if '\n' in text else ' '
+        if(element is self.root):
+            self.add_top_level(escape(text))
+        else:
+            element.add(escape(text), text)
+
+    def opentag(self, tag, attrs={}, block=False):
+        self.htmlstack.append((tag, attrs, block))
+        if(tag == 'body'):
+            self.root = HtmlElement(tag, attrs)
+            self.stack = [self.root]
+        elif(not self.stack):
+            return
+        elif(self.in_note() and tag in ('p', 'span') and not attrs):
+            #these tags are taken out of footnotes before they are parsed (see e_text_note_body)
+            pass
+        else:
+            self.end_segment(self.stack[-1])
+            if(tag == 'span'):
+                #spans are unwrapped
+                pass
+            elif(tag in VOID_TAGS or (tag == 'p' and self.in_note())):
+                raise UnsupportedDocument('<%s> tag' % tag)
+            elif(tag == 'a' and (self.in_note() or any(e.tag == 'h1' for e in self.stack))):
+                raise UnsupportedDocument('link in a header or footnote')
+            else:
+                self.stack.append(HtmlElement(tag, attrs))
+        if block == True:
+            self.text('\n')
+
+    def closetag(self, tag, block=True):
+        self.htmlstack.pop()
+        if(not self.stack):
+            return
+        element = self.stack[-1]
+        if(tag == 'body'):
+            self.end_body()
+            return
+        if(tag == 'span'):
+            if(not self.in_note()):
+                self.end_segment(element)
+        elif(element.tag == tag and len(self.stack) > 1):
+            self.end_segment(element)
+            self.close_element(element)
+        elif(not self.in_note() or tag != 'p'):
+            raise UnsupportedDocument('</%s> tag' % tag)
+        if block == True:
+            self.text('\n')
+
+    def emptytag(self, tag, attrs={}):
+        if(not self.stack):
+            return
+        parent = self.stack[-1]
+        self.end_segment(parent)
+        element = HtmlElement(tag, attrs)
+        html = element.html()
+        if(tag in VOID_TAGS):
+            html = html[:-len('></%s>' % tag)] + '/>'
+        if(parent is self.root):
+            self.add_top_level(html)
+        else:
+            parent.add(html, None)
+        self.text('\n')
+
+    def close_element(self, element):
+        """
+        The element is done: apply what cleanup, process_html_with_blockquotes and process_html would do to it
+        and add it to its parent
+        """
+        self.stack.pop()
+        parent = self.stack[-1]
+        string = element.string()
+        begin = end = False
+        if(element.tag == 'p'):
+            if(element.count == 0):
+                #empty p tags are unwrapped
+                return
+            if(self.blockquotes_enabled and string is not None and ('[[' in string or ']]' in string)):
+                if(parent is not self.root):
+                    raise UnsupportedDocument('blockquote marker that is not in the body')
+                begin = '[[' in string
+                end = ']]' in string
+                string = string.replace('[[', '').replace(']]', '')
+                element.pieces = [escape(string)]
+                element.first = string
+                element.count = 1
+            if(string is not None and STORY_BREAK_REGEX.search(string)):
+                element.attrs['class'] = 'story_break'
+        elif(element.tag == 'h1'):
+            if(parent is not self.root or not element.anchor):
+                raise UnsupportedDocument('h1 tag that is not a header in the body')
+            element.attrs['class'] = 'chapter_title'
+        if(parent is not self.root):
+            parent.add(element.html(), string)
+        elif(element.tag == 'h1'):
+            if(self.quotes):
+                raise UnsupportedDocument('header in a blockquote')
+            self.end_chapter()
+            self.chapter_title = string
+            self.page = [element.html()]
+        else:
+            if(begin):
+                self.quotes.append([])
+            self.add_top_level(element.html())
+            if(end):
+                if(not self.quotes):
+                    raise UnsupportedDocument('unbalanced blockquote markers')
+                self.add_top_level('<blockquote>' + ''.join(self.quotes.pop()) + '</blockquote>')
+
+    def add_top_level(self, html):
+        """
+        Adds html in the body to the open blockquote or the chapter (anything before the first chapter is left out)
+        """
+        if(self.quotes):
+            self.quotes[-1].append(html)
+        elif(self.page is not None):
+            self.page.append(html)
+
+    def end_chapter(self):
+        if(self.page is not None):
+            self.chapters.append(Chapter(str(self.chapter_title).strip(), ''.join(self.page)))
+            self.page = None
+
+    def end_body(self):
+        self.end_segment(self.root)
+        self.end_chapter()
+        self.stack = []
+        if(self.quotes):
+            raise UnsupportedDocument('unbalanced blockquote markers')
+        if(not self.chapters):
+            #process_html looks for h2 or strong tags instead
+            raise UnsupportedDocument('no h1 tags')
+
+    def e_text_h(self, tag, attrs):
+        """
+        h1 tags are written without the anchor, which open_odt would take out
+        """
+        level = min(max(int(attrs[(TEXTNS,'outline-level')]), 1), 6)
+        if(level != 1):
+            return super().e_text_h(tag, attrs)
+        self.writedata()
+        #the anchor isn't written but it is still counted, the anchors of other headers keep their numbers
+        heading = ''.join(self.data)
+        if self.title == '': self.title = heading
+        self.get_anchor("%s.%s" % (self.headinglevels[1], heading))
+        if(self.stack):
+            self.stack[-1].anchor = True
+        self.closetag('h1')
+        self.purgedata()
+
+    def e_text_note_citation(self, tag, attrs):
+        """
+        Marker that links to the footnote in the footer (see save_footers in parsing_libraries)
+        """
+        if(self.page is None or self.chapter_title is None):
+            raise UnsupportedDocument('footnote without a chapter title')
+        mark = ''.join(self.data)
+        self.notedict[self.currentnote]['citation'] = mark
+        self.notedict[self.currentnote]['chapter'] = slugify(self.chapter_title.strip()) + '.xhtml'
+        self.opentag('sup')
+        self.opentag('a',{ 'href': FOOTNOTE_DOC_TITLE + "#footnote-%s" % self.currentnote , 'id' : "footnote-ref-%s" % self.currentnote})
+        self.text("[%s]" % str(self.currentnote))
+        self.closetag('a')
+        self.closetag('sup')
+
+    def s_text_note_body(self, tag, attrs):
+        self.main_stack = self.stack
+        self.stack = [HtmlElement('li', {})]
+
+    def e_text_note_body(self, tag, attrs):
+        """
+        Same as SimpleODF2XHTML: the body is forced to one paragraph and spans are left out
+        """
+        note = self.stack[0]
+        self.end_segment(note)
+        self.stack = self.main_stack
+        self.main_stack = None
+        self.notedict[self.currentnote]['body'] = ''.join(note.pieces)
+
+    def generate_footnotes(self):
+        """
+        The footnotes are kept as the footer instead of being written at the end of the body
+        """
+        if self.currentnote == 0:
+            return
+        self.end_segment(self.root)
+        footer = []
+        for key in range(1,self.currentnote+1):
+            note = self.notedict[key]
+            footer.append('<li id="footnote-%d"><p>%s<a href="%s#footnote-ref-%d">↑</a>\n</p>\n</li>\n' % (key, note['body'], note['chapter'], key))
+        self.footer = ''.join(footer)
+        self.footnote_num = self.currentnote
+        self.text('\n')
@@ -0,0 +1,99 @@
+############################################
+# Zip file that compresses its files in a pool of threads (zlib lets go of the GIL while it compresses)
+# and writes them in the order they were added, so the zip is the same as one written with zipfile
+#
+import os, zlib, zipfile, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def compress(data, compress_type, level):
+    """
+    returns the data compressed the way zipfile compresses it and its crc
+    """
+    crc = zlib.crc32(data)
+    if(compress_type == zipfile.ZIP_STORED):
+        return data, crc
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(), crc
+
+class ParallelZipFile(zipfile.ZipFile):
+    """
+    zipfile.ZipFile (opened for writing) whose writestr compresses in a pool of threads
+    The files are written in the order writestr was called, a few at a time as they are ready (close writes the rest)
+    compresslevel is zlib's, 0 stores the files without compressing them at all (quickest, for drafts)
+    threads is the size of the pool (default: all the cpus)
+    date_time is the date of the files that are added by name (default: now, like zipfile)
+    """
+    def __init__(self, file_name, compresslevel=6, threads=None, date_time=None):
+        compression = zipfile.ZIP_STORED if compresslevel == 0 else zipfile.ZIP_DEFLATED
+        super().__init__(file_name, 'w', compression, compresslevel=compresslevel or None)
+        self.threads = threads or os.cpu_count() or 1
+        self.date_time = date_time
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque() #(ZipInfo, future of the compressed data and crc), in the order they are written
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        """
+        Like zipfile.ZipFile.writestr, the file is compressed in the pool and written when it is its turn
+        """
+        if(isinstance(data, str)):
+            data = data.encode('utf-8')
+        if(isinstance(zinfo_or_arcname, zipfile.ZipInfo)):
+            zinfo = zinfo_or_arcname
+        else:
+            #the same file attributes as zipfile gives them
+            zinfo = zipfile.ZipInfo(filename=zinfo_or_arcname, date_time=self.date_time or time.localtime(time.time())[:6])
+            zinfo.compress_type = self.compression
+            if(zinfo.filename.endswith('/')):
+                zinfo.external_attr = 0o40775 << 16 | 0x10
+            else:
+                zinfo.external_attr = 0o600 << 16
+        if(compress_type is not None):
+            zinfo.compress_type = compress_type
+        level = compresslevel if compresslevel is not None else self.compresslevel
+        if(level is None):
+            level = zlib.Z_DEFAULT_COMPRESSION
+        zinfo.file_size = len(data)
+        self.pending.append((zinfo, self.pool.submit(compress, data, zinfo.compress_type, level)))
+        #only a few files are kept waiting, so the compressed book is not all in memory
+        self.write_pending(2 * self.threads)
+
+    def write_pending(self, keep=0):
+        """
+        Writes the files that are done compressing (in order), and waits for more until there are at most keep left
+        """
+        while(self.pending and (len(self.pending) > keep or self.pending[0][1].done())):
+            zinfo, future = self.pending.popleft()
+            compressed, crc = future.result()
+            self.write_compressed(zinfo, compressed, crc)
+
+    def write_compressed(self, zinfo, compressed, crc):
+        """
+        Writes a file that is already compressed, the same way ZipFile.open(zinfo, 'w') does
+        """
+        zinfo.CRC = crc
+        zinfo.compress_size = len(compressed)
+        zinfo.flag_bits = 0
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        if(zip64 and not self._allowZip64):
+            raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+        with self._lock:
+            if(self._seekable):
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+            self._writecheck(zinfo)
+            self._didModify = True
+            self.fp.write(zinfo.FileHeader(zip64))
+            self.fp.write(compressed)
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        if(self.fp is None):
+            return
+        try:
+            self.write_pending()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            super().close()
@@ -1,14 +1,45 @@
 import re
 from bs4 import BeautifulSoup, NavigableString
-FOOTERS = []
+from bs4.builder import builder_registry
 FOOTNOTE_DOC_TITLE = 'footnotes.xhtml'
-FOOTNOTE_NUM = 0 #footnote numbers need to be changed to be consistent across documents
-HTML_PARSER = 'html.parser'
+#footnote numbers need to be changed to be consistent across documents
+#each file is numbered from 1 and shifted afterwards by offset_footnotes, see iter_merged_chapters
+FOOTNOTE_ID_REGEX = re.compile('(["#]footnote(?:-ref)?-)(\\d+)(")')
+FOOTNOTE_NUMBER_REGEX = re.compile('\\d+')
+FOOTNOTE_MARK_REGEX = re.compile('(id="footnote-ref-\\d+">\\[)(\\d+)(\\]</a>)')
+FOOTNOTE_REF_ID_REGEX = re.compile('id="(footnote-ref-\\d+)"') #ids of the footnote markers in a chapter
+BACK_LINK_REGEX = re.compile('href="[^"#]*#(footnote-ref-\\d+)"') #links from the footnotes back to their markers
+HTML_PARSER = 'html.parser' #default, and what we fall back to if the chosen parser is not installed
+HTML_PARSERS = ['html.parser', 'lxml', 'html5lib']
+STORY_BREAK_REGEX = re.compile('^\\s*\\*+\\s*$') #paragraphs of only asterisks
+BLOCKQUOTE_BEGIN_REGEX = re.compile('\\[\\[')
+BLOCKQUOTE_END_REGEX = re.compile('\\]\\]')
+#tags of html where every tag is closed (like the html BeautifulSoup or mammoth make), see split_long_chapter
+HTML_TAG_REGEX = re.compile('<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*>')
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'])
+#a long chapter can be split before these tags (see split_long_chapter), p and pre tags are its paragraphs
+BLOCK_TAGS = frozenset(['p', 'pre', 'blockquote', 'ul', 'ol', 'dl', 'table', 'div', 'hr', 'h2', 'h3', 'h4', 'h5', 'h6'])
+PARAGRAPH_TAGS = frozenset(['p', 'pre'])
+SUBHEADING_TAGS = frozenset(['h2', 'h3', 'h4', 'h5', 'h6'])
 #soup = BeautifulSoup(html_doc, 'html.parser')  (default parser, don't need to specify I don't think)\
 #BeautifulSoup(markup, "lxml") --lxml's html parser, specify 'xml' for its xml parser
 #BeautifulSoup(markup, "html5lib")  --slow but 'parses the same way a web browser does and creates valid html5 unlike others
 
-def process_html(html_parsed_soup):
+def choose_parser(name=None):
+    """
+    Returns the BeautifulSoup parser to use for name (one of HTML_PARSERS, None for the default)
+    If that parser is not installed, falls back to HTML_PARSER
+    """
+    if(name is None):
+        return HTML_PARSER
+    if(name not in HTML_PARSERS):
+        raise Exception("Unknown html parser: " + str(name) + ". Use one of: " + ', '.join(HTML_PARSERS))
+    if(builder_registry.lookup(name) is None):
+        print("Html parser " + name + " is not installed, using " + HTML_PARSER + " instead")
+        return HTML_PARSER
+    return name
+
+def process_html(html_parsed_soup, parser=None):
     """
     Change html to be neater, etc
     Special notes: Chapters will be divided based on the following: if there are h1 tags, those will be chapter titles, if not then h2, and if no h2, then bold text will be assumed to be chapter titles, and the chapter titles will be used to split the document in split_chapters method
@@ -18,9 +49,9 @@ def process_html(html_parsed_soup):
     #soup = BeautifulSoup(html)
     soup = html_parsed_soup
     if(not isinstance(soup, BeautifulSoup)):
-        soup = BeautifulSoup(html_parsed_soup, HTML_PARSER)
+        soup = BeautifulSoup(html_parsed_soup, parser or HTML_PARSER)
     #find asteriks (but only if they're the only thing in the paragraph)
-    paragraphs = soup.find_all("p", string=re.compile("^\s*\*+\s*$"))
+    paragraphs = soup.find_all("p", string=STORY_BREAK_REGEX)
     for paragraph in paragraphs:
         paragraph['class'] = 'story_break'
     #find chapters
@@ -29,8 +60,19 @@ def process_html(html_parsed_soup):
     if(len(titles) == 0):
         titles = soup.find_all('h2')
     #still nothing? Try strong tags
+    strong = False
     if(len(titles) == 0):
         titles = soup.find_all('strong')
+        strong = True
+    mark_chapter_titles(titles, strong)
+    return soup
+
+def mark_chapter_titles(titles, strong=False):
+    """
+    Adds the chapter_title class to the titles found by process_html
+    strong is True if they are strong tags, those are changed to h1 tags
+    """
+    if(strong):
         #process it to remove surrounding p tags and also change strong to h1 tag
         for title in titles:
             title.parent.unwrap()
@@ -40,56 +82,188 @@ def process_html(html_parsed_soup):
         raise Exception("No section titles/chapters found in the document! Use headers (recommended) or bold text (not recommended).")
     for title in titles:
         title['class'] = 'chapter_title'
-    return soup
 
-def process_html_with_blockquotes(html_parsed_soup):
+class HtmlIndex(object):
+    """
+    The tags of a document that prepare_html and save_footers work on, found with one walk of the soup (see index_html)
+    Everything is in document order
+    """
+    __slots__ = ('spans', 'paragraphs', 'h1', 'h2', 'strong', 'sups', 'footnotes', 'anchors')
+    def __init__(self):
+        self.spans = []
+        self.paragraphs = []
+        self.h1 = []
+        self.h2 = []
+        self.strong = []
+        self.sups = []
+        self.footnotes = [] #li tags with footnote in their id
+        self.anchors = [] #(a tag with an id, the h1 tag before it)
+
+    def footnote_markers(self):
+        return [sup for sup in self.sups if find_footnote_markers(sup)]
+
+    def remove(self, removed):
+        """
+        Forgets the tags whose id() is in removed
+        """
+        #a tags after a removed h1 are in the chapter of the h1 before that one
+        chapter_of = {}
+        h1 = None
+        for tag in self.h1:
+            if(id(tag) in removed):
+                chapter_of[id(tag)] = h1
+            else:
+                h1 = tag
+        self.anchors = [(a, chapter_of.get(id(h1), h1)) for a, h1 in self.anchors if id(a) not in removed]
+        for name in ('h1', 'h2', 'strong', 'sups', 'footnotes'):
+            setattr(self, name, [tag for tag in getattr(self, name) if id(tag) not in removed])
+
+def index_html(html_parsed_soup):
+    """
+    Walks the soup once and sorts the tags that are needed into an HtmlIndex
+    """
+    index = HtmlIndex()
+    h1 = None
+    for elem in html_parsed_soup.descendants:
+        name = elem.name
+        if(name is None):
+            #text
+            continue
+        if(name == 'span'):
+            index.spans.append(elem)
+        elif(name == 'p'):
+            index.paragraphs.append(elem)
+        elif(name == 'a'):
+            if(elem.get('id') is not None):
+                index.anchors.append((elem, h1))
+        elif(name == 'h1'):
+            h1 = elem
+            index.h1.append(elem)
+        elif(name == 'sup'):
+            index.sups.append(elem)
+        elif(name == 'strong'):
+            index.strong.append(elem)
+        elif(name == 'h2'):
+            index.h2.append(elem)
+        elif(name == 'li'):
+            if('footnote' in elem.get('id', '')):
+                index.footnotes.append(elem)
+    return index
+
+def prepare_html(html_parsed_soup, blockquotes_enabled=True):
+    """
+    Does the cleanup of open_file_as_xhtml (unwraps spans and empty p tags), process_html_with_blockquotes
+    (if blockquotes_enabled) and process_html with one walk of the soup instead of one or more for each step
+    returns the soup and the HtmlIndex, which can be given to save_footers so it doesn't walk the soup again
+    (None if the chapter titles were made from strong tags, the h1 tags in it are not the titles then)
+    """
+    soup = html_parsed_soup
+    index = index_html(soup)
+    clean_indexed_html(soup, index, blockquotes_enabled)
+    if(index.h1):
+        mark_chapter_titles(index.h1)
+    elif(index.h2):
+        mark_chapter_titles(index.h2)
+        index = None
+    else:
+        mark_chapter_titles(index.strong, True)
+        index = None
+    return soup, index
+
+def clean_indexed_html(soup, index, blockquotes_enabled=True):
+    """
+    Everything prepare_html does except marking the chapter titles, on a soup already walked by index_html
+    The tags that are removed from the soup are removed from the index as well
+    """
+    #spans are useless because all formatting is gone, so we remove
+    for span in index.spans:
+        span.unwrap()
+    #empty p tags are not very helpful and they are appearing at the end of some documents
+    paragraphs = []
+    for p in index.paragraphs:
+        if(not p.contents):
+            p.unwrap()
+        else:
+            paragraphs.append(p)
+    index.paragraphs = paragraphs
+    if(blockquotes_enabled):
+        strings = [(p, p.string) for p in paragraphs]
+        begins = [p for p, string in strings if string is not None and BLOCKQUOTE_BEGIN_REGEX.search(string)]
+        endings = [p for p, string in strings if string is not None and BLOCKQUOTE_END_REGEX.search(string)]
+        #the text of those p tags is replaced, so any tags inside them are gone from the document
+        removed = set(id(tag) for p in begins + endings for tag in p.find_all(True))
+        enclose_blockquotes(soup, begins, endings)
+        if(removed):
+            index.remove(removed)
+    #find asteriks (but only if they're the only thing in the paragraph)
+    for p in index.paragraphs:
+        string = p.string
+        if(string is not None and STORY_BREAK_REGEX.search(string)):
+            p['class'] = 'story_break'
+
+class UnbalancedBlockquotes(Exception):
+    """
+    Raised when the [[ and ]] that mark blockquotes don't match
+    """
+    pass
+
+def process_html_with_blockquotes(html_parsed_soup, parser=None):
     """
     Find blockquotes marked by [[ and ]] and change them in the html to be blockquote tags
     For example: <p>[[Blockquote in here]]</p> becomes <blockquote><p>Blockquote in here</p></blockquote>
     """
     soup = html_parsed_soup
     if(not isinstance(soup, BeautifulSoup)):
-        soup = BeautifulSoup(html_parsed_soup, HTML_PARSER)
-    begins = soup.find_all('p', string=re.compile('\[\['))
-    endings = soup.find_all('p', string=re.compile('\]\]'))
+        soup = BeautifulSoup(html_parsed_soup, parser or HTML_PARSER)
+    begins = soup.find_all('p', string=BLOCKQUOTE_BEGIN_REGEX)
+    endings = soup.find_all('p', string=BLOCKQUOTE_END_REGEX)
+    enclose_blockquotes(soup, begins, endings)
+    return soup
+
+def enclose_blockquotes(soup, begins, endings):
+    """
+    Removes the [[ and ]] from the p tags that begin and end blockquotes and puts the tags
+    from each begin to its end in a blockquote tag
+    """
     #sanity check:
     if(len(begins) != len(endings)):
-        raise Exception("Error! unclosed [[ or ]] in document! These are for indicating block quotes!")
+        raise UnbalancedBlockquotes("Error! unclosed [[ or ]] in document! These are for indicating block quotes!")
     for begin in begins:
         begin.string = begin.string.replace('[[', '')
     for end in endings:
         end.string = end.string.replace(']]', '')
-    to_remove = []
-    for begin in begins:
-        if(begin in endings):
-            #single paragraph block quote, and we're done
-            begin.wrap(soup.new_tag('blockquote'))
-            to_remove.append(begin)
-    for i in to_remove:
-        begins.remove(i)
-        endings.remove(i)
-    #now the hard part
-    while(len(begins) > 0):
-        enclose(soup, begins.pop(0), begins, endings)
-    return soup
+    #tags compare by value, so we keep track of them by identity instead
+    begin_ids = set(id(begin) for begin in begins)
+    end_ids = set(id(end) for end in endings)
+    parents = {}
+    for marker in begins + endings:
+        parents[id(marker.parent)] = marker.parent
+    for parent in parents.values():
+        enclose(soup, parent, begin_ids, end_ids)
 
-def enclose(soup, current_begin, begins, ends):
+def enclose(soup, parent, begin_ids, end_ids):
     """
-    Helper method for enclosing a group of tags
+    Helper method for enclosing the groups of tags between [[ and ]] in parent in blockquote tags
+    All the children are taken out and put back once, either in parent or in the
+    blockquote that is open at the time, so this is linear in the number of children
+    (wrapping tags one at a time has to look up their position every time)
     """
-    elem = next_element(current_begin)
-    blockquote = soup.new_tag('blockquote')
-    wrap = current_begin.wrap(blockquote)
-    
-    while(elem not in ends):
-        if(elem in begins):
-            elem = enclose(soup, begins.pop(0), begins, ends)
-        next_e = next_element(elem)
-        wrap.append(elem)
-        elem = next_e
-    wrap.append(elem)
-    ends.remove(elem)#not totally necessary
-    return wrap
+    children = list(parent.contents)
+    #clear takes out the first child every time, so bs4 finds its position right away
+    parent.clear()
+    open_quotes = [parent]
+    for child in children:
+        if(id(child) in begin_ids):
+            blockquote = soup.new_tag('blockquote')
+            open_quotes[-1].append(blockquote)
+            open_quotes.append(blockquote)
+        open_quotes[-1].append(child)
+        if(id(child) in end_ids):
+            if(len(open_quotes) == 1):
+                raise UnbalancedBlockquotes("Error! unclosed [[ or ]] in document! These are for indicating block quotes!")
+            open_quotes.pop()
+    if(len(open_quotes) != 1):
+        raise UnbalancedBlockquotes("Error! unclosed [[ or ]] in document! These are for indicating block quotes!")
 
 def next_element(elem):
     """
@@ -101,38 +275,147 @@ def next_element(elem):
         if hasattr(elem, 'name'):
             return elem
 
-def get_doc_title(elem):
+class Chapter(object):
     """
-    Convenience method for determining the title (contained in h1 tag)
-    for an element in the soup tree
-    Works whether the document is already split or not
+    A chapter as produced by split_chapters: the title (contents of the h1 tag),
+    the slug used for its file name and its html, so that nothing has to be parsed again to get them
+    source is the file the chapter comes from (set by iter_merged_chapters, None before that)
+    part is 1, or 2, 3... for the continuation files of a chapter that was too long (see split_long_chapter)
     """
-    title = elem.find_previous('h1').string.strip() #should probably have a global variable instead of checking h1 directly
-    return slugify(title) + '.xhtml'
+    __slots__ = ('title', 'slug', 'html', 'source', 'part')
+    def __init__(self, title, html, slug=None, source=None, part=1):
+        self.title = title
+        self.slug = slug if slug is not None else slugify(title)
+        self.html = html
+        self.source = source
+        self.part = part
+
+    def file_name(self):
+        return self.slug + '.xhtml'
 
 def split_chapters(html_parsed_soup):
     """
-    Splits html into a list of html
-    documents based on h1 tags
+    Splits html into a list of Chapters
+    based on h1 tags
+    Footnotes should already have been removed with save_footers
     """
-    #save and erase footers if they exist
     soup = html_parsed_soup
-    if(soup.find(find_footnote_markers)):
-        #we have footnotes
-        save_footers(soup)
     #split the chapters
-    pages = []
-    titles = []
+    chapters = []
     h1tags = soup.find_all('h1')
     for h1tag in h1tags:
         page = [str(h1tag)]
-        titles.append(str(h1tag.string).strip())
+        title = str(h1tag.string).strip()
         elem = next_element(h1tag)
         while elem and elem.name != 'h1':
             page.append(str(elem))
             elem = next_element(elem)
-        pages.append(''.join(page))
-    return pages
+        chapters.append(Chapter(title, ''.join(page)))
+    return chapters
+def get_part_slug(slug, part):
+    """
+    Slug of a continuation file of the chapter with slug (see split_long_chapter)
+    """
+    return slug + '-part-' + str(part)
+
+def iter_top_level_tags(html):
+    """
+    Finds the tags at the top of the html of a chapter (every tag closed, see HTML_TAG_REGEX),
+    yields the start of each one, its name, the opening tag and the number of paragraphs (PARAGRAPH_TAGS) in it
+    Text between the top level tags is part of the tag before it
+    """
+    depth = 0
+    start = name = opening = None
+    paragraphs = 0
+    for match in HTML_TAG_REGEX.finditer(html):
+        if(match.group(1)):
+            depth -= 1
+            continue
+        if(depth == 0):
+            if(start is not None):
+                yield start, name, opening, paragraphs
+            start, name, opening, paragraphs = match.start(), match.group(2).lower(), match.group(0), 0
+        if(match.group(2).lower() in PARAGRAPH_TAGS):
+            paragraphs += 1
+        if(match.group(2).lower() not in VOID_TAGS and not match.group(0).endswith('/>')):
+            depth += 1
+    if(start is not None):
+        yield start, name, opening, paragraphs
+
+def split_long_chapter(chapter, max_size=None, max_paragraphs=None):
+    """
+    Splits a chapter with more than max_size bytes of html (utf-8) or more than max_paragraphs paragraphs into parts
+    within those limits, so e-readers don't have to open huge files. The html is only cut between top level tags,
+    before a paragraph or another block (BLOCK_TAGS, but not right after a subheading) or after a story break,
+    so blockquotes (see process_html_with_blockquotes), lists and tables are never cut
+    When a part gets too long, it is cut after its last story break if that leaves at least half of the limit in it,
+    before the block that doesn't fit otherwise. A block that is over the limit on its own is kept whole
+    returns the list of Chapters: chapter (or its first part, with the h1) and its continuation files, part 2, 3...
+    """
+    html = chapter.html
+    #<p also counts pre, param... tags, too many is fine here
+    if((max_size is None or len(html.encode('utf-8')) <= max_size) and (max_paragraphs is None or html.count('<p') <= max_paragraphs)):
+        return [chapter]
+    starts = []
+    can_cut = [] #the html can be cut before the tag
+    after_break = [] #the tag comes after a story break
+    paragraphs = [0] #p tags before each tag
+    story_break = False
+    subheading = False
+    for start, name, opening, count in iter_top_level_tags(html):
+        starts.append(start)
+        can_cut.append((name in BLOCK_TAGS and not subheading) or story_break)
+        after_break.append(story_break)
+        paragraphs.append(paragraphs[-1] + count)
+        story_break = name == 'p' and 'story_break' in opening
+        subheading = name in SUBHEADING_TAGS
+    if(not starts):
+        return [chapter]
+    sizes = [0] #bytes before each tag
+    for start, end in zip(starts, starts[1:] + [len(html)]):
+        sizes.append(sizes[-1] + len(html[start:end].encode('utf-8')))
+    def over(first, last):
+        #the tags from first up to (not including) last are too long for one part
+        return ((max_size is not None and sizes[last] - sizes[first] > max_size) or
+            (max_paragraphs is not None and paragraphs[last] - paragraphs[first] > max_paragraphs))
+    def half(first, last):
+        return ((max_size is None or 2 * (sizes[last] - sizes[first]) >= max_size) and
+            (max_paragraphs is None or 2 * (paragraphs[last] - paragraphs[first]) >= max_paragraphs))
+    cuts = [0]
+    break_cut = None #after the last story break of the part
+    #the first part has at least one tag after the title
+    for i in range(2, len(starts)):
+        if(can_cut[i] and over(cuts[-1], i + 1)):
+            if(break_cut is not None and half(cuts[-1], break_cut)):
+                cuts.append(break_cut)
+            if(cuts[-1] != i and over(cuts[-1], i + 1)):
+                cuts.append(i)
+            break_cut = None
+        if(after_break[i] and i > cuts[-1]):
+            break_cut = i
+    if(len(cuts) == 1):
+        return [chapter]
+    #the first part starts at the beginning of the html, whatever is before the first tag
+    bounds = [0] + [starts[i] for i in cuts[1:]] + [len(html)]
+    parts = [Chapter(chapter.title, html[:bounds[1]], chapter.slug, chapter.source)]
+    for part, (start, end) in enumerate(zip(bounds[1:], bounds[2:]), 2):
+        parts.append(Chapter(chapter.title, html[start:end], get_part_slug(chapter.slug, part), chapter.source, part))
+    return parts
+
+def iter_split_chapters(chapters, moved, max_size=None, max_paragraphs=None):
+    """
+    Yields the chapters with the long ones split into parts (see split_long_chapter), and for the footnote markers
+    in the continuation files, adds their ids to moved (marker id: file name), so the back links of the footnotes
+    can be pointed to the right file with relink_footers
+    """
+    for chapter in chapters:
+        parts = split_long_chapter(chapter, max_size, max_paragraphs)
+        for part in parts[1:]:
+            for marker_id in FOOTNOTE_REF_ID_REGEX.findall(part.html):
+                moved[marker_id] = part.file_name()
+        for part in parts:
+            yield part
+
 def find_footnote_markers(elem):
     """
     Method to pass to search to help us find sup tags that contain footnote references
@@ -141,55 +424,144 @@ def find_footnote_markers(elem):
         return False
     return hasattr(elem, 'name') and elem.name == 'sup' and hasattr(elem, 'a') and 'footnote' in str(elem.a['href'])
 
-def save_footers(html_parsed_soup):
+def index_footnotes(html_parsed_soup):
+    """
+    Walks the soup once and returns what save_footers needs: the footnote markers (sup tags, see find_footnote_markers)
+    and the footnotes (li tags with footnote in their id) in document order, and every a tag that has an id
+    along with the h1 tag before it (the title of the chapter it will be in)
+    """
+    markers = []
+    footnotes = []
+    anchors = []
+    h1 = None
+    for elem in html_parsed_soup.descendants:
+        name = elem.name
+        if(name is None):
+            #text
+            continue
+        if(name == 'h1'):
+            h1 = elem
+        elif(name == 'a'):
+            if(elem.get('id') is not None):
+                anchors.append((elem, h1))
+        elif(name == 'sup'):
+            if(find_footnote_markers(elem)):
+                markers.append(elem)
+        elif(name == 'li'):
+            if('footnote' in elem.get('id', '')):
+                footnotes.append(elem)
+    return markers, footnotes, anchors
+
+def get_chapter_file_name(h1, footnote_id):
     """
-    Call before splitting the chapters in split_chapers to store footers
-    returns a list of strings which should be html ordered lists
-    and returns the original string without the footers
+    File name of the chapter with the title in h1 (its slug, like split_chapters), footnote_id is for the error message
+    """
+    if(h1 is None):
+        raise Exception("Error! footnote " + footnote_id + " is not in a chapter (there is no h1 before it)")
+    return slugify(h1.string.strip()) + '.xhtml'
+
+def save_footers(html_parsed_soup, num_offset=0, index=None):
+    """
+    Call before splitting the chapters in split_chapers to remove footers
+    Footnote numbers are shifted by num_offset (the number of footnotes in earlier documents)
+    index is the HtmlIndex from prepare_html, if not given the soup is walked to find the footnotes
+    returns the soup without the footers, the footers as html (li tags, without the enclosing ol)
+    and the last footnote number used
+    The soup is only walked once (see index_footnotes), so documents with many footnotes don't take much longer
     """
-    global FOOTNOTE_NUM
-    global FOOTERS
     soup = html_parsed_soup
     #find footers and footer references, modify them both, store footers and delete from document
-    reg_footer = re.compile('.*footnote.*')
-    reg_digit = re.compile('\d+')
-    #footnote_markers = soup.find_all('a', href=reg_footer) #note: need to get parent sup tag call .parent on each does it
-    footnote_markers = soup.find_all(find_footnote_markers)
-    footnotes = soup.find_all('li', id=reg_footer) #use parent to get the whole list ol
-    num_offset = FOOTNOTE_NUM #must update this after we are done with last footnote number
+    if(index is not None):
+        footnote_markers, footnotes, anchors = index.footnote_markers(), index.footnotes, index.anchors
+    else:
+        footnote_markers, footnotes, anchors = index_footnotes(soup)
+    renumber_footnote_markers(footnote_markers, num_offset)
+    #chapter of each id, now that the markers have their new ids (the first a tag with an id is the one that counts)
+    chapters = {}
+    for a, h1 in anchors:
+        chapters.setdefault(a['id'], h1)
+    footnote_num = link_footnotes(footnotes, chapters, num_offset)
+    #now we remove the footnotes and return them
+    to_save_footers = footnotes[0].parent.extract()
+    footer = ''.join(str(x) for x in to_save_footers.contents)
+    return soup, footer, footnote_num
+
+def renumber_footnote_markers(footnote_markers, num_offset=0):
+    """
+    Shifts the numbers of the footnote markers (sup tags, see find_footnote_markers) by num_offset
+    and points them to the footnote document
+    """
     for fm in footnote_markers:
         #change id and href numbers by offset and add footnote document
-        href = fm.a['href']
-        fm_id = fm.a['id']
-        new_href = int(re.search(reg_digit, href).group()) + num_offset
-        new_id = int(re.search(reg_digit, fm_id).group()) + num_offset
-        fm.a['href'] = FOOTNOTE_DOC_TITLE + re.sub(reg_digit, str(new_href), href)
-        fm.a['id'] = re.sub(reg_digit, str(new_id), fm_id)
-        fm.a.string = re.sub(str(new_href - num_offset), str(new_href), fm.a.string)
+        link = fm.a
+        href = link['href']
+        fm_id = link['id']
+        new_href = int(FOOTNOTE_NUMBER_REGEX.search(href).group()) + num_offset
+        new_id = int(FOOTNOTE_NUMBER_REGEX.search(fm_id).group()) + num_offset
+        link['href'] = FOOTNOTE_DOC_TITLE + FOOTNOTE_NUMBER_REGEX.sub(str(new_href), href)
+        link['id'] = FOOTNOTE_NUMBER_REGEX.sub(str(new_id), fm_id)
+        link.string = link.string.replace(str(new_href - num_offset), str(new_href))
+
+def link_footnotes(footnotes, chapters, num_offset=0):
+    """
+    Shifts the numbers of the footnotes (li tags) by num_offset and points their back links to the chapter
+    of the marker they belong to. chapters has the h1 tag (see get_chapter_file_name) of every id in the text
+    returns the last footnote number (num_offset if there are no footnotes)
+    """
+    footnote_num = num_offset
     for fn in footnotes:
-        new_id = int(re.search(reg_digit, fn['id']).group()) + num_offset
-        new_href = int(re.search(reg_digit, fn.p.a['href']).group()) + num_offset
-        fn['id'] = re.sub(reg_digit, str(new_id), fn['id'])
-        fn.p.a['href'] = re.sub(reg_digit, str(new_href), fn.p.a['href'])
-        href = fn.p.a['href'].replace('#', '')
-        follow_link = soup.find('a', id=href)
-        title = get_doc_title(follow_link)
-        fn.p.a['href'] = title + fn.p.a['href']
-        FOOTNOTE_NUM = new_id #this will be updated to the last value so that it works if there are more documents
-    #now we remove the footnotes and save them
-    to_save_footers = footnotes[0].parent.extract()
-    FOOTERS.append(''.join(str(x) for x in to_save_footers.contents))
-    return soup, FOOTERS
+        back_link = fn.p.a
+        new_id = int(FOOTNOTE_NUMBER_REGEX.search(fn['id']).group()) + num_offset
+        new_href = int(FOOTNOTE_NUMBER_REGEX.search(back_link['href']).group()) + num_offset
+        fn['id'] = FOOTNOTE_NUMBER_REGEX.sub(str(new_id), fn['id'])
+        back_link['href'] = FOOTNOTE_NUMBER_REGEX.sub(str(new_href), back_link['href'])
+        href = back_link['href'].replace('#', '')
+        if(href not in chapters):
+            raise Exception("Error! footnote " + fn['id'] + " is not referenced in the text")
+        title = get_chapter_file_name(chapters[href], fn['id'])
+        back_link['href'] = title + back_link['href']
+        footnote_num = new_id #this will be updated to the last value so the next document can continue from it
+    return footnote_num
+
+def offset_footnotes(html, num_offset):
+    """
+    Shift the footnote numbers in html already processed by save_footers (a chapter or the footer html)
+    by num_offset. Used to renumber documents that were converted separately, see iter_merged_chapters
+    """
+    if(num_offset == 0):
+        return html
+    def shift(match):
+        return match.group(1) + str(int(match.group(2)) + num_offset) + match.group(3)
+    html = FOOTNOTE_MARK_REGEX.sub(shift, html)
+    return FOOTNOTE_ID_REGEX.sub(shift, html)
+
+def iter_merged_chapters(results, footers):
+    """
+    Given the results of converting each file (in book order), renumber the footnotes so they are consistent across documents
+    Each result is a dict with 'chapters', 'footer' and 'footnote_num' as returned by conversion_pool.convert_file
+    Yields the renumbered Chapters as soon as their file is converted and appends the renumbered footers
+    to the footers list as it goes (which can be passed to restore_footers)
+    """
+    num_offset = 0
+    for result in results:
+        if(result['footnote_num'] == 0):
+            for chapter in result['chapters']:
+                chapter.source = result['file']
+                yield chapter
+            continue
+        for chapter in result['chapters']:
+            yield Chapter(chapter.title, offset_footnotes(chapter.html, num_offset), chapter.slug, result['file'])
+        footers.append(offset_footnotes(result['footer'], num_offset))
+        num_offset += result['footnote_num']
 
-def restore_footers():
+def restore_footers(footers):
     """
     Returns collected footnotes as an html text
     TODO: switch to fn tags and/or dl and dt, which will require replacing ol and li tags
     """
-    if(len(FOOTERS) <= 0):
+    if(len(footers) <= 0):
         return None
-    footer_html = footers_to_html(FOOTERS)
-    soup = str(BeautifulSoup(footer_html, HTML_PARSER))
+    footer_html = footers_to_html(footers)
     return footer_html
 
 
@@ -203,50 +575,110 @@ def footers_to_html(footers):
 def get_footer_file_name():
     return FOOTNOTE_DOC_TITLE
 
-def blacklist(html_list, blacklist_titles):
+def iter_unique_chapters(chapters, moved, reserved=()):
+    """
+    Chapters with the same title have the same file name and would be saved over each other, so every chapter
+    whose file name is already used (by an earlier chapter or one of the reserved file names) gets -2, -3... added to its slug
+    Yields the chapters and, for each one that was renamed, adds the ids of its footnote markers to moved
+    (marker id: new file name), so the back links of the footnotes can be fixed with relink_footers
+    The continuation files of a chapter (see split_long_chapter) are named after the file name its first part was saved as
+    """
+    used = set(reserved)
+    first_slug = None #slug the first part of the last chapter was saved as
+    for chapter in chapters:
+        slug = chapter.slug
+        if(chapter.part > 1):
+            slug = get_part_slug(first_slug, chapter.part)
+        if(slug + '.xhtml' in used):
+            n = 2
+            while(slug + '-' + str(n) + '.xhtml' in used):
+                n += 1
+            slug = slug + '-' + str(n)
+            print('Chapter "' + chapter.title + '" (' + str(chapter.source) + ') has the same file name as another one, saved as ' + slug + '.xhtml')
+        if(slug != chapter.slug):
+            for marker_id in FOOTNOTE_REF_ID_REGEX.findall(chapter.html):
+                moved[marker_id] = slug + '.xhtml'
+            chapter = Chapter(chapter.title, chapter.html, slug, chapter.source, chapter.part)
+        if(chapter.part == 1):
+            first_slug = slug
+        used.add(chapter.file_name())
+        yield chapter
+
+def relink_footers(footers, moved):
     """
-    Given a list of html (strings) and a list of titles (strings)
-    remove the html docs whose titles have been specified
-    returns the html_list (the same one, not a copy)
-    Does nothing if blacklist_titles is empty
+    Points the back links of the footers (see iter_merged_chapters) whose markers are in renamed chapters
+    (see iter_unique_chapters) to the new file names, returns the list of footers
     """
-    if(len(blacklist_titles) == 0):
-        return html_list
-    to_remove = []
-    for i, html in enumerate(html_list):
-        if(get_title_from_html(html) in blacklist_titles):
-            to_remove.append(i)
-    #remove in reverse order so there is no problem
-    for i in reversed(to_remove):
-        html_list.pop(i)
-    return html_list
+    if(not moved):
+        return footers
+    def relink(match):
+        if(match.group(1) not in moved):
+            return match.group(0)
+        return 'href="' + moved[match.group(1)] + '#' + match.group(1) + '"'
+    return [BACK_LINK_REGEX.sub(relink, footer) for footer in footers]
 
-def whitelist(html_list, whitelist_titles):
+def compile_title_filter(titles, patterns=()):
     """
-    Given a list of html (strings) and a list of titles (strings)
-    keep only the html whose titles have been specified
-    returns the html_list (the same one, not a copy)
-    Does nothing if whitelist_titles is empty
+    Makes a function that tells if a chapter title is in titles (a whitelist or blacklist, matched exactly)
+    or matches one of patterns (regular expressions searched for in the title, like '^Part \\d+$')
+    """
+    exact = set(titles)
+    searches = [re.compile(pattern).search for pattern in patterns]
+    if(not searches):
+        return exact.__contains__
+    def matches(title):
+        return title in exact or any(search(title) for search in searches)
+    return matches
+
+def blacklist(chapters, blacklist_titles, blacklist_patterns=()):
+    """
+    Given a list of Chapters, a list of titles and a list of title patterns (see compile_title_filter)
+    remove the chapters whose titles have been specified
+    returns the chapters list (the same one, not a copy)
+    Does nothing if blacklist_titles and blacklist_patterns are empty
+    """
+    if(len(blacklist_titles) == 0 and len(blacklist_patterns) == 0):
+        return chapters
+    blacklisted = compile_title_filter(blacklist_titles, blacklist_patterns)
+    chapters[:] = [chapter for chapter in chapters if not blacklisted(chapter.title)]
+    return chapters
+
+def whitelist(chapters, whitelist_titles, whitelist_patterns=()):
+    """
+    Given a list of Chapters, a list of titles and a list of title patterns (see compile_title_filter)
+    keep only the chapters whose titles have been specified
+    returns the chapters list (the same one, not a copy)
+    Does nothing if whitelist_titles and whitelist_patterns are empty
     """
     #if no titles have been specified, user is not whitelisting, so quit early
-    if(len(whitelist_titles) == 0):
-        return html_list
-    to_remove = []
-    for i, html in enumerate(html_list):
-        if(get_title_from_html(html) not in whitelist_titles):
-            to_remove.append(i)
-    #remove in reverse order so there is no problem
-    for i in reversed(to_remove):
-        html_list.pop(i)
-    return html_list
-
-def get_title_from_html(html):
+    if(len(whitelist_titles) == 0 and len(whitelist_patterns) == 0):
+        return chapters
+    whitelisted = compile_title_filter(whitelist_titles, whitelist_patterns)
+    chapters[:] = [chapter for chapter in chapters if whitelisted(chapter.title)]
+    return chapters
+
+def filter_chapters(chapters, whitelist_titles, blacklist_titles, whitelist_patterns=(), blacklist_patterns=()):
+    """
+    Does the same as whitelist and blacklist, but for any iterable of Chapters
+    Yields the chapters that are whitelisted (if there is a whitelist) and not blacklisted
+    """
+    whitelisting = len(whitelist_titles) > 0 or len(whitelist_patterns) > 0
+    whitelisted = compile_title_filter(whitelist_titles, whitelist_patterns)
+    blacklisted = compile_title_filter(blacklist_titles, blacklist_patterns)
+    for chapter in chapters:
+        if(whitelisting and not whitelisted(chapter.title)):
+            continue
+        if(blacklisted(chapter.title)):
+            continue
+        yield chapter
+
+def get_title_from_html(html, parser=None):
     """
     Get title from a chapter, given the html (should be processed first)
     """
     soup = html
     if(not isinstance(soup, BeautifulSoup)):
-        soup = BeautifulSoup(html, HTML_PARSER)
+        soup = BeautifulSoup(html, parser or HTML_PARSER)
     return str(soup.find('h1').string).strip()
     #return re.search('<h1 class="chapter_title">(.+?)</h1>', html).group(1)
 
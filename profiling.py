@@ -0,0 +1,143 @@
+############################################
+# Timing and memory use of each stage of the conversion
+# (enabled with --profile)
+#
+import json, time, tracemalloc, cProfile
+from contextlib import contextmanager, nullcontext
+
+ACTIVE = None #StageTimer of what is being profiled in this process, None when not profiling
+
+class StageTimer(object):
+    """
+    Records wall time, cpu time and peak memory (measured with tracemalloc) of stages
+    Stages can be nested, the peak memory of a stage includes the stages inside it
+    """
+    def __init__(self, f_name=None, previous=None):
+        self.f_name = f_name
+        self.previous = previous #timer that was active before this one
+        self.records = []
+        self.stack = []
+        self.started_tracing = not tracemalloc.is_tracing()
+        if(self.started_tracing):
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        if(self.stack):
+            #the peak is reset for this stage, so remember it for the stage we are in
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        running = {'peak': start_memory}
+        self.stack.append(running)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak = max(running['peak'], tracemalloc.get_traced_memory()[1])
+            self.stack.pop()
+            if(self.stack):
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            self.records.append({'stage': name, 'file': self.f_name, 'wall': wall, 'cpu': cpu, 'peak_memory': peak - start_memory})
+
+    def stop(self):
+        if(self.started_tracing):
+            tracemalloc.stop()
+        return self.records
+
+def start(f_name=None):
+    """
+    Starts profiling the stages in this process, returns the StageTimer
+    If something is already being profiled, it continues once this is stopped
+    (don't start inside a stage of the other timer, its memory peak would be wrong)
+    """
+    global ACTIVE
+    ACTIVE = StageTimer(f_name, ACTIVE)
+    return ACTIVE
+
+def stop():
+    """
+    Stops profiling and returns the records of the stages
+    """
+    global ACTIVE
+    timer = ACTIVE
+    ACTIVE = timer.previous
+    return timer.stop()
+
+def stage(name):
+    """
+    Context manager that times the code inside it as stage name if profiling, otherwise does nothing
+        with stage('process_html'):
+            ...
+    """
+    if(ACTIVE is None):
+        return nullcontext()
+    return ACTIVE.stage(name)
+
+def summarize(records):
+    """
+    Adds up the records by stage and by file
+    """
+    stages = {}
+    files = {}
+    for record in records:
+        total = stages.setdefault(record['stage'], {'stage': record['stage'], 'count': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0})
+        total['count'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['peak_memory'] = max(total['peak_memory'], record['peak_memory'])
+        if(record['stage'] == 'convert_file'):
+            files[record['file']] = record
+    return list(stages.values()), list(files.values())
+
+def write_report(path, records, cached_files):
+    """
+    Writes all the records and the totals by stage and file as json
+    """
+    stages, files = summarize(records)
+    with open(path, 'w') as open_f:
+        json.dump({'stages': stages, 'files': files, 'cached_files': cached_files, 'records': records}, open_f, indent=1)
+
+def print_report(records, cached_files):
+    """
+    Prints the totals by stage and by file as a table
+    """
+    stages, files = summarize(records)
+    print('%-20s %6s %10s %10s %12s' % ('stage', 'count', 'wall (s)', 'cpu (s)', 'peak (MB)'))
+    for total in stages:
+        print('%-20s %6d %10.3f %10.3f %12.2f' % (total['stage'], total['count'], total['wall'], total['cpu'], total['peak_memory'] / 1048576.0))
+    print('')
+    print('%-50s %10s %10s %12s' % ('file', 'wall (s)', 'cpu (s)', 'peak (MB)'))
+    for record in sorted(files, key=lambda r: -r['wall']):
+        print('%-50s %10.3f %10.3f %12.2f' % (record['file'], record['wall'], record['cpu'], record['peak_memory'] / 1048576.0))
+    for f_name in cached_files:
+        print('%-50s %10s' % (f_name, 'cached'))
+
+def slowest_file(records):
+    """
+    The converted file that took the longest, None if no file was converted
+    """
+    stages, files = summarize(records)
+    if(len(files) == 0):
+        return None
+    return max(files, key=lambda r: r['wall'])['file']
+
+def dump_profiles(function, path):
+    """
+    Runs function again under cProfile and tracemalloc, and writes the cProfile
+    stats to path + '.prof' and the lines that allocated the most memory to path + '.memory.txt'
+    """
+    tracemalloc.start(25)
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(function)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    profiler.dump_stats(path + '.prof')
+    with open(path + '.memory.txt', 'w') as open_f:
+        for stat in snapshot.statistics('lineno')[:50]:
+            open_f.write(str(stat) + '\n')
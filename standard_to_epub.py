@@ -1,192 +1,496 @@
-import os, sys, re, json, mammoth
+import os, sys, re, json, argparse, time, traceback
+from itertools import repeat
 from ebooklib import epub
-from parsing_libraries import process_html, process_html_with_blockquotes, split_chapters, get_title_from_html, slugify, blacklist, whitelist, restore_footers, get_footer_file_name
-from standard_open_files_as_html import open_file_as_xhtml
+from parsing_libraries import (choose_parser, HTML_PARSERS, filter_chapters, iter_merged_chapters, iter_unique_chapters,
+    iter_split_chapters, relink_footers, restore_footers, get_footer_file_name)
+from conversion_pool import iter_convert_files, convert_file, get_jobs
+from conversion_cache import ConversionCache
+from streaming_epub import StreamingEpubWriter, write_epub, DEFAULT_COMPRESSION_LEVEL
+from build_state import BuildState, get_state_file_name
+from build_digest import input_digest, read_digest, deterministic_options
+from asset_registry import AssetRegistry, safe_read_file
+import profiling
+from profiling import stage
 
-def safe_read_file(f):
+BOOK_STYLESHEETS = ['cover.css', 'nav.css', 'content.css', 'pages.css'] #file names in style/ of the stylesheets from the data file
+
+def process_cmdline():
+    """
+    The expected input is one or more data files, which will hold all the paths to the files to use in making the epub
+    as well as all the meta data necessary (author, id, title, output file name)
+    Directories can be given too, every json file in them is built
+    Options given on the command line override the ones in the data file
+    """
+    parser = argparse.ArgumentParser(description='Converts a group of files into an epub')
+    parser.add_argument('data_files', nargs='+', help='json files (or directories of them) with the files and meta data for the epub. See example input file.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of files to convert at the same time (0 uses all cpus). When building several books, the number of books built at the same time')
+    parser.add_argument('--no-cache', action='store_true', help="don't use or update the cache of converted files")
+    parser.add_argument('--parser', choices=HTML_PARSERS, default=None, help='html parser to use (lxml is the fastest). Falls back to html.parser if it is not installed')
+    parser.add_argument('--no-odt-fast-path', action='store_true', help='convert odt files with BeautifulSoup like docx files instead of straight into chapters (slower, same output)')
+    parser.add_argument('--no-docx-fast-path', action='store_true', help='convert docx files with mammoth instead of reading them in chunks (slower and needs more memory, same output)')
+    parser.add_argument('--stream', action='store_true', help='write chapters into the epub as soon as they are converted instead of keeping the whole book in memory')
+    parser.add_argument('--incremental', action='store_true', help='only convert the files that changed since the last build of this book')
+    parser.add_argument('--profile', action='store_true', help='print the time and memory used by each stage and file, and save them as json next to the epub (.profile)')
+    parser.add_argument('--profile-dump', action='store_true', help='with --profile, also save cProfile stats and the biggest memory allocations of the slowest file')
+    parser.add_argument('--minify-css', action='store_true', help='minify the stylesheets')
+    parser.add_argument('--chunk-size', type=int, default=None, help='convert docx files in chunks of about this many characters of html, so huge files need less memory')
+    parser.add_argument('--chunk-jobs', type=int, default=None, help='with --chunk-size, number of chunks to convert at the same time (0 uses all cpus, default 1)')
+    parser.add_argument('--compression-level', type=int, choices=range(10), default=None, metavar='0-9', help='how much the epub is compressed, 0 (not at all, quickest) to 9 (smallest). Default %d' % DEFAULT_COMPRESSION_LEVEL)
+    parser.add_argument('--max-chapter-size', type=int, default=None, help='split chapters with more than this many bytes of html into several files (between paragraphs), so e-readers open them quickly')
+    parser.add_argument('--max-chapter-paragraphs', type=int, default=None, help='split chapters with more than this many paragraphs into several files')
+    parser.add_argument('--deterministic', action='store_true', help='write the same epub every time from the same files, and skip the build if the epub is already up to date')
+    parser.add_argument('--watch', action='store_true', help='keep running and build the books again whenever their files change (only the files that changed are converted again)')
+    parser.add_argument('--whitelist-pattern', action='append', default=None, metavar='REGEX', help='only keep the chapters whose title matches this regular expression (can be given several times, replaces "whitelist_patterns" in the data file)')
+    parser.add_argument('--blacklist-pattern', action='append', default=None, metavar='REGEX', help='leave out the chapters whose title matches this regular expression (can be given several times, replaces "blacklist_patterns" in the data file)')
+    parser.add_argument('--max-cover-size', type=int, default=None, help='downscale the cover image if its longest side is more than this many pixels (needs Pillow)')
+    return parser.parse_args()
+
+def get_overrides(args):
+    """
+    The json values that are overridden by the command line arguments
+    """
+    overrides = {}
+    if(args.jobs is not None):
+        overrides['jobs'] = args.jobs
+    if(args.no_cache):
+        overrides['cache_enabled'] = False
+    if(args.parser is not None):
+        overrides['parser'] = args.parser
+    if(args.no_odt_fast_path):
+        overrides['odt_fast_path'] = False
+    if(args.no_docx_fast_path):
+        overrides['docx_fast_path'] = False
+    if(args.stream):
+        overrides['streaming'] = True
+    if(args.incremental):
+        overrides['incremental'] = True
+    if(args.profile or args.profile_dump):
+        overrides['profile'] = True
+    if(args.profile_dump):
+        overrides['profile_dump'] = True
+    if(args.minify_css):
+        overrides['minify_css'] = True
+    if(args.chunk_size is not None):
+        overrides['chunk_size'] = args.chunk_size
+    if(args.chunk_jobs is not None):
+        overrides['chunk_jobs'] = args.chunk_jobs
+    if(args.compression_level is not None):
+        overrides['compression_level'] = args.compression_level
+    if(args.max_chapter_size is not None):
+        overrides['max_chapter_size'] = args.max_chapter_size
+    if(args.max_chapter_paragraphs is not None):
+        overrides['max_chapter_paragraphs'] = args.max_chapter_paragraphs
+    if(args.deterministic):
+        overrides['deterministic'] = True
+    if(args.max_cover_size is not None):
+        overrides['max_cover_size'] = args.max_cover_size
+    if(args.whitelist_pattern is not None):
+        overrides['whitelist_patterns'] = args.whitelist_pattern
+    if(args.blacklist_pattern is not None):
+        overrides['blacklist_patterns'] = args.blacklist_pattern
+    return overrides
+
+def build_book(data_file, overrides=None, progress=None, memory=None):
     """
-    Safe file open operation that returns the whole file as a string
-    Used for opening css files, because most of the rest of the time we do want the program
-    to break if a file can't be opened
-    returns an empty string if it fails and also prints error message to screen.
+    Builds the epub described by the json data file
+    overrides is a dict of values that replace the ones in the json (usually from the command line, see get_overrides)
+    progress is called with a dict for every file that is converted and every chapter that is made (see report_progress)
+    memory is a book_watcher.MemoryCache kept between the builds of watch mode, files that are in it and did not change
+    are not converted again or looked up in the cache
+    returns the path of the epub that was written
     """
-    if(f is None):
-        #print('No file given')
-        return ''
+    with open(data_file, 'r') as open_f:
+        json_data = json.load(open_f) #everything we need should be in the json file
+    json_data.update(overrides or {})
+    #the paths in the json file are relative to where the json file is
+    #(we don't change directory so that several books can be built in one process)
+    base_dir = os.path.dirname(os.path.abspath(data_file))
+    def in_base(path):
+        if(path is None):
+            return None
+        return os.path.join(base_dir, path)
+
+    book = epub.EpubBook()
+
+    # set metadata
+    book.set_identifier(json_data['id'])
+    #this does not have any other options, so if other ids needed, seems like .add_metadata(NAMESPACE, name, value, others=NONE) will have to be used
+    book.set_title(json_data['title'])
+    book.set_language('en')
+    for author in json_data['authors']:
+        #guess file_as if not provided? seems risky
+        file_by = author.split(' ')
+        last_name = file_by.pop(-1)
+        rest_of_name = ' '.join(file_by)
+        file_by = last_name + ', ' + rest_of_name
+        book.add_author(author, file_as=file_by)
+
+    output_file_name = in_base(json_data['output_file_name'])
+    digest = None
+    if(json_data.get('deterministic', False)):
+        #the epub would come out the same as the one that is already there, nothing has to be converted or written
+        digest = input_digest(json_data, [in_base(f) for f in get_input_files(json_data)])
+        if(read_digest(output_file_name) == digest):
+            print(output_file_name + ' is up to date')
+            return output_file_name
+    cache = None
+    if(json_data.get('cache_enabled', True)):
+        #unchanged files are taken from the cache instead of being converted again
+        cache = ConversionCache(json_data.get('cache_dir', None), json_data.get('cache_size', None))
+    state = None
+    if(json_data.get('incremental', False)):
+        #the build state next to the epub knows which files changed since the last build
+        state = BuildState(get_state_file_name(output_file_name), cache)
+        cache = state
+    if(memory is not None):
+        cache = memory.wrap(cache)
+    #0 (no compression) is the quickest, for drafts
+    write_options = {'compresslevel': int(json_data.get('compression_level', DEFAULT_COMPRESSION_LEVEL))}
+    if(digest is not None):
+        #fixed dates, and the digest in the epub for the next build to compare
+        deterministic_options(write_options, digest)
+    profile = None
+    if(json_data.get('profile', False)):
+        profile = {'records': [], 'cached_files': []}
+    writer = None
+    assets = None
     try:
-        data = ''
-        with open(f, 'r') as open_f:
-            data = open_f.read()
-        return data
-    except IOError as e:
-        print("Couldn't open file: " + f)
-        return ''
+        if(profile is not None):
+            #started before the chapters are converted, so the chapters written while streaming are timed too
+            profiling.start()
+        if(json_data.get('streaming', False)):
+            #chapters are written as soon as they are ready, the rest when the book is done
+            writer = StreamingEpubWriter(output_file_name, book, write_options)
+        #the stylesheets, loose files and cover are read while the chapters are converted
+        assets = AssetRegistry(in_base, json_data.get('minify_css', False), json_data.get('max_cover_size', None), BOOK_STYLESHEETS)
+        cover_img = json_data.get('cover_img',None)
+        assets.load(get_asset_files(json_data))
+        assets.load([cover_img], True)
+        epub_chapters, toc_chapters, footers = convert_chapters(json_data, in_base, cache, writer, profile, progress)
+        #check for cover image
+        cover_page = None
+        if(not cover_img is None):
+            book.set_cover(os.path.basename(cover_img), assets.image(cover_img))
+            cover_page = book.get_item_with_id('cover')
+            s_file = json_data.get('cover', None) #TODO replace None with default
+            style = assets.style(s_file)
+            cover_css = epub.EpubItem(uid="style_cover", file_name="style/cover.css", media_type="text/css", content=style)
+            book.add_item(cover_css)
+            cover_page.add_link(href='style/cover.css', rel='stylesheet', type='text/css')
+        with stage('finish_book'):
+            finish_book(book, json_data, assets, cover_page, epub_chapters, footers, toc_chapters)
+        # write to the file
+        with stage('write_epub'):
+            if(writer is not None):
+                writer.close()
+            else:
+                write_epub(output_file_name, book, write_options)
+    except:
+        if(writer is not None):
+            writer.abort()
+        raise
+    finally:
+        if(assets is not None):
+            assets.close()
+        if(profile is not None and profiling.ACTIVE is not None):
+            profile['records'].extend(profiling.stop())
+    if(state is not None):
+        state.save()
+    if(memory is not None):
+        memory.forget_unused()
+    if(profile is not None):
+        report_profile(json_data, output_file_name, profile)
+    return output_file_name
 
-def process_cmdline():
+def report_profile(json_data, output_file_name, profile):
     """
-    The expected input is one data file, which will hold all the paths to the files to use in making the epub
-    as well as all the meta data necessary (author, id, title, output file name)
+    Prints the profile of the build and saves it next to the epub,
+    and the cProfile and tracemalloc dumps of the slowest file if asked for
     """
-    args = list(sys.argv[1:]) #first argument is program file, so throw it out
-    numArgs = len(sys.argv)
-    
-    if numArgs < 2:
-        #try:
-        raise Exception("Error: Not enough arguments to command line. One input file is expected. See example input file.")
-    elif numArgs > 2:
-        raise Exception("Error: Too many arguments on command line. Expected one and only one input file") #maybe someday we'll make multiple files at once, but not today!
-    return args[0]
-
-data_file = process_cmdline()
-json_data = json.load(open(data_file, 'r')) #everything we need should be in the json file
-#change directory to where the json file is because the data will be relative to there
-os.chdir(os.path.dirname(data_file))
-
-book = epub.EpubBook()
-
-# set metadata
-book.set_identifier(json_data['id'])
-#this does not have any other options, so if other ids needed, seems like .add_metadata(NAMESPACE, name, value, others=NONE) will have to be used
-book.set_title(json_data['title'])
-book.set_language('en')
-for author in json_data['authors']:
-    #guess file_as if not provided? seems risky
-    file_by = author.split(' ')
-    last_name = file_by.pop(-1)
-    rest_of_name = ' '.join(file_by)
-    file_by = last_name + ', ' + rest_of_name
-    book.add_author(author, file_as=file_by)
-
-#check for cover image
-cover_img = json_data.get('cover_img',None)
-cover_page = None
-if(not cover_img is None):
-    book.set_cover(os.path.basename(cover_img), open(cover_img, 'rb').read())
-    cover_page = book.get_item_with_id('cover')
-    s_file = json_data.get('cover', None) #TODO replace None with default
-    style = safe_read_file(s_file)
-    cover_css = epub.EpubItem(uid="style_cover", file_name="style/cover.css", media_type="text/css", content=style)
-    book.add_item(cover_css)
-    cover_page.add_link(href='style/cover.css', rel='stylesheet', type='text/css')
-
-
-#change files into html
-files = json_data['files']
-all_html = []
-#titles = []
-for f in files:
-    #open_file = open(f, 'rb')
-    #html_form = mammoth.convert_to_html(open_file).value
-    html_form = open_file_as_xhtml(f)
-    if(json_data.get('blockquotes_enabled', True)):
-        html_form = process_html_with_blockquotes(html_form)
-    all_html.extend(split_chapters(process_html(html_form))) #use process_html_with_blockquotes?
-    #open_file.close()
-
-#loose html files can be added that will not be in table of contents
-intro_loose = []
-outro_loose = []
-footer_html = restore_footers()
-if(cover_page is not None and json_data.get('cover_page_enabled', True)):
-    intro_loose.append(cover_page)
-def create_html_item(entry):
-    content = safe_read_file(entry['file'])
-    intro_epub = epub.EpubHtml(title=entry['name'], file_name=entry['name'] + '.' + entry['ext'], lang='en')
-    intro_epub.content = content
+    profiling.print_report(profile['records'], profile['cached_files'])
+    profiling.write_report(output_file_name + '.profile', profile['records'], profile['cached_files'])
+    slowest = profiling.slowest_file(profile['records'])
+    if(json_data.get('profile_dump', False) and slowest is not None):
+        options = get_conversion_options(json_data)
+        profiling.dump_profiles(lambda: convert_file(slowest, options), output_file_name + '.slowest')
+        print('Profile of the slowest file (' + slowest + ') saved in ' + output_file_name + '.slowest.prof and .slowest.memory.txt')
+
+def get_conversion_options(json_data):
+    """
+    Options for converting the files (see conversion_pool.convert_file)
+    """
+    options = {
+        'blockquotes_enabled': json_data.get('blockquotes_enabled', True),
+        'parser': choose_parser(json_data.get('parser', None)),
+        'odt_fast_path': json_data.get('odt_fast_path', True)
+    }
+    #the docx fast path and chunks give the same html, they are only in the options (and the cache keys) of books that change them
+    if(not json_data.get('docx_fast_path', True)):
+        options['docx_fast_path'] = False
+    if(json_data.get('chunk_size', None) is not None):
+        options['chunk_size'] = int(json_data['chunk_size'])
+        options['chunk_jobs'] = get_jobs(json_data.get('chunk_jobs', 1))
+    return options
+
+def collect_profiles(results, profile):
+    """
+    Takes the profile out of each result (see conversion_pool.convert_file) and adds it to profile
+    """
+    for result in results:
+        if('profile' in result):
+            profile['records'].extend(result.pop('profile'))
+        else:
+            profile['cached_files'].append(result['file'])
+        yield result
+
+def report_progress(results, progress):
+    """
+    Calls progress with {'event': 'file', 'file': ..., 'chapters': number of chapters}
+    for each result (see conversion_pool.convert_file) as it goes by
+    """
+    for result in results:
+        progress({'event': 'file', 'file': result['file'], 'chapters': len(result['chapters'])})
+        yield result
+
+def convert_chapters(json_data, in_base, cache=None, writer=None, profile=None, progress=None):
+    """
+    Converts the files into chapters, removes the ones not whitelisted or blacklisted, splits the ones longer than
+    max_chapter_size bytes or max_chapter_paragraphs paragraphs (see iter_split_chapters), gives chapters
+    with the same title file names of their own (see iter_unique_chapters)
+    and makes an EpubHtml for each one (not yet added to the book)
+    Files found in cache (a ConversionCache or BuildState) are not converted again
+    If writer (a StreamingEpubWriter) is given, each chapter is written right away
+    If profile is given, the profile records of each converted file are added to it (see collect_profiles)
+    If progress is given, it is called for every file and every chapter (see report_progress)
+    returns the list of EpubHtml, the ones that go in the table of contents (the first part of each chapter) and the list of footers
+    """
+    #change files into html
+    files = [in_base(f) for f in json_data['files']]
+    options = get_conversion_options(json_data)
+    results = iter_convert_files(files, options, json_data.get('jobs', 1), cache, profile is not None)
+    if(progress is not None):
+        results = report_progress(results, progress)
+    if(profile is not None):
+        results = collect_profiles(results, profile)
+    #footnotes are numbered per file, so they have to be renumbered in order now
+    footers = []
+    chapters = iter_merged_chapters(results, footers)
+    #remove non-whitelisted chapters (won't do anything if whitelist attribute doesn't exist or is empty)
+    #and blacklisted ones, by exact title or by whitelist_patterns and blacklist_patterns (regular expressions)
+    chapters = filter_chapters(chapters, json_data.get('whitelist', []), json_data.get('blacklist', []),
+        json_data.get('whitelist_patterns', []), json_data.get('blacklist_patterns', []))
+    moved = {}
+    max_size = json_data.get('max_chapter_size', None)
+    max_paragraphs = json_data.get('max_chapter_paragraphs', None)
+    if(max_size is not None or max_paragraphs is not None):
+        #long chapters are split into continuation files, which are in the spine but not in the table of contents
+        chapters = iter_split_chapters(chapters, moved, max_size, max_paragraphs)
+    #chapters with the same title would be saved over each other
+    chapters = iter_unique_chapters(chapters, moved, get_reserved_file_names(json_data))
+
+    epub_chapters = []
+    toc_chapters = []
+    for chapter in chapters:
+        c = epub.EpubHtml(title=chapter.title, file_name=chapter.file_name(), lang='en')
+        c.content = chapter.html
+        c.add_link(href='style/content.css', rel='stylesheet', type='text/css')
+        c.add_link(href='style/pages.css', rel='stylesheet', type='text/css')
+        if(writer is not None):
+            with stage('write_chapter'):
+                writer.write_item(c)
+        epub_chapters.append(c)
+        if(chapter.part == 1):
+            toc_chapters.append(c)
+        if(progress is not None):
+            progress({'event': 'chapter', 'title': chapter.title, 'file_name': c.file_name})
+    return epub_chapters, toc_chapters, relink_footers(footers, moved)
+
+def get_reserved_file_names(json_data):
+    """
+    The html files of the book that are not chapters, chapters can't have these file names
+    """
+    names = [get_footer_file_name(), 'nav.xhtml']
+    if(json_data.get('cover_img', None) is not None):
+        names.append('cover.xhtml')
+    for entry in json_data.get('intro_loose_files', []) + json_data.get('outro_loose_files', []):
+        names.append(entry['name'] + '.' + entry['ext'])
+    return names
+
+def get_asset_files(json_data):
+    """
+    The text files (stylesheets and loose html files) the book needs besides the chapters
+    """
+    files = [json_data.get('cover', None), json_data.get('nav_css', None), json_data.get('content_css', None), json_data.get('pages_css', None)]
+    files.extend(json_data.get('footer_css', []))
+    for entry in json_data.get('intro_loose_files', []) + json_data.get('outro_loose_files', []):
+        files.append(entry['file'])
+        files.extend(entry.get('css', []))
+    return files
+
+def get_input_files(json_data):
+    """
+    Every file the book is built from: the files converted into chapters, the text files (see get_asset_files) and the cover image
+    """
+    return json_data['files'] + get_asset_files(json_data) + [json_data.get('cover_img', None)]
+
+def finish_book(book, json_data, assets, cover_page, epub_chapters, footers, toc_chapters=None):
+    """
+    Adds the footnotes, loose files, chapters, css, table of contents and spine to the book
+    assets is the AssetRegistry the stylesheets and loose files are read from
+    toc_chapters are the chapters in the table of contents (default all of them, see convert_chapters)
+    """
+    #loose html files can be added that will not be in table of contents
+    intro_loose = []
+    outro_loose = []
+    footer_html = restore_footers(footers)
+    defined = [] #(html item, file names of its defined_css)
+    if(cover_page is not None and json_data.get('cover_page_enabled', True)):
+        intro_loose.append(cover_page)
+    def create_html_item(entry):
+        content = assets.text(entry['file'])
+        intro_epub = epub.EpubHtml(title=entry['name'], file_name=entry['name'] + '.' + entry['ext'], lang='en')
+        intro_epub.content = content
     
-    book.add_item(intro_epub)
-    for css in entry.get('css',[]):
-        css_content = safe_read_file(css)
-        file_name = os.path.basename(css)
-        css_epub = epub.EpubItem(uid=file_name, file_name="style/" + file_name, media_type="text/css", content=css_content)
-        book.add_item(css_epub)
-        intro_epub.add_link(href="style/" + file_name, rel="stylesheet", type="text/css")
-    for css in entry.get('defined_css', []):
-        intro_epub.add_link(href="style/" + css, rel="stylesheet", type="text/css")
-    return intro_epub
-
-if(footer_html):
-    footer_epub = epub.EpubHtml(title='footnotes', file_name=get_footer_file_name(), lang='en')
-    footer_epub.content = footer_html
-    book.add_item(footer_epub)
-    outro_loose.append(footer_epub)
-    #so we are again just copy and pasting code, which means there is room for improvement...
-    #it is a little harder this time though because its slightly different TO DO
-    for css in json_data.get('footer_css' , []):
-        css_content = safe_read_file(css)
-        file_name = os.path.basename(css)
-        css_epub = epub.EpubItem(uid=file_name, file_name="style/" + file_name, media_type="text/css", content=css_content)
-        book.add_item(css_epub)
-        footer_epub.add_link(href="style/" + file_name, rel="stylesheet", type="text/css")
-    for css in json_data.get('footer_defined_css', []):
-        footer_epub.add_link(href="style/" + css, rel="stylesheet", type="text/css")
-
-for entry in json_data.get('intro_loose_files', []):
-    intro_epub = create_html_item(entry)
-    intro_loose.append(intro_epub)
-for entry in json_data.get('outro_loose_files', []):
-    outro_epub = create_html_item(entry)
-    outro_loose.append(outro_epub)
+        book.add_item(intro_epub)
+        for css in entry.get('css',[]):
+            intro_epub.add_link(href=assets.add_stylesheet(book, css), rel="stylesheet", type="text/css")
+        defined.append((intro_epub, entry.get('defined_css', [])))
+        return intro_epub
+
+    if(footer_html):
+        footer_epub = epub.EpubHtml(title='footnotes', file_name=get_footer_file_name(), lang='en')
+        footer_epub.content = footer_html
+        book.add_item(footer_epub)
+        outro_loose.append(footer_epub)
+        for css in json_data.get('footer_css' , []):
+            footer_epub.add_link(href=assets.add_stylesheet(book, css), rel="stylesheet", type="text/css")
+        defined.append((footer_epub, json_data.get('footer_defined_css', [])))
+
+    for entry in json_data.get('intro_loose_files', []):
+        intro_epub = create_html_item(entry)
+        intro_loose.append(intro_epub)
+    for entry in json_data.get('outro_loose_files', []):
+        outro_epub = create_html_item(entry)
+        outro_loose.append(outro_epub)
+    #stylesheets named by defined_css can be added by any file, so they are looked up once all of them are added
+    for html_item, names in defined:
+        for css in names:
+            html_item.add_link(href=assets.defined_stylesheet(css), rel="stylesheet", type="text/css")
     
     
-#remove non-whitelisted files (won't do anything if whitelist attribute doesn't exist or is empty)
-whitelist(all_html, json_data.get('whitelist', []))
-#remove blacklisted files
-blacklist(all_html, json_data.get('blacklist', []))
-
-epub_chapters = []
-for html in all_html:
-    title = get_title_from_html(html)
-    c = epub.EpubHtml(title=title, file_name=slugify(title) + '.xhtml', lang='en')
-    c.content = html
-    book.add_item(c)
-    epub_chapters.append(c)
-
-
-# define Table Of Contents
-book.toc = (
-             (
-                epub.Section('Table of Contents'),
-                tuple(epub_chapters)
-              ),
-
-            )
-
-# input file has three CSS files: pages.css, content.css, and nav_style.css
-# They can be set to null if default ones are not to be used.
-#nav style
-s_file = json_data.get('nav_css', None) #TODO replace None with check for default from settings file
-style = safe_read_file(s_file)
-nav_css = epub.EpubItem(uid="style_nav", file_name="style/nav.css", media_type="text/css", content=style)
-#content style
-s_file = json_data.get('content_css', None)
-style = safe_read_file(s_file)
-content_css = epub.EpubItem(uid="style_content", file_name="style/content.css", media_type="text/css", content=style)
-#page style
-s_file = json_data.get('pages_css', None)
-style = safe_read_file(s_file)
-page_css = epub.EpubItem(uid='style_page', file_name='style/pages.css', content=style)
-# add CSS file
-book.add_item(nav_css)
-book.add_item(content_css)
-book.add_item(page_css)
-
-# add default NCX and Nav file
-e_nav = epub.EpubNav()
-e_nav.add_link(href='style/nav.css', rel='stylesheet', type='text/css')
-book.add_item(e_nav)
-book.add_item(epub.EpubNcx())
-
-
-
-for c in epub_chapters:
-    c.add_link(href='style/content.css', rel='stylesheet', type='text/css')
-    c.add_link(href='style/pages.css', rel='stylesheet', type='text/css')
-    #c.add_link(nav_css)
-    #add_link(href='styles.css', rel='stylesheet', type='text/css')
-
-# basic spine
-book.spine = intro_loose + ['nav'] + epub_chapters + outro_loose
-
-# write to the file
-epub.write_epub(json_data['output_file_name'], book, {})
\ No newline at end of file
+    for c in epub_chapters:
+        book.add_item(c)
+
+
+    # define Table Of Contents
+    book.toc = (
+                 (
+                    epub.Section('Table of Contents'),
+                    tuple(toc_chapters if toc_chapters is not None else epub_chapters)
+                  ),
+
+                )
+
+    # input file has three CSS files: pages.css, content.css, and nav_style.css
+    # They can be set to null if default ones are not to be used.
+    #nav style
+    s_file = json_data.get('nav_css', None) #TODO replace None with check for default from settings file
+    style = assets.style(s_file)
+    nav_css = epub.EpubItem(uid="style_nav", file_name="style/nav.css", media_type="text/css", content=style)
+    #content style
+    s_file = json_data.get('content_css', None)
+    style = assets.style(s_file)
+    content_css = epub.EpubItem(uid="style_content", file_name="style/content.css", media_type="text/css", content=style)
+    #page style
+    s_file = json_data.get('pages_css', None)
+    style = assets.style(s_file)
+    page_css = epub.EpubItem(uid='style_page', file_name='style/pages.css', content=style)
+    # add CSS file
+    book.add_item(nav_css)
+    book.add_item(content_css)
+    book.add_item(page_css)
+
+    # add default NCX and Nav file
+    e_nav = epub.EpubNav()
+    e_nav.add_link(href='style/nav.css', rel='stylesheet', type='text/css')
+    book.add_item(e_nav)
+    book.add_item(epub.EpubNcx())
+
+    # basic spine
+    book.spine = intro_loose + ['nav'] + epub_chapters + outro_loose
+
+def find_data_files(paths):
+    """
+    Expands the paths given on the command line: directories are replaced
+    by all the json files inside them (sorted by name)
+    """
+    data_files = []
+    for path in paths:
+        if(os.path.isdir(path)):
+            data_files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith('.json'))
+        else:
+            data_files.append(path)
+    return data_files
+
+def build_book_timed(data_file, overrides=None, progress=None, memory=None):
+    """
+    Builds a book for build_books, catching errors so that one broken book doesn't stop the others
+    returns a dict with the data file, the output file (None if it failed), the time it took in seconds and the error message
+    """
+    start = time.perf_counter()
+    output_file_name = None
+    error = None
+    try:
+        output_file_name = build_book(data_file, overrides, progress, memory)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+        traceback.print_exc()
+    return {'data_file': data_file, 'output_file': output_file_name, 'seconds': time.perf_counter() - start, 'error': error}
+
+def build_books(data_files, jobs=1, overrides=None):
+    """
+    Builds several books in this process, so the libraries only have to be imported once
+    If jobs is more than 1, that many books are built at the same time in a pool of processes
+    (the files of each book are then converted one after the other)
+    returns the results of build_book_timed in the same order as data_files
+    """
+    overrides = dict(overrides or {})
+    overrides['jobs'] = 1
+    jobs = min(get_jobs(jobs), len(data_files))
+    if(jobs <= 1):
+        return [build_book_timed(f, overrides) for f in data_files]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(build_book_timed, data_files, repeat(overrides)))
+
+def print_summary(results):
+    """
+    Prints how long each book took and which ones failed
+    """
+    print('%-40s %10s  %s' % ('book', 'seconds', 'result'))
+    for result in results:
+        status = result['error'] if result['error'] else 'ok'
+        print('%-40s %10.2f  %s' % (result['data_file'], result['seconds'], status))
+    failed = len([r for r in results if r['error']])
+    print('%d books built, %d failed, %.2f seconds in total' % (len(results) - failed, failed, sum(r['seconds'] for r in results)))
+
+def main():
+    args = process_cmdline()
+    overrides = get_overrides(args)
+    data_files = find_data_files(args.data_files)
+    if(args.watch):
+        #imported here, book_watcher imports this module
+        from book_watcher import watch
+        watch(data_files, overrides)
+        return
+    if(len(data_files) == 1 and not os.path.isdir(args.data_files[0])):
+        #a single book, jobs are used for converting its files
+        build_book(data_files[0], overrides)
+        return
+    results = build_books(data_files, args.jobs, overrides)
+    print_summary(results)
+    if(any(r['error'] for r in results)):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
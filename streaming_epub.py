@@ -0,0 +1,126 @@
+############################################
+# Epub writer that writes chapters into the zip file as soon as they are
+# ready, so the html of the whole book never has to be in memory at once
+# Both writers here compress the files in a pool of threads (see parallel_zip)
+#
+import os, zipfile
+from html import escape
+from ebooklib import epub
+from ebooklib.utils import get_pages
+from parallel_zip import ParallelZipFile
+
+DEFAULT_COMPRESSION_LEVEL = 6 #the one ebooklib uses
+
+def open_epub_zip(file_name, options):
+    """
+    The zip file for the options of an epub writer: 'compresslevel', and 'date_time' of the files
+    and the zip 'comment' if they are given (see build_digest.deterministic_options)
+    """
+    out = ParallelZipFile(file_name, options['compresslevel'], date_time=options.get('date_time', None))
+    if(options.get('comment', None)):
+        out.comment = options['comment']
+    return out
+
+class ParallelEpubWriter(epub.EpubWriter):
+    """
+    epub.EpubWriter that compresses the files in a pool of threads, the epub is the same
+    options can have 'compresslevel' (0 to 9, 0 stores the files without compressing them) like epub.EpubWriter
+    """
+    def write(self):
+        self.out = open_epub_zip(self.file_name, self.options)
+        try:
+            self.out.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            self._write_container()
+            self._write_opf()
+            self._write_items()
+        except:
+            #the unfinished epub is deleted like StreamingEpubWriter.abort does, it must not look up to date (see build_digest)
+            self.out.close()
+            os.remove(self.file_name)
+            raise
+        self.out.close()
+
+def write_epub(name, book, options=None):
+    """
+    Writes the book like epub.write_epub, but compressing in a pool of threads (see ParallelEpubWriter)
+    Unlike epub.write_epub, errors while writing are raised
+    """
+    writer = ParallelEpubWriter(name, book, options)
+    writer.process()
+    writer.write()
+
+class StreamingEpubWriter(epub.EpubWriter):
+    """
+    Same output as epub.write_epub, but chapters can be written with write_item while the book is being built
+    Written items keep their metadata (title, file name, links) and lose their content
+    (except for page markers, see page_stub), which is all that is needed to make the opf, ncx and nav files in close
+    The only difference in the epub is the order of the files in the zip: content.opf comes after the chapters
+    """
+    def __init__(self, name, book, options=None):
+        super().__init__(name, book, options)
+        self.written = set()
+        self.out = open_epub_zip(self.file_name, self.options)
+        try:
+            self.out.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            self._write_container()
+        except:
+            #there is no writer to abort yet
+            self.abort()
+            raise
+
+    def item_path(self, item):
+        return self.book.FOLDER_NAME + '/' + item.file_name
+
+    def write_item(self, item):
+        """
+        Writes item (usually an EpubHtml) into the epub and frees its content
+        The item still has to be added to the book so that it is in the opf
+        """
+        #the html template comes from the book, which is normally set by book.add_item
+        item.book = self.book
+        self.out.writestr(self.item_path(item), item.get_content())
+        self.written.add(item.file_name)
+        item.content = self.page_stub(item)
+
+    def page_stub(self, item):
+        """
+        The nav file lists the pages (tags with epub:type) of every document, so written
+        items are left with html that has just those tags instead of their whole content
+        """
+        pages = []
+        if('epub:type' in item.content):
+            pages = get_pages(item)
+        stub = ['<span epub:type="pagebreak" id="%s" aria-label="%s"></span>' % (escape(pageref), escape(label)) for name, pageref, label in pages]
+        return '<div>' + ''.join(stub) + '</div>'
+
+    def _write_items(self):
+        """
+        Writes the items that were not already written with write_item
+        """
+        for item in self.book.get_items():
+            if(item.file_name in self.written):
+                continue
+            if(isinstance(item, epub.EpubNcx)):
+                self.out.writestr(self.item_path(item), self._get_ncx())
+            elif(isinstance(item, epub.EpubNav)):
+                self.out.writestr(self.item_path(item), self._get_nav(item))
+            elif(item.manifest):
+                self.out.writestr(self.item_path(item), item.get_content())
+            else:
+                self.out.writestr(item.file_name, item.get_content())
+
+    def close(self):
+        """
+        Writes everything else and the opf file and closes the epub
+        """
+        self.process()
+        self._write_opf()
+        self._write_items()
+        self.out.close()
+
+    def abort(self):
+        """
+        Closes and deletes the unfinished epub
+        """
+        self.out.close()
+        os.remove(self.file_name)
@@ -0,0 +1,15 @@
+############################################
+# The modules of the repository are flat files at its top, so the tests import them from there
+#
+import os, sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'examples')
+if(REPO_DIR not in sys.path):
+    sys.path.insert(0, REPO_DIR)
+
+def example_documents():
+    """
+    The documents in examples/ (odt files)
+    """
+    return sorted(os.path.join(EXAMPLES_DIR, f) for f in os.listdir(EXAMPLES_DIR) if f.endswith('.odt'))
@@ -0,0 +1,49 @@
+############################################
+# BuildState: a file is converted again when it changed since the last build, even when it was saved while it was converted
+#
+import os
+import conversion_pool
+from conversion_pool import iter_convert_files
+from build_state import BuildState
+from odf.opendocument import OpenDocumentText
+from odf.text import H, P
+
+def write_odt(f_name, text):
+    doc = OpenDocumentText()
+    doc.text.addElement(H(outlinelevel=1, text='Chapter'))
+    doc.text.addElement(P(text=text))
+    doc.save(f_name)
+
+def build(f_name, state_file):
+    state = BuildState(state_file)
+    result = list(iter_convert_files([f_name], {}, cache=state))[0]
+    state.save()
+    return result
+
+def test_unchanged_file(tmp_path):
+    f_name = str(tmp_path / 'book.odt')
+    state_file = str(tmp_path / 'book.epub.buildstate')
+    write_odt(f_name, 'First version')
+    build(f_name, state_file)
+    state = BuildState(state_file)
+    result = state.get(state.key(f_name, {}))
+    assert result is not None and 'First version' in result['chapters'][0].html
+
+def test_edit_during_conversion(tmp_path, monkeypatch):
+    f_name = str(tmp_path / 'book.odt')
+    state_file = str(tmp_path / 'book.epub.buildstate')
+    write_odt(f_name, 'First version')
+    convert_file = conversion_pool.convert_file
+    def convert_then_edit(*args):
+        result = convert_file(*args)
+        #saved while it was converted, the result is the one of the first version
+        write_odt(f_name, 'Second version, a little longer')
+        stat = os.stat(f_name)
+        os.utime(f_name, (stat.st_atime, stat.st_mtime + 10))
+        return result
+    monkeypatch.setattr(conversion_pool, 'convert_file', convert_then_edit)
+    assert 'First version' in build(f_name, state_file)['chapters'][0].html
+    monkeypatch.setattr(conversion_pool, 'convert_file', convert_file)
+    state = BuildState(state_file)
+    assert state.get(state.key(f_name, {})) is None
+    assert 'Second version' in build(f_name, state_file)['chapters'][0].html
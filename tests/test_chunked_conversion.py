@@ -0,0 +1,105 @@
+############################################
+# Converting the html of a docx file in chunks (chunked_conversion) gives the same chapters,
+# footer and footnote numbers as converting it as a whole, or raises UnsupportedDocument
+#
+import pytest
+from bs4 import BeautifulSoup
+import chunked_conversion
+from chunked_conversion import convert_xhtml_in_chunks, find_chunks
+from conversion_pool import convert_soup
+from parsing_libraries import HTML_PARSER
+from standard_open_files_as_html import UnsupportedDocument
+
+def marker(num):
+    return '<sup><a href="#footnote-%d" id="footnote-ref-%d">[%d]</a></sup>' % (num, num, num)
+
+def footnotes(count):
+    """
+    The list of footnotes at the end of the html mammoth makes
+    """
+    return '<ol>' + ''.join('<li id="footnote-%d"><p> Note %d <a href="#footnote-ref-%d">↑</a></p></li>' % (num, num, num)
+        for num in range(1, count + 1)) + '</ol>'
+
+QUOTE = '<p>[[A quote</p><p>that goes on]]</p>'
+
+def make_xhtml(chapters=6):
+    """
+    html like mammoth's: chapters with footnote markers, bookmarks, bold text and a blockquote each, then the footnotes
+    """
+    html = []
+    num = 0
+    for c in range(1, chapters + 1):
+        html.append('<h1>Chapter %d</h1>' % c)
+        html.append('<p><a id="mark-%d"></a>Some <strong>bold</strong> text%s and more.</p>' % (c, marker(num + 1)))
+        html.append(QUOTE)
+        html.append('<p>***</p><p>After the break%s.</p>' % marker(num + 2))
+        num += 2
+    return ''.join(html) + footnotes(num)
+
+def as_whole(xhtml, options):
+    chapters, footer, footnote_num = convert_soup(BeautifulSoup(xhtml, HTML_PARSER), options)
+    return [(c.title, c.slug, c.html) for c in chapters], footer, footnote_num
+
+def in_chunks(xhtml, options):
+    chapters, footer, footnote_num = convert_xhtml_in_chunks(xhtml, options)
+    return [(c.title, c.slug, c.html) for c in chapters], footer, footnote_num
+
+@pytest.mark.parametrize('chunk_size', [1, 200, 1000])
+@pytest.mark.parametrize('blockquotes_enabled', [True, False], ids=['blockquotes', 'no_blockquotes'])
+def test_same_as_whole(chunk_size, blockquotes_enabled):
+    xhtml = make_xhtml()
+    options = {'chunk_size': chunk_size, 'blockquotes_enabled': blockquotes_enabled}
+    chunks, note_chunks = find_chunks(xhtml, chunk_size)
+    assert len(chunks) > 1
+    if(chunk_size == 1):
+        #every chapter and every footnote is a chunk of its own
+        assert len(chunks) == 6 and len(note_chunks) == 12
+    assert in_chunks(xhtml, options) == as_whole(xhtml, options)
+
+def test_same_as_whole_in_processes():
+    xhtml = make_xhtml()
+    assert in_chunks(xhtml, {'chunk_size': 1, 'chunk_jobs': 2}) == as_whole(xhtml, {})
+
+def test_quote_across_a_cut(monkeypatch):
+    #the blockquote opens in the second chapter and closes in the third, so its chunk is converted again with the next one
+    xhtml = make_xhtml(4)
+    chapters = xhtml.split('<h1>')
+    chapters[2] = chapters[2].replace(QUOTE, '<p>[[A quote</p>')
+    chapters[3] = chapters[3].replace(QUOTE, '<p>that goes on]]</p>')
+    xhtml = '<h1>'.join(chapters)
+    assert xhtml.count('[[') == xhtml.count(']]') == 3
+    converted = []
+    convert_chunk = chunked_conversion.convert_chunk
+    def recording_convert_chunk(text, *args):
+        converted.append(text)
+        return convert_chunk(text, *args)
+    monkeypatch.setattr(chunked_conversion, 'convert_chunk', recording_convert_chunk)
+    options = {'chunk_size': 1}
+    result = in_chunks(xhtml, options)
+    assert result == as_whole(xhtml, options)
+    #the chunk of chapter 2 failed alone and was converted again with chapter 3
+    assert [text.count('<h1>') for text in converted] == [1, 1, 2, 1]
+    assert '<blockquote>' in ''.join(html for title, slug, html in result[0])
+
+def test_markers_without_footnotes():
+    xhtml = make_xhtml()
+    xhtml = xhtml[:xhtml.index('<ol>')]
+    with pytest.raises(UnsupportedDocument):
+        convert_xhtml_in_chunks(xhtml, {'chunk_size': 1})
+
+def test_footnotes_without_markers():
+    xhtml = make_xhtml()
+    for num in range(1, 13):
+        xhtml = xhtml.replace(marker(num), '')
+    with pytest.raises(UnsupportedDocument):
+        convert_xhtml_in_chunks(xhtml, {'chunk_size': 1})
+
+def test_chapter_after_footnotes():
+    xhtml = make_xhtml() + '<h1>Afterword</h1><p>The end.</p>'
+    with pytest.raises(UnsupportedDocument):
+        convert_xhtml_in_chunks(xhtml, {'chunk_size': 1})
+
+def test_one_chunk():
+    xhtml = make_xhtml()
+    with pytest.raises(UnsupportedDocument):
+        convert_xhtml_in_chunks(xhtml, {'chunk_size': len(xhtml)})
@@ -0,0 +1,177 @@
+############################################
+# DocxHtmlReader (the docx fast path) makes the same html as mammoth.convert_to_html, and the documents
+# it can't read like mammoth raise UnsupportedDocument and are converted with mammoth instead
+#
+import zipfile
+import pytest
+import mammoth
+from standard_open_files_as_html import WINDOWS_1252, UnsupportedDocument
+from docx_converters import DocxHtmlReader, UNSUPPORTED_ELEMENTS, NAMESPACES
+from conversion_pool import convert_file
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+RELATIONSHIPS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+#the first namespace of each prefix in docx_converters is the one the documents here are written with
+PREFIXES = dict(reversed([(prefix, uri) for uri, prefix in NAMESPACES.items()]))
+CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/></Types>')
+LINK = 'http://example.com/a?b=1&amp;c=&quot;2&quot;#frag'
+STYLES = ('<w:styles xmlns:w="%s">'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Titre1"><w:name w:val="Heading 1"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="FootnoteText"><w:name w:val="footnote text"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="ListPara"><w:name w:val="List Paragraph"/></w:style>'
+    '<w:style w:type="character" w:styleId="Strong"><w:name w:val="Strong"/></w:style>'
+    '<w:style w:type="character" w:styleId="FootnoteReference"><w:name w:val="footnote reference"/></w:style>'
+    '</w:styles>') % W
+NUMBERING = ('<w:numbering xmlns:w="%s"><w:abstractNum w:abstractNumId="0"><w:lvl w:ilvl="0"><w:numFmt w:val="bullet"/>'
+    '<w:pStyle w:val="ListPara"/></w:lvl></w:abstractNum><w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num></w:numbering>') % W
+
+def relationships(*targets):
+    xml = ''.join('<Relationship Id="%s" Type="%s/%s" Target="%s"%s/>' % (relationship_id, R, kind, target,
+        ' TargetMode="External"' if kind == 'hyperlink' else '') for relationship_id, kind, target in targets)
+    return '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="%s">%s</Relationships>' % (RELATIONSHIPS, xml)
+
+def write_docx(f_name, body, notes='', extra=None):
+    """
+    A docx file with body in its w:body and the w:footnote elements notes, with styles, numbering and a hyperlink (rId9)
+    """
+    namespaces = ' '.join('xmlns:%s="%s"' % item for item in sorted(PREFIXES.items()) if item[0] != 'relationships')
+    document_relationships = relationships(('rId1', 'styles', 'styles.xml'), ('rId2', 'footnotes', 'footnotes.xml'),
+        ('rId3', 'numbering', 'numbering.xml'), ('rId4', 'endnotes', 'endnotes.xml'), ('rId9', 'hyperlink', LINK))
+    with zipfile.ZipFile(f_name, 'w', zipfile.ZIP_DEFLATED) as out:
+        out.writestr('[Content_Types].xml', CONTENT_TYPES)
+        out.writestr('_rels/.rels', relationships(('rId1', 'officeDocument', 'word/document.xml')))
+        out.writestr('word/_rels/document.xml.rels', document_relationships)
+        out.writestr('word/_rels/footnotes.xml.rels', document_relationships)
+        out.writestr('word/styles.xml', STYLES)
+        out.writestr('word/numbering.xml', NUMBERING)
+        out.writestr('word/document.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document %s><w:body>%s</w:body></w:document>' % (namespaces, body))
+        out.writestr('word/footnotes.xml', '<?xml version="1.0" encoding="UTF-8"?><w:footnotes xmlns:w="%s" xmlns:r="%s">'
+            '<w:footnote w:type="separator" w:id="-1"><w:p><w:r><w:separator/></w:r></w:p></w:footnote>'
+            '<w:footnote w:type="continuationSeparator" w:id="0"><w:p><w:r><w:continuationSeparator/></w:r></w:p></w:footnote>'
+            '%s</w:footnotes>' % (W, R, notes))
+        out.writestr('word/endnotes.xml', '<?xml version="1.0" encoding="UTF-8"?><w:endnotes xmlns:w="%s">'
+            '<w:endnote w:id="1"><w:p><w:r><w:t>endnote</w:t></w:r></w:p></w:endnote></w:endnotes>' % W)
+        for name, content in (extra or {}).items():
+            out.writestr(name, content)
+
+def p(runs, style=None, properties=''):
+    if(style):
+        properties = '<w:pStyle w:val="%s"/>' % style + properties
+    return '<w:p>%s%s</w:p>' % ('<w:pPr>%s</w:pPr>' % properties if properties else '', runs)
+
+def r(text, properties=''):
+    return '<w:r><w:rPr>%s</w:rPr><w:t xml:space="preserve">%s</w:t></w:r>' % (properties, text)
+
+def reference(note_id):
+    return '<w:r><w:rPr><w:rStyle w:val="FootnoteReference"/></w:rPr><w:footnoteReference w:id="%s"/></w:r>' % note_id
+
+def footnote(note_id, paragraphs):
+    return '<w:footnote w:id="%s">%s</w:footnote>' % (note_id, paragraphs)
+
+def mammoth_html(f_name):
+    """
+    The html of mammoth.convert_to_html, with the characters changed like standard_open_files_as_html.docx_to_xhtml does
+    """
+    with open(f_name, 'rb') as open_f:
+        return mammoth.convert_to_html(open_f).value.translate(WINDOWS_1252)
+
+def reader_html(f_name, chunk_size):
+    reader = DocxHtmlReader(f_name)
+    chunks = list(reader.iter_body_chunks(chunk_size))
+    return chunks, ''.join(reader.iter_note_chunks())
+
+HEADING = p(r('Chapter 1'), 'Heading1')
+#attributes mammoth needs to read these elements
+ELEMENT_ATTRIBUTES = {'w:sym': ' w:font="Wingdings" w:char="F04A"', 'w:endnoteReference': ' w:id="1"'}
+CASES = {
+    'escaping': HEADING + p(r('a &amp; b &lt; c &gt; d "q" \' ’ \u0080 \u0093 é')) + p(r('quoted'), 'Quote'),
+    'formatting': HEADING + p(r('plain ') + r('bold', '<w:b/>') + r(' still bold', '<w:b/>') + r('italic', '<w:i/>')
+        + r('both', '<w:b/><w:i/>') + r('not bold', '<w:i/><w:b w:val="0"/>') + r('struck', '<w:strike/>')
+        + r('sup', '<w:vertAlign w:val="superscript"/>') + r('sub', '<w:vertAlign w:val="subscript"/>')
+        + r('strong', '<w:rStyle w:val="Strong"/>') + r('underlined', '<w:u w:val="single"/>')) + p('') + p(r('')),
+    'headings': ''.join(p(r('Title ' + style), style) for style in ['Heading1', 'Heading2', 'Titre1', 'FootnoteText', 'Undefined']),
+    'footnotes': HEADING + p(r('text') + reference(2) + r(' more') + reference(1)) + p(r('Chapter 2'), 'Heading1') + p(reference(2)),
+    'numbering': HEADING + p(r('not a list'), None, '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="0"/></w:numPr>')
+        + p(r('Numbered heading'), 'Heading1', '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'),
+    'hyperlinks': HEADING + p('<w:hyperlink r:id="rId9"><w:r><w:t>a</w:t></w:r></w:hyperlink>'
+        '<w:hyperlink r:id="rId9"><w:r><w:t>b</w:t></w:r></w:hyperlink><w:hyperlink w:anchor="mark"><w:r><w:t>c</w:t></w:r></w:hyperlink>'
+        '<w:hyperlink r:id="rId9" w:anchor="x" w:tgtFrame="_blank"><w:r><w:t>d</w:t></w:r></w:hyperlink>'
+        '<w:hyperlink><w:r><w:t>e</w:t></w:r></w:hyperlink>'),
+    'bookmarks': HEADING + p(r('a', '<w:b/>') + '<w:bookmarkStart w:id="1" w:name="mark"/><w:bookmarkEnd w:id="1"/>' + r('b', '<w:b/>')
+        + '<w:bookmarkStart w:id="2" w:name="_GoBack"/>' + r('c')) + p('<w:bookmarkStart w:id="3" w:name="only"/>'),
+    'breaks': HEADING + p('<w:r><w:t>a</w:t><w:tab/><w:t>b</w:t><w:br/><w:t>c</w:t><w:br w:type="page"/><w:br w:type="textWrapping"/>'
+        '<w:noBreakHyphen/><w:softHyphen/><w:lastRenderedPageBreak/></w:r>') + p('<w:br/>') + '<w:sectPr/>',
+    'wrappers': HEADING + p('<w:ins><w:r><w:t>inserted</w:t></w:r></w:ins><w:del><w:r><w:delText>deleted</w:delText></w:r></w:del>'
+        '<w:smartTag><w:r><w:t>smart</w:t></w:r></w:smartTag><w:commentRangeStart w:id="0"/><w:r><w:commentReference w:id="0"/></w:r>'),
+}
+NOTES = (footnote(1, p('<w:r><w:footnoteRef/></w:r>' + r(' Note one ') + r('italic', '<w:i/>'), 'FootnoteText'))
+    + footnote(2, p(r('Two a')) + p(r('Two b') + '<w:hyperlink r:id="rId9"><w:r><w:t>link</w:t></w:r></w:hyperlink>'))
+    + footnote(3, p(r('never referenced'))))
+
+@pytest.mark.parametrize('case', sorted(CASES))
+@pytest.mark.parametrize('chunk_size', [10 ** 9, 1], ids=['one_chunk', 'small_chunks'])
+def test_same_as_mammoth(tmp_path, case, chunk_size):
+    f_name = str(tmp_path / (case + '.docx'))
+    write_docx(f_name, CASES[case], NOTES)
+    chunks, notes = reader_html(f_name, chunk_size)
+    assert ''.join(chunks) + notes == mammoth_html(f_name)
+    #chunks are cut before h1 tags only
+    assert all(chunk.startswith('<h1>') for chunk in chunks[1:])
+
+def unsupported_cases():
+    """
+    An element of UNSUPPORTED_ELEMENTS in a run, and the other things mammoth does that the reader doesn't
+    returns {name: (body, notes, extra files)}
+    """
+    cases = dict(('element_' + name.replace(':', '_'), (HEADING + p('<w:r><%s%s/></w:r>' % (name, ELEMENT_ATTRIBUTES.get(name, ''))), '', None))
+        for name in sorted(UNSUPPORTED_ELEMENTS))
+    cases['list'] = (HEADING + p(r('item'), None, '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'), '', None)
+    cases['list_style'] = (HEADING + p(r('item'), 'ListPara'), '', None)
+    cases['deleted_paragraph'] = (HEADING + p(r('gone'), None, '<w:rPr><w:del/></w:rPr>') + p(r('kept')), '', None)
+    cases['note_in_note'] = (HEADING + p(r('text') + reference(1)), footnote(1, p(r('note') + reference(2))) + footnote(2, p(r('inner'))), None)
+    cases['style_map'] = (HEADING + p(r('quoted'), 'Quote'), '', {'mammoth/style-map': "p[style-name='Quote'] => blockquote"})
+    return cases
+
+UNSUPPORTED_CASES = unsupported_cases()
+#the html mammoth makes of these can't be made into chapters either, both ways fail the same
+NOT_CONVERTIBLE = frozenset(['note_in_note'])
+
+@pytest.mark.parametrize('case', sorted(UNSUPPORTED_CASES))
+def test_unsupported(tmp_path, case):
+    body, notes, extra = UNSUPPORTED_CASES[case]
+    f_name = str(tmp_path / (case + '.docx'))
+    write_docx(f_name, body, notes, extra)
+    with pytest.raises(UnsupportedDocument):
+        reader_html(f_name, 10 ** 9)
+    #convert_file falls back to mammoth
+    if(case in NOT_CONVERTIBLE):
+        with pytest.raises(Exception) as fast:
+            convert_file(f_name, {'docx_fast_path': True})
+        with pytest.raises(Exception) as with_mammoth:
+            convert_file(f_name, {'docx_fast_path': False})
+        assert str(fast.value) == str(with_mammoth.value)
+        return
+    fast = convert_file(f_name, {'docx_fast_path': True})
+    with_mammoth = convert_file(f_name, {'docx_fast_path': False})
+    assert [(c.title, c.slug, c.html) for c in fast['chapters']] == [(c.title, c.slug, c.html) for c in with_mammoth['chapters']]
+    assert (fast['footer'], fast['footnote_num']) == (with_mammoth['footer'], with_mammoth['footnote_num'])
+
+def test_archive_closed_when_unsupported(tmp_path, monkeypatch):
+    f_name = str(tmp_path / 'style_map.docx')
+    write_docx(f_name, HEADING, '', {'mammoth/style-map': "p => p"})
+    archives = []
+    class RecordingZipFile(zipfile.ZipFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            archives.append(self)
+    monkeypatch.setattr(zipfile, 'ZipFile', RecordingZipFile)
+    with pytest.raises(UnsupportedDocument):
+        DocxHtmlReader(f_name)
+    assert archives and all(archive.fp is None for archive in archives)
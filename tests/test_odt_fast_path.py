@@ -0,0 +1,111 @@
+############################################
+# ChapterODF2XHTML (the odt fast path) makes the same chapters as converting the odt with BeautifulSoup
+#
+import os
+import pytest
+from odf.opendocument import OpenDocumentText
+from odf.style import Style, TextProperties
+from odf.text import H, P, Span, S, Tab, LineBreak, Note, NoteCitation, NoteBody, List, ListItem
+from conftest import example_documents
+from conversion_pool import convert_file
+from standard_open_files_as_html import open_odt_chapters, UnsupportedDocument
+
+#examples the fast path doesn't handle (a footnote before the first h1), they are converted with BeautifulSoup either way
+FALLBACK_EXAMPLES = ['example2.odt']
+
+def both_paths(f_name, blockquotes_enabled=True):
+    fast = convert_file(f_name, {'odt_fast_path': True, 'blockquotes_enabled': blockquotes_enabled})
+    soup = convert_file(f_name, {'odt_fast_path': False, 'blockquotes_enabled': blockquotes_enabled})
+    def plain(result):
+        return [[c.title, c.slug, c.html] for c in result['chapters']], result['footer'], result['footnote_num']
+    return plain(fast), plain(soup)
+
+def takes_fast_path(f_name, blockquotes_enabled=True):
+    """
+    Whether convert_file really uses ChapterODF2XHTML for the file, otherwise the parity tests would compare BeautifulSoup with itself
+    """
+    try:
+        open_odt_chapters(f_name, blockquotes_enabled)
+    except UnsupportedDocument:
+        return False
+    return True
+
+def text_style(doc, name, **properties):
+    style = Style(name=name, family='text')
+    style.addElement(TextProperties(**properties))
+    doc.automaticstyles.addElement(style)
+    return style
+
+def note(num, text):
+    element = Note(id='ftn%d' % num, noteclass='footnote')
+    element.addElement(NoteCitation(text=str(num)))
+    body = NoteBody()
+    body.addElement(P(text=text))
+    element.addElement(body)
+    return element
+
+def write_constructs_odt(f_name, headings=True):
+    """
+    An odt with footnotes, text:s, tabs, line breaks, nested spans, bold in headings, lists, two chapters with the
+    same title, bold chapter titles, a [[ ]] blockquote and a story break. If headings is False the chapter titles are bold paragraphs
+    """
+    doc = OpenDocumentText()
+    bold = text_style(doc, 'T_bold', fontweight='bold')
+    italic = text_style(doc, 'T_italic', fontstyle='italic')
+    def title(text):
+        if(headings):
+            heading = H(outlinelevel=1)
+            heading.addElement(Span(stylename=bold, text=text))
+            return heading
+        paragraph = P()
+        paragraph.addElement(Span(stylename=bold, text=text))
+        return paragraph
+    num = 0
+    for chapter in ['One', 'Two', 'One']:
+        doc.text.addElement(title(chapter))
+        paragraph = P()
+        paragraph.addText('spaces')
+        paragraph.addElement(S(c=3))
+        paragraph.addText('and')
+        paragraph.addElement(Tab())
+        paragraph.addText('tab & <escaped>')
+        paragraph.addElement(LineBreak())
+        outer = Span(stylename=italic, text='outer ')
+        #without headings every bold text is a chapter title
+        outer.addElement(Span(stylename=bold if headings else italic, text='inner'))
+        paragraph.addElement(outer)
+        num += 1
+        paragraph.addElement(note(num, 'note %d of %s' % (num, chapter)))
+        paragraph.addText(' end.')
+        doc.text.addElement(paragraph)
+        items = List()
+        for text in ['first', 'second']:
+            item = ListItem()
+            item.addElement(P(text=text))
+            items.addElement(item)
+        doc.text.addElement(items)
+        doc.text.addElement(P(text='[[quoted'))
+        doc.text.addElement(P(text='still quoted]]'))
+        doc.text.addElement(P(text='***'))
+        doc.text.addElement(P(text='after the break'))
+        doc.text.addElement(P())
+    doc.save(f_name)
+
+@pytest.mark.parametrize('f_name', example_documents(), ids=os.path.basename)
+def test_examples(f_name):
+    fast, soup = both_paths(f_name)
+    assert fast == soup
+    assert takes_fast_path(f_name) == (os.path.basename(f_name) not in FALLBACK_EXAMPLES)
+
+@pytest.mark.parametrize('headings', [True, False], ids=['headings', 'bold_titles'])
+@pytest.mark.parametrize('blockquotes_enabled', [True, False], ids=['blockquotes', 'no_blockquotes'])
+def test_constructs(tmp_path, headings, blockquotes_enabled):
+    f_name = str(tmp_path / 'constructs.odt')
+    write_constructs_odt(f_name, headings)
+    fast, soup = both_paths(f_name, blockquotes_enabled)
+    assert fast == soup
+    #without h1 tags process_html looks for the titles, which the fast path leaves to BeautifulSoup
+    assert takes_fast_path(f_name, blockquotes_enabled) == headings
+    chapters, footer, footnote_num = fast
+    assert footnote_num == 3
+    assert [c[1] for c in chapters] == ['one', 'two', 'one']
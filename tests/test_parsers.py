@@ -0,0 +1,43 @@
+############################################
+# The chapters and footnotes of the example documents are the same with every html parser
+# (process_html_with_blockquotes, process_html, save_footers and split_chapters)
+#
+import os
+import pytest
+from bs4.builder import builder_registry
+from conftest import example_documents
+from standard_open_files_as_html import open_file_as_xhtml
+from parsing_libraries import (HTML_PARSER, HTML_PARSERS, process_html_with_blockquotes, process_html, save_footers,
+    split_chapters, find_footnote_markers)
+
+def convert(f_name, parser):
+    """
+    The chapters (title, slug, html) and the footer of f_name converted the way standard_to_epub used to, with parser
+    """
+    soup = open_file_as_xhtml(f_name, parser)
+    soup = process_html_with_blockquotes(soup, parser)
+    soup = process_html(soup, parser)
+    footer = None
+    if(soup.find(find_footnote_markers) is not None):
+        soup, footer, footnote_num = save_footers(soup)
+    chapters = [[c.title, c.slug, c.html] for c in split_chapters(soup)]
+    return chapters, footer
+
+def normalize(chapters):
+    """
+    html5lib moves the whitespace after the end of the document into the body, so the last chapter of a file
+    ends with a few more newlines than with the other parsers. That is the only difference, it is stripped here
+    """
+    if(chapters):
+        chapters[-1][2] = chapters[-1][2].rstrip()
+    return chapters
+
+@pytest.mark.parametrize('parser', [p for p in HTML_PARSERS if p != HTML_PARSER])
+@pytest.mark.parametrize('f_name', example_documents(), ids=os.path.basename)
+def test_same_chapters_with_every_parser(f_name, parser):
+    if(builder_registry.lookup(parser) is None):
+        pytest.skip(parser + ' is not installed')
+    expected_chapters, expected_footer = convert(f_name, HTML_PARSER)
+    chapters, footer = convert(f_name, parser)
+    assert normalize(chapters) == normalize(expected_chapters)
+    assert footer == expected_footer
@@ -0,0 +1,96 @@
+############################################
+# Long chapters split into continuation files (max_chapter_paragraphs): the links between the chapters
+# and the footnotes still work, blockquotes are not cut and only the first part of a chapter is in the table of contents
+#
+import json, zipfile, posixpath
+import pytest
+from bs4 import BeautifulSoup
+from odf.opendocument import OpenDocumentText
+from odf.text import H, P, Note, NoteCitation, NoteBody
+from standard_to_epub import build_book
+from parsing_libraries import get_footer_file_name
+
+PARAGRAPHS = 24 #in each long chapter
+QUOTE_EVERY = 5 #a three paragraph blockquote after every few paragraphs
+
+def write_book_odt(f_name):
+    """
+    Two long chapters with the same title (so the second one is renamed) and a short one,
+    every paragraph of the long ones has a footnote
+    """
+    doc = OpenDocumentText()
+    num = 0
+    quotes = 0
+    for title, paragraphs in [('Long', PARAGRAPHS), ('Long', PARAGRAPHS), ('Short', 1)]:
+        doc.text.addElement(H(outlinelevel=1, text=title))
+        for i in range(paragraphs):
+            num += 1
+            paragraph = P(text='Paragraph %d of %s' % (i, title))
+            note = Note(id='ftn%d' % num, noteclass='footnote')
+            note.addElement(NoteCitation(text=str(num)))
+            body = NoteBody()
+            body.addElement(P(text='Note %d' % num))
+            note.addElement(body)
+            paragraph.addElement(note)
+            doc.text.addElement(paragraph)
+            if(i % QUOTE_EVERY == QUOTE_EVERY - 1):
+                quotes += 1
+                for text in ['[[quote begins', 'quote goes on', 'quote ends]]']:
+                    doc.text.addElement(P(text=text))
+            if(i == PARAGRAPHS // 2):
+                doc.text.addElement(P(text='***'))
+    doc.save(f_name)
+    return num, quotes
+
+def build(tmp_path, streaming):
+    notes, quotes = write_book_odt(str(tmp_path / 'book.odt'))
+    data_file = str(tmp_path / 'book.json')
+    with open(data_file, 'w') as open_f:
+        json.dump({'authors': ['John McAuthor'], 'title': 'Split', 'id': '1234567890', 'output_file_name': 'split.epub',
+            'files': ['book.odt'], 'max_chapter_paragraphs': 5, 'streaming': streaming, 'cache_enabled': False}, open_f)
+    return build_book(data_file), notes, quotes
+
+def read_epub(epub_file):
+    """
+    returns the soup of every html file of the epub by its path, the paths in the spine and the paths in the nav
+    """
+    with zipfile.ZipFile(epub_file) as open_zip:
+        opf_path = BeautifulSoup(open_zip.read('META-INF/container.xml'), 'xml').find('rootfile')['full-path']
+        folder = posixpath.dirname(opf_path)
+        opf = BeautifulSoup(open_zip.read(opf_path), 'xml')
+        paths = dict((item['id'], posixpath.join(folder, item['href'])) for item in opf.find_all('item'))
+        spine = [paths[itemref['idref']] for itemref in opf.find_all('itemref')]
+        files = dict((name, BeautifulSoup(open_zip.read(name), 'html.parser')) for name in open_zip.namelist() if name.endswith('.xhtml'))
+    nav_path = posixpath.join(folder, 'nav.xhtml')
+    nav = [posixpath.join(folder, a['href'].split('#')[0]) for a in files[nav_path].find_all('a', href=True)]
+    return files, spine, nav
+
+@pytest.mark.parametrize('streaming', [False, True], ids=['write_epub', 'streaming'])
+def test_split_chapters(tmp_path, streaming):
+    epub_file, notes, quotes = build(tmp_path, streaming)
+    files, spine, nav = read_epub(epub_file)
+    folder = posixpath.dirname(spine[0])
+    footer_path = posixpath.join(folder, get_footer_file_name())
+    chapters = [path for path in spine if path not in (footer_path, posixpath.join(folder, 'nav.xhtml'))]
+    #both long chapters are split, the second one is renamed and its parts after it
+    parts = [posixpath.basename(path) for path in chapters if '-part-' in path]
+    assert 'long-part-2.xhtml' in parts and 'long-2-part-2.xhtml' in parts
+    #continuation files are in the spine but not in the table of contents
+    assert nav == [posixpath.join(folder, name) for name in ['long.xhtml', 'long-2.xhtml', 'short.xhtml']]
+    assert len(chapters) == 3 + len(parts)
+    ids = dict((path, set(tag['id'] for tag in soup.find_all(id=True))) for path, soup in files.items())
+    def resolves(path, href):
+        target, anchor = href.split('#')
+        target = posixpath.join(posixpath.dirname(path), target) if target else path
+        return anchor in ids.get(target, ())
+    #every footnote marker points to its footnote and every footnote back to its marker
+    markers = [(path, a['href']) for path in chapters for a in files[path].find_all('a', href=True)]
+    back_links = [(footer_path, a['href']) for a in files[footer_path].find_all('a', href=True)]
+    assert len(markers) == len(back_links) == notes
+    assert all(href.startswith(get_footer_file_name() + '#') for path, href in markers)
+    assert [href for path, href in markers if not resolves(path, href)] == []
+    assert [href for path, href in back_links if not resolves(path, href)] == []
+    #blockquotes are whole
+    blockquotes = [blockquote for path in chapters for blockquote in files[path].find_all('blockquote')]
+    assert len(blockquotes) == quotes
+    assert all(len(blockquote.find_all('p')) == 3 for blockquote in blockquotes)
@@ -0,0 +1,69 @@
+############################################
+# Stylesheets of the loose files and the footer: each content is in the epub once, and every link
+# (css or defined_css, whatever file added the stylesheet) points to a stylesheet that is in the epub
+#
+import os, json, zipfile, posixpath
+from bs4 import BeautifulSoup
+from odf.opendocument import OpenDocumentText
+from odf.text import H, P, Note, NoteCitation, NoteBody
+from standard_to_epub import build_book
+from parsing_libraries import get_footer_file_name
+
+SAME = 'p { color: red; }'
+OTHER = 'p { color: blue; }'
+
+def write_book_odt(f_name):
+    doc = OpenDocumentText()
+    doc.text.addElement(H(outlinelevel=1, text='Chapter'))
+    paragraph = P(text='Text')
+    note = Note(id='ftn1', noteclass='footnote')
+    note.addElement(NoteCitation(text='1'))
+    body = NoteBody()
+    body.addElement(P(text='Note'))
+    note.addElement(body)
+    paragraph.addElement(note)
+    doc.text.addElement(paragraph)
+    doc.save(f_name)
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as open_f:
+        open_f.write(text)
+
+def build(tmp_path):
+    write_book_odt(str(tmp_path / 'book.odt'))
+    #same.css has the content of first.css, other/first.css has the name of first.css
+    write(str(tmp_path / 'first.css'), SAME)
+    write(str(tmp_path / 'same.css'), SAME)
+    write(str(tmp_path / 'other' / 'first.css'), OTHER)
+    for name in ['intro', 'outro']:
+        write(str(tmp_path / (name + '.xhtml')), '<html><body><p>%s</p></body></html>' % name)
+    data_file = str(tmp_path / 'book.json')
+    with open(data_file, 'w') as open_f:
+        json.dump({'authors': ['John McAuthor'], 'title': 'Styles', 'id': '1234567890', 'output_file_name': 'styles.epub',
+            'files': ['book.odt'], 'cache_enabled': False,
+            #the footer names same.css before the loose file that adds it
+            'footer_defined_css': ['same.css', 'first.css'],
+            'intro_loose_files': [{'file': 'intro.xhtml', 'name': 'intro', 'ext': 'xhtml', 'css': ['first.css', 'same.css']}],
+            'outro_loose_files': [{'file': 'outro.xhtml', 'name': 'outro', 'ext': 'xhtml', 'css': ['other/first.css'],
+                'defined_css': ['same.css', 'content.css']}]}, open_f)
+    return build_book(data_file)
+
+def test_defined_css(tmp_path):
+    with zipfile.ZipFile(build(tmp_path)) as open_zip:
+        opf_path = BeautifulSoup(open_zip.read('META-INF/container.xml'), 'xml').find('rootfile')['full-path']
+        folder = posixpath.dirname(opf_path)
+        names = set(open_zip.namelist())
+        stylesheets = dict((name, open_zip.read(name).decode('utf-8')) for name in names if name.endswith('.css'))
+        def links(name):
+            soup = BeautifulSoup(open_zip.read(posixpath.join(folder, name)), 'html.parser')
+            return [link['href'] for link in soup.find_all('link', rel='stylesheet')]
+        intro, outro, footer = links('intro.xhtml'), links('outro.xhtml'), links(get_footer_file_name())
+    #the content of first.css and same.css is in the epub once
+    assert [name for name, css in stylesheets.items() if 'red' in css] == [posixpath.join(folder, 'style/first.css')]
+    assert intro == ['style/first.css', 'style/first.css']
+    assert footer == ['style/first.css', 'style/first.css']
+    assert outro[1:] == ['style/first.css', 'style/content.css']
+    assert outro[0] != 'style/first.css' and 'blue' in stylesheets[posixpath.join(folder, outro[0])]
+    for href in intro + outro + footer:
+        assert posixpath.join(folder, href) in names
@@ -0,0 +1,32 @@
+############################################
+# whitelist, blacklist and filter_chapters: titles match exactly (whatever is in them), patterns are regular expressions
+#
+from parsing_libraries import Chapter, compile_title_filter, whitelist, blacklist, filter_chapters
+
+TITLES = ['Prologue', 'Part 1', 'Part 2', 'Part 10', 'glob:Part *', 're:^Part', 'Epilogue']
+
+def chapters():
+    return [Chapter(title, '<h1>%s</h1>' % title) for title in TITLES]
+
+def titles(chapters):
+    return [chapter.title for chapter in chapters]
+
+def test_titles_are_exact():
+    #what used to be glob: and re: prefixes are part of the title like anything else
+    matches = compile_title_filter(['glob:Part *', 're:^Part', 'Part 1'])
+    assert [title for title in TITLES if matches(title)] == ['Part 1', 'glob:Part *', 're:^Part']
+    assert titles(blacklist(chapters(), ['glob:Part *'])) == [title for title in TITLES if title != 'glob:Part *']
+    assert titles(whitelist(chapters(), ['re:^Part'])) == ['re:^Part']
+
+def test_patterns():
+    assert titles(whitelist(chapters(), [], [r'^Part \d+$'])) == ['Part 1', 'Part 2', 'Part 10']
+    assert titles(whitelist(chapters(), ['Prologue'], [r'^Part \d$'])) == ['Prologue', 'Part 1', 'Part 2']
+    assert titles(blacklist(chapters(), ['Epilogue'], ['logue$', r'\d\d'])) == ['Part 1', 'Part 2', 'glob:Part *', 're:^Part']
+
+def test_filter_chapters():
+    kept = filter_chapters(chapters(), [], ['Part 2'], [], ['^(glob|re):'])
+    assert titles(kept) == ['Prologue', 'Part 1', 'Part 10', 'Epilogue']
+    kept = filter_chapters(chapters(), [], ['Part 2'], ['^Part'], [])
+    assert titles(kept) == ['Part 1', 'Part 10']
+    #nothing to whitelist or blacklist keeps every chapter
+    assert titles(filter_chapters(chapters(), [], [])) == TITLES